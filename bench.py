@@ -0,0 +1,954 @@
+#!/usr/bin/env python
+""" Benchmarks for the kdtree package
+
+Run all benchmarks with
+
+    python bench.py
+
+or only some of them by giving their names, eg
+
+    python bench.py create --sizes 100000 1000000
+
+The results can be written to a JSON file with --json, and compared to
+those of an earlier run with --compare, eg for the whole suite
+
+    python bench.py suite --sizes 1000 10000 100000 1000000 --json new.json \
+        --compare old.json
+"""
+
+from __future__ import print_function
+
+import argparse
+import gc
+import heapq
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import pickle
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import OrderedDict
+
+import kdtree
+
+
+BENCHMARKS = OrderedDict()
+
+# the results of report(), in the order they were reported
+RESULTS = []
+
+
+def benchmark(func):
+    """ Registers a benchmark function under its name """
+    BENCHMARKS[func.__name__] = func
+    return func
+
+
+def timed(func, *args, **kwargs):
+    """ Returns the time it takes to call func, and its result """
+
+    gc.collect()
+    start = time.time()
+    result = func(*args, **kwargs)
+    return time.time() - start, result
+
+
+def report(name, size, seconds, baseline=None):
+    line = '%-40s %10d %10.3fs' % (name, size, seconds)
+    if baseline is not None:
+        line += ' %8.1fx' % (baseline / seconds)
+    print(line)
+    RESULTS.append(OrderedDict([('name', name), ('size', size),
+                                ('seconds', seconds),
+                                ('baseline', baseline)]))
+
+
+def random_points(n, dimensions=3):
+    return [tuple(random.random() for _ in range(dimensions))
+            for _ in range(n)]
+
+
+def clustered_points(n, dimensions=3, clusters=10, spread=0.01):
+    """ Points normally distributed around a few random centers """
+
+    centers = random_points(clusters, dimensions)
+    return [tuple(random.gauss(c, spread) for c in random.choice(centers))
+            for _ in range(n)]
+
+
+def sorted_points(n, dimensions=3, offset=0):
+    """ Random points sorted by their first coordinate, which is shifted by
+    offset """
+
+    points = sorted(random_points(n, dimensions))
+    return [(p[0] + offset, ) + p[1:] for p in points]
+
+
+class LegacyNode(object):
+    """ A node that stores its attributes like KDNode did before it had
+    __slots__ and a shared TreeConfig """
+
+    def __init__(self, data=None, left=None, right=None, axis=None,
+                 sel_axis=None, dimensions=None):
+        self.data = data
+        self.left = left
+        self.right = right
+        self.axis = axis
+        self.sel_axis = sel_axis
+        self.dimensions = dimensions
+
+
+def create_resorting(point_list, dimensions, axis=0, node=kdtree.KDNode):
+    """ The create() algorithm that re-sorts the points on every level """
+
+    sel_axis = lambda a: (a + 1) % dimensions
+    if not point_list:
+        return node(axis=axis, dimensions=dimensions, sel_axis=sel_axis)
+
+    point_list = list(point_list)
+    point_list.sort(key=lambda point: point[axis])
+    median = len(point_list) // 2
+    child_axis = sel_axis(axis)
+
+    return node(point_list[median],
+            create_resorting(point_list[:median], dimensions, child_axis, node),
+            create_resorting(point_list[median + 1:], dimensions, child_axis,
+                             node),
+            axis=axis, dimensions=dimensions, sel_axis=sel_axis)
+
+
+def search_node_recursive(node, point, k, results, get_dist, counter,
+                          stats=None):
+    """ The recursive kNN search that KDNode used before it had a stack,
+    which prunes with the distance to the splitting plane only """
+
+    if not node:
+        return
+
+    if stats is not None:
+        stats.nodes_visited += 1
+
+    node_dist = get_dist(node)
+    item = (-node_dist, next(counter), node)
+    if len(results) >= k:
+        if -node_dist > results[0][0]:
+            heapq.heapreplace(results, item)
+    else:
+        heapq.heappush(results, item)
+
+    for member in node.bucket or ():
+        member_dist = get_dist(member)
+        if len(results) >= k:
+            if member_dist < -results[0][0]:
+                heapq.heapreplace(results, (-member_dist, next(counter), member))
+        else:
+            heapq.heappush(results, (-member_dist, next(counter), member))
+
+    plane_dist = point[node.axis] - node.data[node.axis]
+    if plane_dist < 0:
+        near, far = node.left, node.right
+    else:
+        near, far = node.right, node.left
+
+    if near is not None:
+        search_node_recursive(near, point, k, results, get_dist, counter,
+                              stats)
+    if -plane_dist * plane_dist > results[0][0] or len(results) < k:
+        if far is not None:
+            search_node_recursive(far, point, k, results, get_dist, counter,
+                                  stats)
+
+
+def search_knn_recursive(tree, point, k, stats=None):
+    results = []
+    search_node_recursive(tree, point, k, results, lambda n: n.dist(point),
+                          itertools.count(), stats)
+    return [(node, -d) for d, _, node in sorted(results, reverse=True)]
+
+
+def search_nn_dist_recursive(node, point, dist, results):
+    """ The recursive radius search that KDNode used before """
+
+    if not node:
+        return
+
+    if node.dist(point) < dist:
+        results.append(node.data)
+    for member in node.bucket or ():
+        if member.dist(point) < dist:
+            results.append(member.data)
+
+    split_plane = node.data[node.axis]
+    if point[node.axis] <= split_plane + dist and node.left is not None:
+        search_nn_dist_recursive(node.left, point, dist, results)
+    if point[node.axis] >= split_plane - dist and node.right is not None:
+        search_nn_dist_recursive(node.right, point, dist, results)
+
+
+def extreme_child_scanning(self, sel_func, axis):
+    """ The extreme_child() that KDNode used before, which scans the whole
+    subtree """
+
+    max_key = lambda child_parent: child_parent[0].data[axis]
+
+    me = [(self, None)] if self else []
+    me += [(n, self) for n in self.bucket or ()]
+
+    child_max = [c.extreme_child(sel_func, axis) for c, _ in self.children]
+    child_max = [(c, p if p is not None else self) for c, p in child_max]
+
+    candidates = me + child_max
+    if not candidates:
+        return None, None
+
+    return sel_func(candidates, key=max_key)
+
+
+def degenerate_tree(size, dimensions=3):
+    """ A tree that is a single chain of nodes, as built by add() with
+    sorted points """
+
+    tree = kdtree.create(dimensions=dimensions)
+    node = tree
+    for i in range(size):
+        point = tuple(float(i) for _ in range(dimensions))
+        if node.data is None:
+            node.data = point
+        else:
+            node.right = node.create_subnode(point)
+            node = node.right
+    return tree
+
+
+@benchmark
+def create(sizes):
+    """ create() compared to re-sorting the points on every level """
+
+    for size in sizes:
+        points = random_points(size)
+        baseline, _ = timed(create_resorting, points, 3)
+        report('create (re-sorting)', size, baseline)
+        seconds, _ = timed(kdtree.create, points)
+        report('create', size, seconds, baseline)
+
+
+@benchmark
+def workers(sizes):
+    """ create() with the layout computed by 1 to N processes """
+
+    counts = [1]
+    while counts[-1] < multiprocessing.cpu_count():
+        counts.append(min(counts[-1] * 2, multiprocessing.cpu_count()))
+
+    for size in sizes:
+        points = random_points(size)
+        baseline = None
+        for count in counts:
+            seconds, _ = timed(kdtree.create, points, workers=count)
+            report('create, workers=%d' % count, size, seconds, baseline)
+            baseline = baseline or seconds
+
+
+@benchmark
+def leaf_size(sizes, queries=1000, k=10):
+    """ search_knn() on trees with different leaf sizes """
+
+    for size in sizes:
+        tree_points = random_points(size)
+        query_points = random_points(queries)
+        baseline = None
+        for leaf_size in (1, 4, 8, 16, 32):
+            tree = kdtree.create(tree_points, leaf_size=leaf_size)
+            seconds, _ = timed(lambda: [tree.search_knn(point, k)
+                                        for point in query_points])
+            report('search_knn, leaf_size=%d' % leaf_size, size, seconds,
+                   baseline)
+            baseline = baseline or seconds
+
+
+@benchmark
+def memory(sizes):
+    """ Memory used by the nodes of a tree, in bytes per point """
+
+    for size in sizes:
+        points = random_points(size)
+        for name, build in (
+                ('legacy nodes', lambda: create_resorting(points, 3,
+                                                          node=LegacyNode)),
+                ('create', lambda: kdtree.create(points)),
+                ('create, leaf_size=16', lambda: kdtree.create(
+                    points, leaf_size=16))):
+            gc.collect()
+            tracemalloc.start()
+            tree = build()
+            used = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            print('%-40s %10d %10.1f bytes/point' % (name, size,
+                                                     used / float(size)))
+            del tree
+
+
+@benchmark
+def search_kernels(sizes, queries=1000, k=10, degenerate_size=5000):
+    """ Iterative searches compared to the recursive ones they replace """
+
+    limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(max(limit, 2 * degenerate_size))
+    try:
+        trees = [('balanced', size, kdtree.create(random_points(size)))
+                 for size in sizes]
+        trees.append(('degenerate', degenerate_size,
+                      degenerate_tree(degenerate_size)))
+
+        for shape, size, tree in trees:
+            # every query visits all nodes of the degenerate tree
+            scale = size if shape == 'degenerate' else 1
+            count = queries // 10 if shape == 'degenerate' else queries
+            query_points = [tuple(scale * x for x in point)
+                            for point in random_points(count)]
+            radius = (scale * 0.05) ** 2
+
+            for name, search, baseline_search in (
+                    ('search_knn', lambda p: tree.search_knn(p, k),
+                     lambda p: search_knn_recursive(tree, p, k)),
+                    ('search_nn_dist', lambda p: tree.search_nn_dist(p, radius),
+                     lambda p: search_nn_dist_recursive(tree, p, radius, []))):
+                baseline, _ = timed(lambda: [baseline_search(p)
+                                             for p in query_points])
+                report('%s recursive, %s' % (name, shape), size, baseline)
+                seconds, _ = timed(lambda: [search(p) for p in query_points])
+                report('%s, %s' % (name, shape), size, seconds, baseline)
+    finally:
+        sys.setrecursionlimit(limit)
+
+
+@benchmark
+def pruning(sizes, queries=200, k=10):
+    """ Nodes visited by search_knn(), plane vs region distance pruning """
+
+    for size in sizes:
+        for dimensions in (3, 5, 8):
+            for distribution, make_points in (('uniform', random_points),
+                                              ('clustered', clustered_points)):
+                points = make_points(size + queries, dimensions)
+                tree = kdtree.create(points[:size])
+                plane, region = kdtree.SearchStats(), kdtree.SearchStats()
+                for point in points[size:]:
+                    search_knn_recursive(tree, point, k, plane)
+                    tree.search_knn(point, k, stats=region)
+                print('%-40s %10d %10.1f %10.1f visits/query %6.2fx' % (
+                    '%s, d=%d' % (distribution, dimensions), size,
+                    plane.nodes_visited / float(queries),
+                    region.nodes_visited / float(queries),
+                    plane.nodes_visited / float(region.nodes_visited)))
+
+
+@benchmark
+def approximate(sizes, queries=200, k=10, dimensions=8):
+    """ Approximate search_knn(), time and recall for eps and max_visits """
+
+    for size in sizes:
+        points = random_points(size + queries, dimensions)
+        tree = kdtree.create(points[:size])
+        query_points = points[size:]
+        baseline, expected = timed(lambda: [tree.search_knn(p, k)
+                                            for p in query_points])
+        report('exact', size, baseline)
+
+        for name, options in (('eps=0.5', dict(eps=0.5)),
+                              ('eps=1', dict(eps=1)),
+                              ('eps=2', dict(eps=2)),
+                              ('max_visits=%d' % (k * 50),
+                               dict(max_visits=k * 50))):
+            seconds, found = timed(lambda: [tree.search_knn(p, k, **options)
+                                            for p in query_points])
+            hits = sum(len(set(n.data for n, _ in a) &
+                           set(n.data for n, _ in b))
+                       for a, b in zip(expected, found))
+            report(name, size, seconds, baseline)
+            print('%-40s %10s %10.3f recall' % ('', '',
+                                               hits / float(k * queries)))
+
+
+@benchmark
+def metrics(sizes, queries=200, k=10):
+    """ search_knn() with Metric objects and with plain distance functions """
+
+    # Plain functions are pruned with squared euclidean bounds. In the unit
+    # cube, these prune too little for Manhattan and Chebyshev, and too much
+    # for Minkowski(3), which misses neighbors.
+    for size in sizes:
+        points = random_points(size)
+        tree = kdtree.create(points)
+        query_points = random_points(queries)
+        for metric in (kdtree.SquaredEuclidean(), kdtree.Manhattan(),
+                       kdtree.Chebyshev(), kdtree.Minkowski(3),
+                       kdtree.WeightedEuclidean((1, 2, 4))):
+            exact = [tree.search_knn(p, k, dist=metric) for p in query_points]
+            function = lambda a, b: metric.dist(a, b)
+            baseline, approx = timed(lambda: [
+                tree.search_knn(p, k, dist=function) for p in query_points])
+            correct = sum(e[-1][1] == a[-1][1] for e, a in zip(exact, approx))
+            report('%r as function, %d%% exact' %
+                   (metric, 100 * correct // queries), size, baseline)
+            seconds, _ = timed(lambda: [tree.search_knn(p, k, dist=metric)
+                                        for p in query_points])
+            report('%r' % metric, size, seconds, baseline)
+
+
+@benchmark
+def box(sizes, queries=100, width=0.1, dimensions=2):
+    """ Box queries compared to filtering a radius search """
+
+    for size in sizes:
+        tree = kdtree.create(random_points(size, dimensions))
+        boxes = []
+        for lower in random_points(queries, dimensions):
+            boxes.append((lower, tuple(x + width for x in lower)))
+
+        def search_radius(lower, upper):
+            center = tuple((l + u) / 2. for l, u in zip(lower, upper))
+            # search_nn_dist() compares squared distances to the radius,
+            # but prunes with unsquared ones, so it needs the larger one
+            radius = sum(((u - l) / 2.) ** 2 for l, u in zip(lower, upper))
+            radius = max(radius, math.sqrt(radius))
+            return [p for p in tree.search_nn_dist(center, radius)
+                    if all(l <= x <= u for l, x, u in zip(lower, p, upper))]
+
+        baseline, _ = timed(lambda: [search_radius(*b) for b in boxes])
+        report('search_nn_dist and filter', size, baseline)
+        seconds, _ = timed(lambda: [tree.search_box(*b) for b in boxes])
+        report('search_box', size, seconds, baseline)
+        seconds, _ = timed(lambda: [tree.count_box(*b) for b in boxes])
+        report('count_box', size, seconds, baseline)
+
+
+@benchmark
+def iter_nearest(sizes, queries=200, k=10, accepted=0.05):
+    """ Filtered nearest neighbors, iter_nearest() vs growing k """
+
+    for size in sizes:
+        tree = kdtree.create(random_points(size))
+        query_points = random_points(queries)
+        keep = lambda node: hash(node.data) % 1000 < accepted * 1000
+
+        def search_growing(point):
+            n = k
+            while True:
+                result = [r for r in tree.search_knn(point, n) if keep(r[0])]
+                if len(result) >= k or n >= size:
+                    return result[:k]
+                n *= 2
+
+        def search_iter(point):
+            return list(itertools.islice((r for r in tree.iter_nearest(point)
+                                          if keep(r[0])), k))
+
+        baseline, _ = timed(lambda: [search_growing(p) for p in query_points])
+        report('search_knn, doubling k', size, baseline)
+        seconds, _ = timed(lambda: [search_iter(p) for p in query_points])
+        report('iter_nearest', size, seconds, baseline)
+
+
+@benchmark
+def frozen(sizes, queries=1000, k=10):
+    """ Trees frozen into shared memory, attaching and searching """
+
+    for size in sizes:
+        points = random_points(size)
+        baseline, tree = timed(kdtree.create, points)
+        report('create', size, baseline)
+        seconds, shared = timed(tree.freeze, shared=True)
+        report('freeze, shared memory', size, seconds)
+        try:
+            seconds, attached = timed(kdtree.attach, shared.name)
+            report('attach', size, seconds, baseline)
+
+            query_points = random_points(queries)
+            baseline, _ = timed(lambda: [tree.search_knn(p, k)
+                                         for p in query_points])
+            report('search_knn', size, baseline)
+            seconds, _ = timed(lambda: [attached.search_knn(p, k)
+                                        for p in query_points])
+            report('search_knn, attached', size, seconds, baseline)
+            attached.close()
+        finally:
+            shared.close()
+            shared.unlink()
+
+
+@benchmark
+def save_load(sizes):
+    """ Saving and loading trees, compared to pickle and rebuilding """
+
+    limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(max(limit, 10000))
+    fd, path = tempfile.mkstemp()
+    os.close(fd)
+    try:
+        for size in sizes:
+            points = random_points(size)
+            baseline, tree = timed(kdtree.create, points)
+            report('create', size, baseline)
+
+            seconds, pickled = timed(pickle.dumps, tree, -1)
+            report('pickle.dumps', size, seconds)
+            seconds, _ = timed(pickle.loads, pickled)
+            report('pickle.loads', size, seconds, baseline)
+            del pickled
+
+            seconds, _ = timed(tree.save, path)
+            report('save', size, seconds)
+            for mmap in (False, True):
+                seconds, loaded = timed(kdtree.load, path, mmap=mmap)
+                report('load, mmap=%s' % mmap, size, seconds, baseline)
+                loaded.close()
+    finally:
+        os.remove(path)
+        sys.setrecursionlimit(limit)
+
+
+@benchmark
+def scapegoat(sizes, queries=1000, k=10, sorted_size=5000):
+    """ add() and search_knn() with and without alpha, random and sorted """
+
+    def height(tree):
+        # height() is recursive, which fails for the chain of sorted points
+        levels = 0
+        level = [tree]
+        while level:
+            levels += 1
+            level = [c for n in level for c in (n.left, n.right) if c]
+        return levels
+
+    limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(max(limit, 2 * sorted_size))
+    try:
+        query_points = random_points(queries)
+        inputs = [('random', random_points(size)) for size in sizes]
+        # without alpha, sorted points build a chain of nodes, each add()
+        # walks all of them
+        inputs.append(('sorted', [(i / float(sorted_size),) * 3
+                                  for i in range(sorted_size)]))
+
+        for order, points in inputs:
+            baseline = None
+            for alpha in (None, 0.6, 0.7, 0.8):
+                tree = kdtree.create(dimensions=3, alpha=alpha)
+                seconds, _ = timed(lambda: [tree.add(p) for p in points])
+                report('add, %s, alpha=%s, height %d' %
+                       (order, alpha, height(tree)),
+                       len(points), seconds, baseline)
+                baseline = baseline or seconds
+
+            tree = kdtree.create(points)
+            baseline, _ = timed(lambda: [tree.search_knn(p, k)
+                                         for p in query_points])
+            report('search_knn, %s, create()' % order, len(points), baseline)
+            for alpha in (None, 0.7):
+                tree = kdtree.create(dimensions=3, alpha=alpha)
+                for point in points:
+                    tree.add(point)
+                seconds, _ = timed(lambda: [tree.search_knn(p, k)
+                                            for p in query_points])
+                report('search_knn, %s, alpha=%s' % (order, alpha),
+                       len(points), seconds, baseline)
+    finally:
+        sys.setrecursionlimit(limit)
+
+
+@benchmark
+def remove(sizes, removals=10000, top=255):
+    """ remove() with the axis-aware extreme_child() compared to scanning """
+
+    for size in sizes:
+        points = random_points(size)
+        tree = kdtree.create(points)
+        # the nodes of the top levels have the largest subtrees to search
+        # for a replacement
+        inputs = (('random points', random.sample(points, removals)),
+                  ('top levels', [n.data for n in itertools.islice(
+                      kdtree.level_order(tree), top)]))
+
+        for name, targets in inputs:
+            def remove_all(tree):
+                for point in targets:
+                    tree = tree.remove(point)
+                return tree
+
+            baseline = None
+            for label, extreme_child in (
+                    ('scanning', extreme_child_scanning),
+                    ('axis-aware', kdtree.KDNode.extreme_child)):
+                tree = kdtree.create(points)
+                original = kdtree.KDNode.extreme_child
+                kdtree.KDNode.extreme_child = extreme_child
+                try:
+                    seconds, _ = timed(remove_all, tree)
+                finally:
+                    kdtree.KDNode.extreme_child = original
+                report('remove %s, %s' % (name, label), len(targets),
+                       seconds, baseline)
+                baseline = baseline or seconds
+
+
+@benchmark
+def forest(sizes, queries=1000, k=10):
+    """ Adding a stream of points to a KDNode and to a KDForest """
+
+    query_points = random_points(queries)
+    for size in sizes:
+        points = random_points(size)
+        for order, stream in (('random', points),
+                              ('sorted by x', sorted(points))):
+            baseline = search_baseline = None
+            for name, container in (
+                    ('KDNode', kdtree.create(dimensions=3)),
+                    ('KDNode, alpha=0.7', kdtree.create(dimensions=3,
+                                                       alpha=0.7)),
+                    ('KDForest', kdtree.KDForest(dimensions=3))):
+                seconds, _ = timed(lambda: [container.add(p) for p in stream])
+                report('add %s, %s' % (order, name), size, seconds, baseline)
+                baseline = baseline or seconds
+
+                seconds, _ = timed(lambda: [container.search_knn(p, k)
+                                            for p in query_points])
+                report('search_knn %s, %s' % (order, name), size, seconds,
+                       search_baseline)
+                search_baseline = search_baseline or seconds
+
+
+@benchmark
+def batch(sizes, fraction=0.1):
+    """ add_many() and remove_many() compared to add() and remove() loops """
+
+    for size in sizes:
+        points = random_points(size)
+        count = int(size * fraction)
+        for order, new_points in (('random', random_points(count)),
+                                  ('clustered', clustered_points(
+                                      count, clusters=1, spread=0.001))):
+            tree = kdtree.create(points)
+            baseline, _ = timed(lambda: [tree.add(p) for p in new_points])
+            report('add loop, %s, height %d' % (order, tree.height()),
+                   count, baseline)
+
+            tree = kdtree.create(points)
+            seconds, tree = timed(tree.add_many, new_points)
+            report('add_many, %s, height %d' % (order, tree.height()),
+                   count, seconds, baseline)
+
+        removals = random.sample(points, count)
+
+        def remove_all(tree):
+            for point in removals:
+                tree = tree.remove(point)
+            return tree
+
+        baseline, _ = timed(remove_all, kdtree.create(points))
+        report('remove loop', count, baseline)
+        seconds, _ = timed(kdtree.create(points).remove_many, removals)
+        report('remove_many', count, seconds, baseline)
+
+
+@benchmark
+def tombstones(sizes, removed=0.2, queries=1000, k=10):
+    """ remove() and search_knn() with and without max_dead """
+
+    for size in sizes:
+        points = random_points(size)
+        removals = random.sample(points, int(size * removed))
+        query_points = random_points(queries)
+
+        baseline = search_baseline = None
+        for max_dead in (None, 0.1, 0.25, 0.5):
+            tree = kdtree.create(points, max_dead=max_dead)
+
+            def remove_all(tree):
+                for point in removals:
+                    tree = tree.remove(point)
+                return tree
+
+            seconds, tree = timed(remove_all, tree)
+            report('remove, max_dead=%s' % max_dead, len(removals), seconds,
+                   baseline)
+            baseline = baseline or seconds
+
+            seconds, _ = timed(lambda: [tree.search_knn(p, k)
+                                        for p in query_points])
+            report('search_knn, max_dead=%s, dead %.2f' %
+                   (max_dead, tree.dead_ratio), size, seconds,
+                   search_baseline)
+            search_baseline = search_baseline or seconds
+
+
+def pow_distance(a, b):
+    """ The squared distance as KDNode.dist() computed it before it had
+    specialized kernels """
+    return sum([math.pow(a[i] - b[i], 2) for i in range(len(a))])
+
+
+@benchmark
+def kernels(sizes, queries=1000, k=10):
+    """ search_knn() with specialized squared distance kernels compared to
+    math.pow() per axis """
+
+    kernel_function = kdtree._squared_distance_function
+    for size in sizes:
+        for dimensions, array in ((2, False), (3, False), (8, False),
+                                  (8, True)):
+            if array and kdtree.np is None:
+                continue
+            points = random_points(size, dimensions)
+            query_points = random_points(queries, dimensions)
+            name = '%d-D' % dimensions
+            if array:
+                points = list(kdtree.np.array(points))
+                query_points = list(kdtree.np.array(query_points))
+                name += ' arrays'
+            tree = kdtree.create(points)
+
+            kdtree._squared_distance_function = lambda *a: pow_distance
+            try:
+                baseline, _ = timed(lambda: [tree.search_knn(p, k)
+                                             for p in query_points])
+            finally:
+                kdtree._squared_distance_function = kernel_function
+            report('search_knn, math.pow, %s' % name, size, baseline)
+
+            seconds, _ = timed(lambda: [tree.search_knn(p, k)
+                                        for p in query_points])
+            report('search_knn, %s' % kernel_function(
+                dimensions, query_points[0]).__name__, size, seconds,
+                baseline)
+
+
+@benchmark
+def cache(sizes, queries=10000, hot=100, k=10, cache_size=1000):
+    """ search_knn() for repeated query points with and without a cache """
+
+    for size in sizes:
+        points = random_points(size)
+        hot_points = random_points(hot)
+        query_points = [random.choice(hot_points) for _ in range(queries)]
+
+        baseline = None
+        for cache_size in (None, cache_size):
+            tree = kdtree.create(points, cache_size=cache_size)
+            seconds, _ = timed(lambda: [tree.search_knn(p, k)
+                                        for p in query_points])
+            name = 'search_knn, cache_size=%s' % cache_size
+            if cache_size:
+                name += ', hit rate %.2f' % tree.config.cache.hit_rate
+            report(name, size, seconds, baseline)
+            baseline = baseline or seconds
+
+
+@benchmark
+def suite(sizes, dimensions=(2, 3, 8, 16), updates=1000, queries=100,
+          brute_queries=10, k=10):
+    """ All operations for uniform, clustered and sorted points, searches
+    compared to brute force """
+
+    # Each tree gets updates points added and removed, at most a tenth of
+    # its size, before it is searched. Brute force is timed for
+    # brute_queries of the queries and scaled up.
+
+    distributions = (('uniform', random_points), ('clustered', clustered_points),
+                     ('sorted', sorted_points))
+
+    for size, d, (distribution, generate) in itertools.product(
+            sizes, dimensions, distributions):
+        name = lambda op: '%s, %d-D %s' % (op, d, distribution)
+        squared_distance = kdtree._squared_distance_function(d)
+
+        count = min(updates, size // 10)
+        points = generate(size, d)
+        seconds, tree = timed(kdtree.create, points)
+        report(name('create'), size, seconds)
+
+        # sorted points are added beyond the existing ones
+        new_points = generate(count, d) if distribution != 'sorted' else \
+            sorted_points(count, d, offset=1)
+        seconds, _ = timed(lambda: [tree.add(p) for p in new_points])
+        report(name('add %d' % count), size, seconds)
+
+        removals = random.sample(points, count)
+
+        def remove_all(tree):
+            for point in removals:
+                tree = tree.remove(point)
+            return tree
+
+        seconds, tree = timed(remove_all, tree)
+        report(name('remove %d' % count), size, seconds)
+        removed = set(removals)
+        points = [p for p in points if p not in removed] + new_points
+
+        query_points = generate(queries, d)
+        radii = [tree.search_knn(p, k)[-1][1] for p in query_points]
+        brute = query_points[:brute_queries]
+        scale = queries / float(len(brute))
+
+        searches = (
+            ('search_knn', lambda q, r: tree.search_knn(q, k),
+             lambda q, r: heapq.nsmallest(
+                 k, points, key=lambda p: squared_distance(p, q))),
+            ('search_nn', lambda q, r: tree.search_nn(q),
+             lambda q, r: min(points, key=lambda p: squared_distance(p, q))),
+            ('search_nn_dist', lambda q, r: tree.search_nn_dist(q, r),
+             lambda q, r: [p for p in points if squared_distance(p, q) < r]),
+        )
+        for op, search, brute_force in searches:
+            baseline, _ = timed(lambda: [brute_force(q, r)
+                                         for q, r in zip(brute, radii)])
+            baseline *= scale
+            report(name('%s, brute force' % op), size, baseline)
+            seconds, _ = timed(lambda: [search(q, r)
+                                        for q, r in zip(query_points, radii)])
+            report(name(op), size, seconds, baseline)
+
+        seconds, tree = timed(tree.rebalance)
+        report(name('rebalance'), size, seconds)
+
+
+def is_balanced_recursive(node):
+    """ The is_balanced that KDNode used before it kept the height of every
+    subtree, which computes the heights again for every node """
+
+    left_height = kdtree.Node.height(node.left) if node.left else 0
+    right_height = kdtree.Node.height(node.right) if node.right else 0
+
+    if abs(left_height - right_height) > 1:
+        return False
+
+    return all(is_balanced_recursive(c) for c, _ in node.children)
+
+
+@benchmark
+def balance_check(sizes):
+    """ is_balanced with cached heights compared to computing them """
+
+    # Node.height() only recurses through KDNode.height(), which now
+    # returns the cached height, so the old one is restored for the
+    # baseline
+    cached_height = kdtree.KDNode.height
+    for size in sizes:
+        tree = kdtree.create(random_points(size))
+
+        kdtree.KDNode.height = kdtree.Node.height
+        try:
+            baseline, _ = timed(is_balanced_recursive, tree)
+        finally:
+            kdtree.KDNode.height = cached_height
+        report('is_balanced, computing heights', size, baseline)
+
+        seconds, _ = timed(lambda: tree.is_balanced)
+        report('is_balanced, cached heights', size, seconds, baseline)
+
+
+@benchmark
+def max_cost(sizes, fraction=0.25, queries=1000, k=10):
+    """ Sorted updates with and without max_cost, search cost and stats() """
+
+    for size in sizes:
+        points = random_points(size)
+        # points along the diagonal beyond the others, which without
+        # rebuilding form a chain of nodes
+        count = int(size * fraction)
+        new_points = [(1 + i / float(count), ) * 3 for i in range(count)]
+        # half of the queries are among the added points
+        query_points = random_points(queries // 2) + \
+            [(1 + p[0], ) * 3 for p in random_points(queries // 2)]
+
+        baseline = search_baseline = None
+        for kwargs in ({}, {'alpha': 0.7}, {'max_cost': 2},
+                       {'max_cost': 1.2}):
+            name = ', '.join('%s=%s' % kv for kv in kwargs.items()) or \
+                'no rebuilding'
+            tree = kdtree.create(points, **kwargs)
+            seconds, _ = timed(lambda: [tree.add(p) for p in new_points])
+            report('add sorted, %s' % name, len(new_points), seconds,
+                   baseline)
+            baseline = baseline or seconds
+
+            seconds, stats = timed(tree.stats)
+            report('stats(), cost %.2f' % stats.cost, tree.size, seconds)
+
+            seconds, _ = timed(lambda: [tree.search_knn(p, k)
+                                        for p in query_points])
+            report('search_knn, %s' % name, tree.size, seconds,
+                   search_baseline)
+            search_baseline = search_baseline or seconds
+
+
+def compare(previous, results):
+    """ Prints the results that were also in the previous run, and how much
+    faster they are now """
+
+    times = dict(((benchmark, r['name'], r['size']), r['seconds'])
+                 for benchmark, records in previous['benchmarks'].items()
+                 for r in records)
+
+    print('Compared to the previous run')
+    for benchmark, records in results['benchmarks'].items():
+        for r in records:
+            before = times.get((benchmark, r['name'], r['size']))
+            if before is not None:
+                print('%-40s %10d %10.3fs %8.2fx' % (
+                    '%s: %s' % (benchmark, r['name']), r['size'],
+                    r['seconds'], before / r['seconds']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('names', nargs='*', metavar='benchmark',
+                        help='one of: ' + ', '.join(BENCHMARKS))
+    parser.add_argument('--sizes', nargs='+', type=int,
+                        default=[10 ** 5, 10 ** 6],
+                        help='numbers of points to benchmark with')
+    parser.add_argument('--json', metavar='PATH',
+                        help='write the results to a JSON file')
+    parser.add_argument('--compare', metavar='PATH',
+                        help='compare to the results in a JSON file')
+    args = parser.parse_args()
+
+    for name in args.names or BENCHMARKS:
+        if name not in BENCHMARKS:
+            parser.error('unknown benchmark %s' % name)
+
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+
+    results = OrderedDict([
+        ('python', platform.python_version()),
+        ('platform', platform.platform()),
+        ('numpy', kdtree.np is not None),
+        ('sizes', args.sizes),
+        ('benchmarks', OrderedDict()),
+    ])
+    for name in args.names or BENCHMARKS:
+        print(BENCHMARKS[name].__doc__.strip())
+        start = len(RESULTS)
+        BENCHMARKS[name](args.sizes)
+        results['benchmarks'][name] = RESULTS[start:]
+        print()
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if previous is not None:
+        compare(previous, results)
+
+
+if __name__ == '__main__':
+    main()
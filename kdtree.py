@@ -9,13 +9,30 @@ https://en.wikipedia.org/wiki/K-d_tree
 
 from __future__ import print_function
 
+import array
+import gc
 import heapq
 import itertools
 import operator
 import math
-from collections import deque
+import mmap as _mmap
+import struct
+import sys
+import time
+from collections import deque, OrderedDict
+from contextlib import contextmanager
 from functools import wraps
 
+try:
+    import numpy as np
+except ImportError:  # numpy is only required for FlatKDTree
+    np = None
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:  # Python < 3.8
+    shared_memory = None
+
 __author__ = u'Stefan Kögl <stefan@skoegl.net>'
 __version__ = '0.16'
 __website__ = 'https://github.com/stefankoegl/kdtree'
@@ -26,12 +43,20 @@ class Node(object):
     """ A Node in a kd-tree
 
     A tree is represented by its root node, and every node represents
-    its subtree"""
+    its subtree. A leaf can hold further nodes in its bucket, which are
+    part of the tree but have no position of their own.
+
+    Nodes use __slots__ to keep their memory footprint small. Additional
+    attributes can still be set on a node, but only nodes that actually
+    use them pay for an instance dict. """
+
+    __slots__ = ('data', 'left', 'right', 'bucket', '__dict__')
 
     def __init__(self, data=None, left=None, right=None):
         self.data = data
         self.left = left
         self.right = right
+        self.bucket = None
 
 
     @property
@@ -51,52 +76,60 @@ class Node(object):
     def preorder(self):
         """ iterator for nodes: root, left, right """
 
-        if not self:
-            return
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            if not node:
+                continue
 
-        yield self
+            yield node
 
-        if self.left:
-            for x in self.left.preorder():
+            for x in node.bucket or ():
                 yield x
 
-        if self.right:
-            for x in self.right.preorder():
-                yield x
+            stack.append(node.right)
+            stack.append(node.left)
 
 
     def inorder(self):
         """ iterator for nodes: left, root, right """
 
-        if not self:
-            return
-
-        if self.left:
-            for x in self.left.inorder():
-                yield x
+        stack = []
+        node = self or None
+        while stack or node is not None:
+            if node is not None:
+                stack.append(node)
+                node = node.left or None
+                continue
 
-        yield self
+            node = stack.pop()
+            yield node
 
-        if self.right:
-            for x in self.right.inorder():
+            for x in node.bucket or ():
                 yield x
 
+            node = node.right or None
+
 
     def postorder(self):
         """ iterator for nodes: left, right, root """
 
-        if not self:
-            return
+        stack = [(self, False)]
+        while stack:
+            node, visited = stack.pop()
+            if not node:
+                continue
 
-        if self.left:
-            for x in self.left.postorder():
-                yield x
+            if not visited:
+                stack.append((node, True))
+                stack.append((node.right, False))
+                stack.append((node.left, False))
+                continue
 
-        if self.right:
-            for x in self.right.postorder():
+            for x in node.bucket or ():
                 yield x
 
-        yield self
+            yield node
 
 
     @property
@@ -200,478 +233,3634 @@ def require_axis(f):
 
 
 
-class KDNode(Node):
-    """ A Node that contains kd-tree specific data and methods """
+class TreeConfig(object):
+    """ Settings that are shared by all nodes of a kd-tree
 
+    Instead of every node keeping its own reference to them, the nodes of
+    a tree refer to a single TreeConfig.
 
-    def __init__(self, data=None, left=None, right=None, axis=None,
-            sel_axis=None, dimensions=None):
-        """ Creates a new node for a kd-tree
+    version is increased by every change to the tree, which invalidates
+    the results in its QueryCache, if it has one.
 
-        If the node will be used within a tree, the axis and the sel_axis
-        function should be supplied.
+    For a tree with a max_cost (see create()), updates counts the points
+    added and removed since its cost was last checked, path_length is an
+    estimate of the sum of the numbers of nodes from the root to every
+    point, and max_path_length the largest path_length that keeps the cost
+    below max_cost. """
 
-        sel_axis(axis) is used when creating subnodes of the current node. It
-        receives the axis of the parent node and returns the axis of the child
-        node. """
-        super(KDNode, self).__init__(data, left, right)
-        self.axis = axis
-        self.sel_axis = sel_axis
+    __slots__ = ('dimensions', 'sel_axis', 'leaf_size', 'dist', 'alpha',
+                 'max_dead', 'version', 'cache', 'max_cost',
+                 'updates', 'path_length', 'max_path_length')
+
+    def __init__(self, dimensions=None, sel_axis=None, leaf_size=1,
+                 dist=None, alpha=None, max_dead=None, cache=None,
+                 max_cost=None):
         self.dimensions = dimensions
+        self.sel_axis = sel_axis
+        self.leaf_size = leaf_size
+        self.dist = dist
+        self.alpha = alpha
+        self.max_dead = max_dead
+        self.version = 0
+        self.cache = cache
+        self.max_cost = max_cost
+        self.updates = self.path_length = self.max_path_length = 0
 
 
-    @require_axis
-    def add(self, point):
-        """
-        Adds a point to the current node or iteratively
-        descends to one of its children.
+    def _changed(self):
+        """ Increases the version after a change to the tree
 
-        Users should call add() only to the topmost tree.
-        """
+        The results in the QueryCache are removed, as they are out of date,
+        and would keep removed nodes and replaced trees alive. """
 
-        current = self
-        while True:
-            check_dimensionality([point], dimensions=current.dimensions)
+        self.version += 1
+        if self.cache is not None:
+            self.cache.invalidate()
 
-            # Adding has hit an empty leaf-node, add here
-            if current.data is None:
-                current.data = point
-                return current
 
-            # split on self.axis, recurse either left or right
-            if point[current.axis] < current.data[current.axis]:
-                if current.left is None:
-                    current.left = current.create_subnode(point)
-                    return current.left
-                else:
-                    current = current.left
-            else:
-                if current.right is None:
-                    current.right = current.create_subnode(point)
-                    return current.right
-                else:
-                    current = current.right
+    def __repr__(self):
+        return '<%(cls)s - %(dims)s dimensions, leaf_size %(leaf_size)s>' % \
+            dict(cls=self.__class__.__name__, dims=self.dimensions,
+                 leaf_size=self.leaf_size)
 
 
-    @require_axis
-    def create_subnode(self, data):
-        """ Creates a subnode for the current node """
 
-        return self.__class__(data,
-                axis=self.sel_axis(self.axis),
-                sel_axis=self.sel_axis,
-                dimensions=self.dimensions)
+# the most precise clock for timing searches
+_clock = getattr(time, 'perf_counter', time.time)
 
 
-    @require_axis
-    def find_replacement(self):
-        """ Finds a replacement for the current node
+class SearchStats(object):
+    """ Counts the work done by searches
 
-        The replacement is returned as a
-        (replacement-node, replacements-parent-node) tuple """
+    An instance can be passed to a search as its stats argument. Counts of
+    several searches add up, which costs a few additions per search. A
+    single instance can therefore be passed to all searches and exported
+    with as_dict() or reset() from time to time.
 
-        if self.right:
-            child, parent = self.right.extreme_child(min, self.axis)
-        else:
-            child, parent = self.left.extreme_child(max, self.axis)
+    searches is the number of searches and seconds their wall time.
+    nodes_visited counts the nodes whose point and bucket were looked at,
+    and distance_evals the distances that were computed. Of the subtrees
+    that a search came across, subtrees_pruned were skipped because they
+    could not contain a result, and subtrees_explored were searched even
+    though they are on the far side of a splitting plane. max_depth is
+    the depth of the deepest node that was visited, the root being at
+    depth 0.
 
-        return (child, parent if parent is not None else self)
+    iter_nearest() only counts visited nodes and distances, search_box()
+    and count_box() don't compute distances. Searches that are answered
+    by a QueryCache are not counted. """
 
+    __slots__ = ('searches', 'nodes_visited', 'distance_evals',
+                 'subtrees_pruned', 'subtrees_explored', 'max_depth',
+                 'seconds')
 
-    def should_remove(self, point, node):
-        """ checks if self's point (and maybe identity) matches """
-        if not self.data == point:
-            return False
+    def __init__(self):
+        self.reset()
 
-        return (node is None) or (node is self)
 
+    def __repr__(self):
+        return '<%(cls)s - %(visited)d nodes visited in %(searches)d ' \
+               'searches>' % dict(cls=self.__class__.__name__,
+                                  visited=self.nodes_visited,
+                                  searches=self.searches)
 
-    @require_axis
-    def remove(self, point, node=None):
-        """ Removes the node with the given point from the tree
 
-        Returns the new root node of the (sub)tree.
+    def as_dict(self):
+        """ Returns the counts as a dict, keyed by their names """
 
-        If there are multiple points matching "point", only one is removed. The
-        optional "node" parameter is used for checking the identity, once the
-        removeal candidate is decided."""
+        return OrderedDict((name, getattr(self, name))
+                           for name in self.__slots__)
 
-        # Recursion has reached an empty leaf node, nothing here to delete
-        if not self:
-            return
 
-        # Recursion has reached the node to be deleted
-        if self.should_remove(point, node):
-            return self._remove(point)
+    def reset(self):
+        """ Sets all counts to zero and returns the previous ones as a dict,
+        see as_dict() """
 
-        # Remove direct subnode
-        if self.left and self.left.should_remove(point, node):
-            self.left = self.left._remove(point)
+        counts = self.as_dict() if hasattr(self, 'searches') else None
+        self.searches = self.nodes_visited = self.distance_evals = 0
+        self.subtrees_pruned = self.subtrees_explored = self.max_depth = 0
+        self.seconds = 0.0
+        return counts
 
-        elif self.right and self.right.should_remove(point, node):
-            self.right = self.right._remove(point)
 
-        # Recurse to subtrees
-        if point[self.axis] <= self.data[self.axis]:
-            if self.left:
-                self.left = self.left.remove(point, node)
+    def _add(self, visited, evals, pruned, explored, depth):
+        self.nodes_visited += visited
+        self.distance_evals += evals
+        self.subtrees_pruned += pruned
+        self.subtrees_explored += explored
+        self.max_depth = max(self.max_depth, depth)
 
-        if point[self.axis] >= self.data[self.axis]:
-            if self.right:
-                self.right = self.right.remove(point, node)
 
-        return self
+    def _searched(self, start):
+        self.searches += 1
+        self.seconds += _clock() - start
 
 
-    @require_axis
-    def _remove(self, point):
-        # we have reached the node to be deleted here
 
-        # deleting a leaf node is trivial
-        if self.is_leaf:
-            self.data = None
-            return self
+class TreeStats(object):
+    """ The shape of a kd-tree, see KDNode.stats()
 
-        # we have to delete a non-leaf node here
+    size is the number of points and dead the number of dead nodes, see
+    KDNode.remove(). depths[i] is the number of nodes at depth i, the root
+    being at depth 0 and nodes in buckets not counted. leaves is the number
+    of nodes without children, average_leaf_depth and max_leaf_depth are
+    their mean and largest depth. splits[a] is the number of nodes with
+    children that split on axis a.
 
-        # find a replacement for the node (will be the new subtree-root)
-        root, max_p = self.find_replacement()
+    imbalance is the largest fraction of the points of a node that one of
+    its subtrees holds. It is at most 0.5 for trees built by create(), and
+    about alpha for trees with an alpha.
 
-        # self and root swap positions
-        tmp_l, tmp_r = self.left, self.right
-        self.left, self.right = root.left, root.right
-        root.left, root.right = tmp_l if tmp_l is not root else self, tmp_r if tmp_r is not root else self
-        self.axis, root.axis = root.axis, self.axis
+    cost is the expected cost of a search compared to a balanced tree: the
+    average number of nodes from the root to a point, divided by the same
+    for the tree that create() would build of these points. """
 
-        # Special-case if we have not chosen a direct child as the replacement
-        if max_p is not self:
-            pos = max_p.get_child_pos(root)
-            max_p.set_child(pos, self)
-            max_p.remove(point, self)
+    __slots__ = ('size', 'dead', 'depths', 'leaves', 'average_leaf_depth',
+                 'max_leaf_depth', 'imbalance', 'splits', 'cost')
 
-        else:
-            root.remove(point, self)
+    def __init__(self, size, dead, depths, leaves, average_leaf_depth,
+                 max_leaf_depth, imbalance, splits, cost):
+        self.size = size
+        self.dead = dead
+        self.depths = depths
+        self.leaves = leaves
+        self.average_leaf_depth = average_leaf_depth
+        self.max_leaf_depth = max_leaf_depth
+        self.imbalance = imbalance
+        self.splits = splits
+        self.cost = cost
 
-        return root
 
+    def __repr__(self):
+        return '<%(cls)s - %(size)d points, max leaf depth %(depth)d, ' \
+               'cost %(cost).2f>' % dict(cls=self.__class__.__name__,
+                                         size=self.size,
+                                         depth=self.max_leaf_depth,
+                                         cost=self.cost)
 
-    @property
-    def is_balanced(self):
-        """ Returns True if the (sub)tree is balanced
 
-        The tree is balanced if the heights of both subtrees differ at most by
-        1 """
+    def as_dict(self):
+        """ Returns the statistics as a dict, keyed by their names """
 
-        left_height = self.left.height() if self.left else 0
-        right_height = self.right.height() if self.right else 0
+        return OrderedDict((name, getattr(self, name))
+                           for name in self.__slots__)
 
-        if abs(left_height - right_height) > 1:
-            return False
 
-        return all(c.is_balanced for c, _ in self.children)
 
+def _balanced_path_length(n, leaf_size):
+    """ Returns the sum of the number of nodes from the root to each point
+    of a tree of n points that is built by create()
 
-    def rebalance(self):
-        """
-        Returns the (possibly new) root of the rebalanced tree
-        """
+    The subtrees of the median-split tree have only O(log n) different
+    sizes, see _build_nodes(). """
 
-        return create([x.data for x in self.inorder()])
+    lengths = {0: 0}
 
+    def length(m):
+        if m not in lengths:
+            if leaf_size > 1 and m <= leaf_size:
+                lengths[m] = m
+            else:
+                lengths[m] = m + length(m // 2) + length(m - m // 2 - 1)
+        return lengths[m]
 
-    def axis_dist(self, point, axis):
-        """
-        Squared distance at the given axis between
-        the current Node and the given point
-        """
-        return math.pow(self.data[axis] - point[axis], 2)
+    return length(n)
 
 
-    def dist(self, point):
-        """
-        Squared distance between the current Node
-        and the given point
-        """
-        r = range(self.dimensions)
-        return sum([self.axis_dist(point, i) for i in r])
 
+class KNNResult(list):
+    """ The result of a nearest neighbor search
 
-    def search_knn(self, point, k, dist=None):
-        """ Return the k nearest neighbors of point and their distances
+    A list of (node, distance) tuples, ordered by distance. exact is False
+    if the search was approximate and might have missed closer points. """
 
-        point must be an actual point, not a node.
+    def __init__(self, results=(), exact=True):
+        super(KNNResult, self).__init__(results)
+        self.exact = exact
 
-        k is the number of results to return. The actual results can be less
-        (if there aren't more nodes to return) or more in case of equal
-        distances.
 
-        dist is a distance function, expecting two points and returning a
-        distance value. Distance values can be any comparable type.
 
-        The result is an ordered list of (node, distance) tuples.
-        """
+class QueryCache(object):
+    """ A least recently used cache of search results
 
-        if k < 1:
-            raise ValueError("k must be greater than 0.")
+    A tree that is created with a cache_size keeps the results of its
+    searches in a QueryCache, keyed on the query point and the arguments
+    of the search. Each result is stored with the version of the tree
+    (see TreeConfig) and is not returned anymore once the tree has
+    changed. Changes also remove all results, so that the nodes in them
+    and in their keys can be freed. When the cache holds maxsize results,
+    the least recently used one is dropped.
 
-        if dist is None:
-            get_dist = lambda n: n.dist(point)
-        else:
-            get_dist = lambda n: dist(n.data, point)
+    hits and misses count the lookups, searches whose arguments can't be
+    hashed are not cached. """
 
-        results = []
+    def __init__(self, maxsize):
+        if maxsize < 1:
+            raise ValueError('maxsize must be greater than 0.')
 
-        self._search_node(point, k, results, get_dist, itertools.count())
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._results = OrderedDict()
 
-        # We sort the final result by the distance in the tuple
-        # (<KdNode>, distance).
-        return [(node, -d) for d, _, node in sorted(results, reverse=True)]
 
+    def __len__(self):
+        return len(self._results)
 
-    def _search_node(self, point, k, results, get_dist, counter):
-        if not self:
-            return
 
-        nodeDist = get_dist(self)
-
-        # Add current node to the priority queue if it closer than
-        # at least one point in the queue.
-        #
-        # If the heap is at its capacity, we need to check if the
-        # current node is closer than the current farthest node, and if
-        # so, replace it.
-        item = (-nodeDist, next(counter), self)
-        if len(results) >= k:
-            if -nodeDist > results[0][0]:
-                heapq.heapreplace(results, item)
-        else:
-            heapq.heappush(results, item)
-        # get the splitting plane
-        split_plane = self.data[self.axis]
-        # get the squared distance between the point and the splitting plane
-        # (squared since all distances are squared).
-        plane_dist = point[self.axis] - split_plane
-        plane_dist2 = plane_dist * plane_dist
-
-        # Search the side of the splitting plane that the point is in
-        if point[self.axis] < split_plane:
-            if self.left is not None:
-                self.left._search_node(point, k, results, get_dist, counter)
-        else:
-            if self.right is not None:
-                self.right._search_node(point, k, results, get_dist, counter)
-
-        # Search the other side of the splitting plane if it may contain
-        # points closer than the farthest point in the current results.
-        if -plane_dist2 > results[0][0] or len(results) < k:
-            if point[self.axis] < self.data[self.axis]:
-                if self.right is not None:
-                    self.right._search_node(point, k, results, get_dist,
-                                            counter)
-            else:
-                if self.left is not None:
-                    self.left._search_node(point, k, results, get_dist,
-                                           counter)
+    def __repr__(self):
+        return '<%(cls)s - %(size)d of %(maxsize)d, hit rate %(rate).2f>' % \
+            dict(cls=self.__class__.__name__, size=len(self),
+                 maxsize=self.maxsize, rate=self.hit_rate)
 
 
-    @require_axis
-    def search_nn(self, point, dist=None):
-        """
-        Search the nearest node of the given point
+    @property
+    def hit_rate(self):
+        """ The fraction of the lookups that returned a result """
 
-        point must be an actual point, not a node. The nearest node to the
-        point is returned. If a location of an actual node is used, the Node
-        with this location will be returned (not its neighbor).
+        lookups = self.hits + self.misses
+        return self.hits / float(lookups) if lookups else 0.0
 
-        dist is a distance function, expecting two points and returning a
-        distance value. Distance values can be any comparable type.
 
-        The result is a (node, distance) tuple.
-        """
+    def get(self, key, version):
+        """ Returns the result for key if it is from the given version
 
-        return next(iter(self.search_knn(point, 1, dist)), None)
+        Returns None otherwise, or if key can't be hashed. """
 
+        try:
+            entry = self._results.pop(key, None)
+        except TypeError:
+            return None
 
-    def _search_nn_dist(self, point, dist, results, get_dist):
-        if not self:
+        if entry is None or entry[0] != version:
+            self.misses += 1
+            return None
+
+        self._results[key] = entry
+        self.hits += 1
+        return entry[1]
+
+
+    def put(self, key, version, result):
+        """ Stores the result for key from the given version """
+
+        try:
+            self._results[key] = (version, result)
+        except TypeError:
             return
 
-        nodeDist = get_dist(self)
+        if len(self._results) > self.maxsize:
+            self._results.popitem(last=False)
 
-        if nodeDist < dist:
-            results.append(self.data)
 
-        # get the splitting plane
-        split_plane = self.data[self.axis]
+    def invalidate(self):
+        """ Removes all results, but keeps the counts """
 
-        # Search the side of the splitting plane that the point is in
-        if point[self.axis] <= split_plane + dist:
-            if self.left is not None:
-                self.left._search_nn_dist(point, dist, results, get_dist)
-        if point[self.axis] >= split_plane - dist:
-            if self.right is not None:
-                self.right._search_nn_dist(point, dist, results, get_dist)
+        self._results.clear()
 
 
-    @require_axis
-    def search_nn_dist(self, point, distance, best=None):
-        """
-        Search the n nearest nodes of the given point which are within given
-        distance
+    def clear(self):
+        """ Removes all results and resets the counts """
 
-        point must be a location, not a node. A list containing the n nearest
-        nodes to the point within the distance will be returned.
-        """
+        self._results.clear()
+        self.hits = self.misses = 0
 
-        results = []
-        get_dist = lambda n: n.dist(point)
 
-        self._search_nn_dist(point, distance, results, get_dist)
-        return results
+def _point_key(point):
+    """ Returns a hashable key for the coordinates of point """
 
+    if isinstance(point, tuple):
+        return point
 
-    @require_axis
-    def is_valid(self):
-        """ Checks recursively if the tree is valid
+    try:
+        return tuple(point)
+    except TypeError:
+        return point
 
-        It is valid if each node splits correctly """
 
-        if not self:
-            return True
 
-        if self.left and self.data[self.axis] < self.left.data[self.axis]:
-            return False
+class Metric(object):
+    """ A distance function that searches can prune with
 
-        if self.right and self.data[self.axis] > self.right.data[self.axis]:
-            return False
+    Searches bound the distance between a point and the region of a
+    subtree by combining per-axis distances, which the metric provides by
+    axis_dist(). Distances don't have to be true distances, but have to
+    grow with them, like squared euclidean distances do. power is the
+    exponent that relates them to the true distance, which is used to
+    scale the eps of approximate searches.
 
-        return all(c.is_valid() for c, _ in self.children) or self.is_leaf
+    A Metric can be given as the dist argument of searches and of
+    create(). Metric itself is the squared euclidean distance, subclasses
+    override dist(), axis_dist() and power for other distances. """
 
+    power = 2
 
-    def extreme_child(self, sel_func, axis):
-        """ Returns a child of the subtree and its parent
+    def dist(self, a, b):
+        """ Returns the distance between the points a and b """
+        return sum((x - y) * (x - y) for x, y in zip(a, b))
 
-        The child is selected by sel_func which is either min or max
-        (or a different function with similar semantics). """
 
-        max_key = lambda child_parent: child_parent[0].data[axis]
+    def axis_dist(self, axis, diff):
+        """ Returns the distance contributed by a difference along axis """
+        return diff * diff
 
 
-        # we don't know our parent, so we include None
-        me = [(self, None)] if self else []
+    def region_dist(self, region_dist, offsets, axis, axis_dist):
+        """ Returns the distance of a region after its distance on axis
+        grows from offsets[axis] to axis_dist
 
-        child_max = [c.extreme_child(sel_func, axis) for c, _ in self.children]
-        # insert self for unknown parents
-        child_max = [(c, p if p is not None else self) for c, p in child_max]
+        region_dist is the previous distance of the region, offsets are the
+        previous per-axis distances. """
+        return region_dist - offsets[axis] + axis_dist
 
-        candidates =  me + child_max
 
-        if not candidates:
-            return None, None
+    def __repr__(self):
+        return '%s()' % self.__class__.__name__
 
-        return sel_func(candidates, key=max_key)
 
 
+class SquaredEuclidean(Metric):
+    """ The squared euclidean distance, the default of searches
 
-def create(point_list=None, dimensions=None, axis=0, sel_axis=None):
-    """ Creates a kd-tree from a list of points
+    It is the same as Metric(), under a name of its own. """
 
-    All points in the list must be of the same dimensionality.
 
-    If no point_list is given, an empty tree is created. The number of
-    dimensions has to be given instead.
 
-    If both a point_list and dimensions are given, the numbers must agree.
+class Manhattan(Metric):
+    """ The sum of the absolute differences along all axes (L1) """
 
-    Axis is the axis on which the root-node should split.
+    power = 1
 
-    sel_axis(axis) is used when creating subnodes of a node. It receives the
-    axis of the parent node and returns the axis of the child node. """
+    def dist(self, a, b):
+        return sum(abs(x - y) for x, y in zip(a, b))
 
-    if not point_list and not dimensions:
-        raise ValueError('either point_list or dimensions must be provided')
 
-    elif point_list:
-        dimensions = check_dimensionality(point_list, dimensions)
+    def axis_dist(self, axis, diff):
+        return abs(diff)
 
-    # by default cycle through the axis
-    sel_axis = sel_axis or (lambda prev_axis: (prev_axis+1) % dimensions)
 
-    if not point_list:
-        return KDNode(sel_axis=sel_axis, axis=axis, dimensions=dimensions)
 
-    # Sort point list and choose median as pivot element
-    point_list = list(point_list)
-    point_list.sort(key=lambda point: point[axis])
-    median = len(point_list) // 2
+class Chebyshev(Metric):
+    """ The largest absolute difference along any axis (L-infinity) """
 
-    loc   = point_list[median]
-    left  = create(point_list[:median], dimensions, sel_axis(axis))
-    right = create(point_list[median + 1:], dimensions, sel_axis(axis))
-    return KDNode(loc, left, right, axis=axis, sel_axis=sel_axis, dimensions=dimensions)
+    power = 1
 
+    def dist(self, a, b):
+        return max(abs(x - y) for x, y in zip(a, b))
 
-def check_dimensionality(point_list, dimensions=None):
-    dimensions = dimensions or len(point_list[0])
-    for p in point_list:
-        if len(p) != dimensions:
-            raise ValueError('All Points in the point_list must have the same dimensionality')
 
-    return dimensions
+    def axis_dist(self, axis, diff):
+        return abs(diff)
 
 
+    def region_dist(self, region_dist, offsets, axis, axis_dist):
+        # the distance along an axis only grows while descending
+        return max(region_dist, axis_dist)
 
-def level_order(tree, include_all=False):
-    """ Returns an iterator over the tree in level-order
 
-    If include_all is set to True, empty parts of the tree are filled
-    with dummy entries and the iterator becomes infinite. """
 
-    q = deque()
-    q.append(tree)
-    while q:
-        node = q.popleft()
-        yield node
+class WeightedEuclidean(Metric):
+    """ The squared euclidean distance with a weight for every axis """
 
-        if include_all or node.left:
-            q.append(node.left or node.__class__())
+    power = 2
 
-        if include_all or node.right:
-            q.append(node.right or node.__class__())
+    def __init__(self, weights):
+        self.weights = tuple(weights)
+        if any(w < 0 for w in self.weights):
+            raise ValueError('weights must not be negative')
 
 
+    def dist(self, a, b):
+        return sum(w * (x - y) * (x - y)
+                   for w, x, y in zip(self.weights, a, b))
 
-def visualize(tree, max_level=100, node_width=10, left_padding=5):
-    """ Prints the tree to stdout """
 
-    height = min(max_level, tree.height()-1)
-    max_width = pow(2, height)
+    def axis_dist(self, axis, diff):
+        return self.weights[axis] * diff * diff
 
-    per_level = 1
-    in_level  = 0
-    level     = 0
 
-    for node in level_order(tree, include_all=True):
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, self.weights)
 
-        if in_level == 0:
-            print()
-            print()
-            print(' '*left_padding, end=' ')
 
-        width = int(max_width*node_width/per_level)
 
-        node_str = (str(node.data) if node else '').center(width)
-        print(node_str, end=' ')
+class Minkowski(Metric):
+    """ The p-norm distance, raised to the power of p
 
-        in_level += 1
+    Like the squared euclidean distance, the p-th root is not taken.
+    Minkowski(2) orders points like SquaredEuclidean(), Minkowski(1) is
+    Manhattan(). """
 
-        if in_level == per_level:
-            in_level   = 0
-            per_level *= 2
-            level     += 1
+    def __init__(self, p):
+        if p < 1:
+            raise ValueError('p must be at least 1')
+        self.p = self.power = p
 
-        if level > height:
-            break
 
+    def dist(self, a, b):
+        p = self.p
+        return sum(abs(x - y) ** p for x, y in zip(a, b))
+
+
+    def axis_dist(self, axis, diff):
+        return abs(diff) ** self.p
+
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, self.p)
+
+
+
+def _squared_distance_2(a, b):
+    d0 = a[0] - b[0]
+    d1 = a[1] - b[1]
+    return d0 * d0 + d1 * d1
+
+
+def _squared_distance_3(a, b):
+    d0 = a[0] - b[0]
+    d1 = a[1] - b[1]
+    d2 = a[2] - b[2]
+    return d0 * d0 + d1 * d1 + d2 * d2
+
+
+def _squared_distance(a, b):
+    diff = list(map(operator.sub, a, b))
+    return sum(map(operator.mul, diff, diff))
+
+
+def _squared_distance_array(a, b):
+    diff = a - b
+    return float(diff.dot(diff))
+
+
+_SQUARED_DISTANCES = {2: _squared_distance_2, 3: _squared_distance_3}
+
+
+def _squared_distance_function(dimensions, point=None):
+    """ Returns a function for the squared euclidean distance of two points
+
+    The function is unrolled for 2 and 3 dimensions. For more dimensions,
+    if point is a numpy array, it computes the distance with numpy, which
+    is faster from 4 dimensions on if the other point is an array too. """
+
+    if np is not None and isinstance(point, np.ndarray) and dimensions > 3:
+        return _squared_distance_array
+    return _SQUARED_DISTANCES.get(dimensions, _squared_distance)
+
+
+def _distance_function(dist, point, dimensions):
+    """ Returns a function that computes the distance of a node to point,
+    and the Metric that bounds the distance of regions
+
+    dist is a Metric, a function of two points or None for the squared
+    euclidean distance. The Metric is None if regions are bounded by
+    squared euclidean distances, which is also done for plain functions. """
+
+    if dist is None:
+        squared_distance = _squared_distance_function(dimensions, point)
+        return (lambda n: squared_distance(n.data, point)), None
+
+    if isinstance(dist, Metric):
+        metric_dist = dist.dist
+        return (lambda n: metric_dist(n.data, point)), dist
+
+    return (lambda n: dist(n.data, point)), None
+
+
+
+def _config_property(name):
+    """ A property that delegates to the node's TreeConfig
+
+    Setting it changes the setting for all nodes of the tree. """
+
+    def fget(self):
+        return getattr(self.config, name)
+
+    def fset(self, value):
+        setattr(self.config, name, value)
+
+    return property(fget, fset, doc='Shared %s of the tree' % name)
+
+
+
+# add_many() and remove_many() rebuild subtrees in which one side holds more
+# than this fraction of the points after the batch, if the tree has no alpha
+_BATCH_ALPHA = 0.75
+
+# the cost of a tree with a max_cost is checked after this fraction of its
+# points has been added or removed
+_COST_CHECK_INTERVAL = 0.25
+
+# subtrees with fewer points are not rebuilt for a max_cost, as they add
+# little to the cost of searches
+_COST_MIN_POINTS = 64
+
+
+class KDNode(Node):
+    """ A Node that contains kd-tree specific data and methods """
+
+    __slots__ = ('axis', 'config', 'size', 'levels', 'dead', 'dead_size')
+
+
+    def __init__(self, data=None, left=None, right=None, axis=None,
+            sel_axis=None, dimensions=None, leaf_size=1, config=None):
+        """ Creates a new node for a kd-tree
+
+        If the node will be used within a tree, the axis and the sel_axis
+        function should be supplied.
+
+        sel_axis(axis) is used when creating subnodes of the current node. It
+        receives the axis of the parent node and returns the axis of the child
+        node.
+
+        leaf_size is the number of points a leaf can hold before it is
+        split, including its own point.
+
+        Nodes of the same tree share a TreeConfig. If config is given, the
+        node uses it instead of sel_axis, dimensions and leaf_size.
+
+        size is the number of points in the subtree, including the bucket
+        but not dead nodes. levels is the height of the subtree, see
+        height(). Both are kept up to date by add() and remove().
+
+        dead is True if the point of the node has been removed, but the
+        node is still part of the tree, see remove(). dead_size is the
+        number of dead nodes in the subtree, including the bucket. """
+        super(KDNode, self).__init__(data, left, right)
+        self.axis = axis
+        self.config = config or TreeConfig(dimensions, sel_axis, leaf_size)
+        self.size = (data is not None) + \
+                    (left.size if left is not None else 0) + \
+                    (right.size if right is not None else 0)
+        self.levels = max([int(data is not None)] +
+                          [c.levels + 1 for c in (left, right) if c])
+        self.dead = False
+        self.dead_size = 0
+
+
+    sel_axis = _config_property('sel_axis')
+    dimensions = _config_property('dimensions')
+    leaf_size = _config_property('leaf_size')
+
+
+    @property
+    def version(self):
+        """ The number of changes to the tree, see TreeConfig """
+        return self.config.version
+
+
+    @require_axis
+    def add(self, point):
+        """
+        Adds a point to the current node or iteratively
+        descends to one of its children.
+
+        Users should call add() only to the topmost tree.
+
+        If the tree has an alpha (see create()) and the new node ends up
+        deeper than log(n) / log(1 / alpha), the lowest subtree on its path
+        that is out of balance is rebuilt. As add() returns the new node
+        and not the root, the topmost node is never rebuilt, which leaves
+        the new node at most one level deeper.
+        """
+
+        self.config._changed()
+        current = self
+        path = []
+        while True:
+            check_dimensionality([point], dimensions=current.dimensions)
+            current.size += 1
+            path.append(current)
+
+            # Adding has hit an empty leaf-node, add here
+            if current.data is None:
+                current.data = point
+                node = current
+                break
+
+            # Leaves with buckets take the point until they overflow
+            if current.leaf_size > 1 and not (current.left or current.right):
+                node = current._add_to_bucket(point)
+                break
+
+            # split on self.axis, recurse either left or right
+            if point[current.axis] < current.data[current.axis]:
+                if current.left is None:
+                    current.left = current.create_subnode(point)
+                    node = current.left
+                    break
+                else:
+                    current = current.left
+            else:
+                if current.right is None:
+                    current.right = current.create_subnode(point)
+                    node = current.right
+                    break
+                else:
+                    current = current.right
+
+        alpha = self.config.alpha
+        rebuilt = False
+        if alpha is not None and \
+                len(path) - 1 > math.log(self.size) / -math.log(alpha):
+            for i in reversed(range(1, len(path))):
+                if path[i]._is_unbalanced():
+                    path[i - 1]._replace_child(path[i], path[i]._rebuild())
+                    # the rebuilt subtree is up to date, but the dead nodes
+                    # it dropped are still counted above it
+                    del path[i:]
+                    rebuilt = True
+                    break
+
+        for current in reversed(path):
+            if rebuilt:
+                current._update_size()
+            else:
+                current._update_levels()
+
+        self._check_cost(1, len(path), replace=False)
+        return node
+
+
+    @require_axis
+    def add_many(self, point_list):
+        """ Adds many points to the tree at once
+
+        The points are checked once and are partitioned down the tree in a
+        single traversal. The points that end up below a leaf are built into
+        a balanced subtree. A subtree is rebuilt together with its points if
+        they would put more than alpha (see create(), 0.75 if the tree has
+        none) of its points on one side.
+
+        Returns the new root of the tree, like remove(). Users should call
+        add_many() only to the topmost tree. """
+
+        point_list = list(point_list)
+        if not point_list:
+            return self
+
+        check_dimensionality(point_list, self.dimensions)
+        self.config._changed()
+        alpha = self.config.alpha or _BATCH_ALPHA
+
+        root = self
+        visited = []
+        stack = [(None, self, point_list)]
+        while stack:
+            parent, node, batch = stack.pop()
+            visited.append(node)
+            old_size = node.size
+            node.size += len(batch)
+
+            # empty trees and leaves with buckets
+            if not node or node.leaf_size > 1 and \
+                    not (node.left or node.right):
+                bucket = node.bucket or []
+                if node and len(bucket) + len(batch) < node.leaf_size:
+                    node.bucket = bucket + [node.create_subnode(p)
+                                            for p in batch]
+                else:
+                    root = node._rebuild_at(parent, root, batch)
+                continue
+
+            axis = node.axis
+            split = node.data[axis]
+            left = [p for p in batch if p[axis] < split]
+            right = [p for p in batch if p[axis] >= split]
+
+            old_left = node.left.size if node.left else 0
+            old_right = node.right.size if node.right else 0
+            limit = alpha * node.size
+            if (old_left + len(left) > limit or
+                    old_right + len(right) > limit) and \
+                    max(old_left, old_right) <= alpha * old_size:
+                root = node._rebuild_at(parent, root, batch)
+                continue
+
+            if right:
+                if node.right:
+                    stack.append((node, node.right, right))
+                else:
+                    node.right = node._create_subtree(right)
+            if left:
+                if node.left:
+                    stack.append((node, node.left, left))
+                else:
+                    node.left = node._create_subtree(left)
+
+        # children are visited after their parents, and rebuilt subtrees
+        # have dropped their dead nodes
+        for node in reversed(visited):
+            node._update_size()
+
+        return root._check_cost(len(point_list))
+
+
+    def _create_subtree(self, point_list):
+        """ Creates a balanced child subtree of the points """
+
+        if len(point_list) == 1:
+            return self.create_subnode(point_list[0])
+
+        axis = self.sel_axis(self.axis)
+        layout = _median_layout(point_list, self.dimensions, axis,
+                                self.sel_axis)
+        return _build_nodes(point_list, layout, axis, self.config)
+
+
+    def _add_to_bucket(self, point):
+        """ Adds a point to the bucket of the current leaf
+
+        If the leaf overflows, its bucket is split around the leaf's own
+        point into two new leaves. """
+
+        node = self.create_subnode(point)
+        bucket = (self.bucket or []) + [node]
+
+        if len(bucket) < self.leaf_size:
+            self.bucket = bucket
+            return node
+
+        split = self.data[self.axis]
+        self.bucket = None
+        self.left = self._make_leaf(
+            [n for n in bucket if n.data[self.axis] < split])
+        self.right = self._make_leaf(
+            [n for n in bucket if n.data[self.axis] >= split])
+        return node
+
+
+    def _make_leaf(self, nodes):
+        """ Turns nodes into a child leaf of the current node
+
+        The node at the median of the child's axis becomes the leaf, the
+        others are put into its bucket. """
+
+        if not nodes:
+            return None
+
+        axis = self.sel_axis(self.axis)
+        nodes.sort(key=lambda n: n.data[axis])
+        leaf = nodes.pop(len(nodes) // 2)
+        leaf.axis = axis
+        leaf.left = leaf.right = None
+        leaf.bucket = nodes or None
+        leaf._update_size()
+        return leaf
+
+
+    def _merge_bucket(self):
+        """ Merges the children into the current node if they underflow
+
+        This happens if both children are leaves which, together with the
+        current node, hold at most half of leaf_size points. """
+
+        if self.leaf_size < 2 or not (self.left or self.right):
+            return
+
+        nodes = []
+        for child in (self.left, self.right):
+            if not child:
+                continue
+            if child.left or child.right:
+                return
+            nodes.append(child)
+            nodes.extend(child.bucket or ())
+
+        if len(nodes) + len(self.bucket or ()) + 1 > self.leaf_size // 2:
+            return
+
+        for node in nodes:
+            node.left = node.right = node.bucket = None
+            node.size = node.levels = 1
+        self.bucket = (self.bucket or []) + nodes
+        self.left = self.right = None
+
+
+    @require_axis
+    def create_subnode(self, data):
+        """ Creates a subnode for the current node """
+
+        return self.__class__(data,
+                axis=self.sel_axis(self.axis),
+                config=self.config)
+
+
+    @require_axis
+    def find_replacement(self):
+        """ Finds a replacement for the current node
+
+        The replacement is returned as a
+        (replacement-node, replacements-parent-node) tuple """
+
+        if self.right:
+            child, parent = self.right.extreme_child(min, self.axis)
+        else:
+            child, parent = self.left.extreme_child(max, self.axis)
+
+        return (child, parent if parent is not None else self)
+
+
+    def should_remove(self, point, node):
+        """ checks if self's point (and maybe identity) matches """
+        if not self.data == point:
+            return False
+
+        return (node is None) or (node is self)
+
+
+    @require_axis
+    def remove(self, point, node=None):
+        """ Removes the node with the given point from the tree
+
+        Returns the new root node of the (sub)tree.
+
+        If there are multiple points matching "point", only one is removed. The
+        optional "node" parameter is used for checking the identity, once the
+        removeal candidate is decided.
+
+        If the tree has an alpha (see create()), subtrees on the path to the
+        removed node that are out of balance are rebuilt afterwards.
+
+        If the tree has a max_dead (see create()), the node is only marked
+        as dead instead, which takes O(log n). Dead nodes still split the
+        space and are returned by traversals, but are skipped by searches
+        and by live_nodes(). Once more than max_dead of the nodes are dead,
+        the tree is compacted. Users should then call remove() only on the topmost
+        tree.
+
+        If the tree has a max_cost (see create()), the new root is checked
+        for subtrees to rebuild."""
+
+        self.config._changed()
+
+        if self.config.max_dead is not None:
+            root = self._remove_lazy(point, node)
+        else:
+            root = self._remove_point(point, node)
+
+        if root is not None:
+            root = root._check_cost(1)
+        return root
+
+
+    def _remove_point(self, point, node):
+        """ Removes the node with the given point from the subtree of the
+        current node, see remove() """
+
+        # Recursion has reached an empty leaf node, nothing here to delete
+        if not self:
+            return
+
+        # Recursion has reached the node to be deleted
+        if self.should_remove(point, node):
+            root = self._remove(point)
+            if self.config.alpha is not None and root._is_unbalanced():
+                root = root._rebuild()
+            return root
+
+        # The point is in the bucket of this leaf
+        for i, member in enumerate(self.bucket or ()):
+            if member.should_remove(point, node):
+                del self.bucket[i]
+                self.size -= 1
+                return self
+
+        # Remove direct subnode
+        if self.left and self.left.should_remove(point, node):
+            self.left = self.left._remove(point)
+
+        elif self.right and self.right.should_remove(point, node):
+            self.right = self.right._remove(point)
+
+        # Recurse to subtrees, the right one only if nothing has been
+        # removed from the left one
+        else:
+            size = self.size
+            if point[self.axis] <= self.data[self.axis]:
+                if self.left:
+                    self.left = self.left._remove_point(point, node)
+                    self._update_size()
+
+            if point[self.axis] >= self.data[self.axis]:
+                if self.right and self.size == size:
+                    self.right = self.right._remove_point(point, node)
+
+        self._merge_bucket()
+        self._update_size()
+
+        if self.config.alpha is not None and self._is_unbalanced():
+            return self._rebuild()
+
+        return self
+
+
+    @require_axis
+    def remove_many(self, point_list):
+        """ Removes many points from the tree at once
+
+        For every point, one node with that point is removed, if there is
+        one. The points are checked once and are partitioned down the tree
+        in a single traversal. Afterwards, the highest subtrees that contain
+        removed nodes or that the batch put out of balance (see add_many())
+        are rebuilt without them.
+
+        If the tree has a max_dead, the nodes are only marked as dead
+        instead, see remove(), and only subtrees that are out of balance are
+        rebuilt.
+
+        Returns the new root of the tree, like remove(). Users should call
+        remove_many() only on the topmost tree. """
+
+        point_list = list(point_list)
+        if not point_list or not self:
+            return self
+
+        check_dimensionality(point_list, self.dimensions)
+        self.config._changed()
+        alpha = self.config.alpha or _BATCH_ALPHA
+        lazy = self.config.max_dead is not None
+
+        # points are identified by their index, as they can be on both sides
+        # of a splitting plane
+        found = set()
+        visited = []
+        stack = [(None, self, 0, list(enumerate(point_list)))]
+        while stack:
+            parent, node, depth, batch = stack.pop()
+            if not node:
+                continue
+
+            visited.append((parent, node, depth, node._is_unbalanced(alpha)))
+
+            for candidate in itertools.chain((node, ), node.bucket or ()):
+                if candidate.dead:
+                    continue
+                for i, point in batch:
+                    if i not in found and candidate.data == point:
+                        found.add(i)
+                        candidate.dead = True
+                        candidate.size -= 1
+                        candidate.dead_size += 1
+                        break
+
+            batch = [(i, p) for i, p in batch if i not in found]
+            if not batch:
+                continue
+
+            axis = node.axis
+            split = node.data[axis]
+            if node.right:
+                right = [(i, p) for i, p in batch if p[axis] >= split]
+                if right:
+                    stack.append((node, node.right, depth + 1, right))
+            if node.left:
+                left = [(i, p) for i, p in batch if p[axis] <= split]
+                if left:
+                    stack.append((node, node.left, depth + 1, left))
+
+        if not found:
+            return self
+
+        # visited is in preorder, so children are updated before parents
+        for _, node, _, _ in reversed(visited):
+            if not lazy and node.bucket:
+                node.bucket = [n for n in node.bucket if not n.dead] or None
+            node._update_size()
+
+        # the subtree of a node follows it in visited
+        root = self
+        rebuilt = False
+        rebuilt_depth = None
+        for parent, node, depth, was_unbalanced in visited:
+            if rebuilt_depth is not None and depth > rebuilt_depth:
+                continue
+
+            rebuilt_depth = None
+            if node.dead and not lazy or \
+                    node._is_unbalanced(alpha) and not was_unbalanced:
+                root = node._rebuild_at(parent, root)
+                rebuilt_depth = depth
+                rebuilt = True
+
+        if rebuilt:
+            for _, node, _, _ in reversed(visited):
+                node._update_size()
+
+        if lazy and root.dead_ratio > root.config.max_dead:
+            root = root.compact()
+
+        return root._check_cost(len(found))
+
+
+    @require_axis
+    def _remove(self, point):
+        # we have reached the node to be deleted here
+
+        # deleting a leaf node is trivial, unless another node from its
+        # bucket has to take its place
+        if self.is_leaf:
+            if not self.bucket:
+                self.data = None
+                self.size = self.levels = 0
+                return self
+
+            root = self.bucket.pop()
+            root.left, root.right = self.left, self.right
+            root.axis = self.axis
+            root.bucket, self.bucket = self.bucket or None, None
+            root._update_size()
+            return root
+
+        # we have to delete a non-leaf node here
+
+        # find a replacement for the node (will be the new subtree-root)
+        root, max_p = self.find_replacement()
+
+        # the replacement is taken out of a bucket and takes our place
+        if root is not max_p.left and root is not max_p.right:
+            max_p.bucket = [n for n in max_p.bucket if n is not root] or None
+            root.left, root.right = self.left, self.right
+            root.axis = self.axis
+            root._update_sizes_to(max_p)
+            return root
+
+        # self and root swap positions
+        tmp_l, tmp_r = self.left, self.right
+        self.left, self.right = root.left, root.right
+        root.left, root.right = tmp_l if tmp_l is not root else self, tmp_r if tmp_r is not root else self
+        self.axis, root.axis = root.axis, self.axis
+        self.bucket, root.bucket = root.bucket, self.bucket
+
+        # Special-case if we have not chosen a direct child as the replacement
+        if max_p is not self:
+            pos = max_p.get_child_pos(root)
+            max_p.set_child(pos, self._remove(point))
+            max_p._merge_bucket()
+            root._update_sizes_to(max_p)
+            return root
+
+        return root._remove_point(point, self)
+
+
+    def _remove_lazy(self, point, node):
+        """ Marks the node with the given point as dead, see remove() """
+
+        if self._mark_dead(point, node) is not None and \
+                self.dead_ratio > self.config.max_dead:
+            return self.compact()
+        return self
+
+
+    def _mark_dead(self, point, node):
+        """ Marks the node with the given point as dead and returns it
+
+        Returns None if the subtree has no such node that is not dead. """
+
+        stack = [self]
+        while stack:
+            current = stack.pop()
+            if not current:
+                continue
+
+            for candidate in itertools.chain((current, ), current.bucket or ()):
+                if not candidate.dead and candidate.should_remove(point, node):
+                    candidate.dead = True
+                    candidate.size -= 1
+                    candidate.dead_size += 1
+                    self._update_sizes_to(current)
+                    return candidate
+
+            axis = current.axis
+            if point[axis] >= current.data[axis]:
+                stack.append(current.right)
+            if point[axis] <= current.data[axis]:
+                stack.append(current.left)
+
+        return None
+
+
+    @property
+    def dead_ratio(self):
+        """ The fraction of the nodes of the (sub)tree that are dead
+
+        See remove(). """
+
+        dead = self.dead_size
+        return dead / float(self.size + dead) if dead else 0.0
+
+
+    def live_nodes(self):
+        """ iterator for the nodes that are not dead, in preorder
+
+        Traversals like preorder() also return the dead nodes, which still
+        split the space, see remove(). """
+
+        return (node for node in self.preorder() if not node.dead)
+
+
+    def compact(self):
+        """ Removes the dead nodes from the subtree of the current node
+
+        The subtree is rebuilt from its remaining nodes in O(n log n), see
+        remove(). Returns the new root of the subtree, as the current node
+        might be dead itself. """
+
+        self.config._changed()
+        return self._rebuild()
+
+
+    def _update_size(self):
+        """ Recomputes the size, dead_size and levels of the current node
+        from its children """
+
+        children = [c for c in (self.left, self.right) if c]
+        dead = int(self.dead) + sum(n.dead for n in self.bucket or ())
+        self.size = int(self.data is not None) + len(self.bucket or ()) - \
+                    dead + sum(c.size for c in children)
+        self.dead_size = dead + sum(c.dead_size for c in children)
+        self._update_levels()
+
+
+    def _update_levels(self):
+        """ Recomputes the levels of the current node from its children """
+
+        self.levels = max([int(self.data is not None)] +
+                          [c.levels + 1 for c in (self.left, self.right) if c])
+
+
+    def _is_unbalanced(self, alpha=None):
+        """ Returns True if a subtree holds more than alpha of the points
+
+        alpha defaults to the one of the tree. """
+
+        limit = (alpha or self.config.alpha) * self.size
+        return bool(self.left and self.left.size > limit or
+                    self.right and self.right.size > limit)
+
+
+    def _rebuild(self, point_list=()):
+        """ Rebuilds the subtree of the current node into a median-split tree
+
+        This takes O(m log m) for a subtree of m points. The existing nodes
+        are relinked instead of creating new ones, so they keep their points,
+        and dead nodes are dropped. Returns the new root of the subtree,
+        which the caller has to link in place of the current node.
+
+        New nodes are created for the points in point_list, if given. """
+
+        nodes = list(self.live_nodes())
+        nodes.extend(self.create_subnode(p) for p in point_list)
+
+        if not nodes:
+            self.data = self.left = self.right = self.bucket = None
+            self.dead = False
+            self.size = self.levels = self.dead_size = 0
+            return self
+
+        points = [node.data for node in nodes]
+        layout = _median_layout(points, self.dimensions, self.axis,
+                                self.sel_axis)
+
+        return _build_nodes(points, layout, self.axis, self.config, nodes)
+
+
+    def _rebuild_at(self, parent, root, point_list=()):
+        """ Rebuilds the subtree of the current node, see _rebuild()
+
+        The new root of the subtree is linked into parent. Returns the root
+        of the tree, which is the new root of the subtree if the current
+        node has no parent. """
+
+        subtree = self._rebuild(point_list)
+        if parent is None:
+            return subtree
+
+        parent._replace_child(self, subtree)
+        return root
+
+
+    def _replace_child(self, child, node):
+        """ Links node in place of the child of the current node
+
+        An empty node, left by rebuilding a subtree without live nodes, is
+        not linked. """
+
+        node = node or None
+        if self.left is child:
+            self.left = node
+        else:
+            self.right = node
+
+
+    def _update_sizes_to(self, target):
+        """ Recomputes the sizes on the path from the current node down to
+        the node target, bottom-up
+
+        The path is found by descending towards target's point, on both
+        sides if it lies on a splitting plane. """
+
+        point = target.data
+        path = []
+        stack = [(self, 0)]
+        while stack:
+            node, depth = stack.pop()
+            del path[depth:]
+            path.append(node)
+            if node is target:
+                break
+
+            axis = node.axis
+            if node.right and point[axis] >= node.data[axis]:
+                stack.append((node.right, depth + 1))
+            if node.left and point[axis] <= node.data[axis]:
+                stack.append((node.left, depth + 1))
+        else:
+            path = []
+
+        for node in reversed(path):
+            node._update_size()
+
+
+    def height(self):
+        """
+        Returns height of the (sub)tree, without considering
+        empty leaf-nodes
+
+        This takes O(1), as every node keeps the height of its subtree.
+        """
+
+        return self.levels
+
+
+    @property
+    def is_balanced(self):
+        """ Returns True if the (sub)tree is balanced
+
+        The tree is balanced if the heights of both subtrees differ at most by
+        1. This is checked for every node, in O(n). """
+
+        for node in self.preorder():
+            left_height = node.left.levels if node.left else 0
+            right_height = node.right.levels if node.right else 0
+
+            if abs(left_height - right_height) > 1:
+                return False
+
+        return True
+
+
+    def stats(self):
+        """ Returns a TreeStats report of the shape of the (sub)tree
+
+        The report is computed in a single pass over the nodes. """
+
+        depths = []
+        dead = leaves = leaf_depths = points = path_length = 0
+        imbalance = 0.0
+        splits = [0] * self.dimensions
+
+        stack = [(self, 0)] if self else []
+        while stack:
+            node, depth = stack.pop()
+            if depth == len(depths):
+                depths.append(0)
+            depths[depth] += 1
+
+            count = 1 + len(node.bucket or ())
+            points += count
+            path_length += count * (depth + 1)
+            dead += node.dead + sum(n.dead for n in node.bucket or ())
+
+            children = [c for c in (node.left, node.right) if c]
+            if not children:
+                leaves += 1
+                leaf_depths += depth
+                continue
+
+            splits[node.axis] += 1
+            if node.size:
+                largest = max(c.size for c in children)
+                imbalance = max(imbalance, largest / float(node.size))
+            for child in children:
+                stack.append((child, depth + 1))
+
+        balanced = _balanced_path_length(points, self.leaf_size)
+        return TreeStats(self.size, dead, depths, leaves,
+                         leaf_depths / float(leaves) if leaves else 0.0,
+                         len(depths) - 1, imbalance, splits,
+                         path_length / float(balanced) if points else 1.0)
+
+
+    def _check_cost(self, updates, path_length=0, replace=True):
+        """ Counts updates to the tree for its max_cost, see create()
+
+        path_length is added to the estimate of the TreeConfig. The cost of
+        the tree is checked once the estimate is too large, or once a
+        quarter of its points have been added or removed since the last
+        check. The highest subtrees whose cost (see TreeStats) is above
+        max_cost are then rebuilt, except small ones. The topmost node is
+        only rebuilt if replace is True, otherwise its subtrees are checked
+        instead. Returns the new root of the tree. """
+
+        config = self.config
+        if config.max_cost is None or not self:
+            return self
+
+        config.updates += updates
+        config.path_length += path_length
+        if config.updates < _COST_CHECK_INTERVAL * self.size and \
+                config.path_length <= config.max_path_length:
+            return self
+        config.updates = 0
+
+        _, lengths = self._path_lengths()
+        root = self
+        rebuilt = False
+        stack = [(None, self)]
+        while stack:
+            parent, node = stack.pop()
+            points, path_length = lengths[node]
+            if points < _COST_MIN_POINTS:
+                continue
+
+            if path_length > config.max_cost * _balanced_path_length(
+                    points, config.leaf_size) and \
+                    (parent is not None or replace):
+                root = node._rebuild_at(parent, root)
+                rebuilt = True
+                continue
+
+            stack.extend((node, c) for c in (node.left, node.right) if c)
+
+        # the preorder of the relinked tree, children after their parents,
+        # as rebuilt subtrees have dropped their dead nodes
+        if rebuilt:
+            nodes, lengths = root._path_lengths()
+            for node in reversed(nodes):
+                node._update_size()
+
+        points, config.path_length = lengths[root]
+        if replace:
+            config.max_path_length = config.max_cost * _balanced_path_length(
+                points, config.leaf_size)
+        else:
+            # the topmost node stays, so only the paths below it can get
+            # shorter until the next check that may replace it
+            config.max_path_length = points + sum(
+                config.max_cost * _balanced_path_length(
+                    lengths[child][0], config.leaf_size)
+                for child in (root.left, root.right) if child)
+        return root
+
+
+    def _path_lengths(self):
+        """ Returns the nodes of the subtree in preorder, and a dict with
+        the number of points of each of their subtrees and the sum of the
+        numbers of nodes from its root to them """
+
+        nodes = []
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            if node:
+                nodes.append(node)
+                stack.append(node.right)
+                stack.append(node.left)
+
+        # children before parents
+        lengths = {}
+        for node in reversed(nodes):
+            points = path_length = 1 + len(node.bucket or ())
+            for child in (node.left, node.right):
+                if child:
+                    child_points, child_length = lengths[child]
+                    points += child_points
+                    path_length += child_length + child_points
+            lengths[node] = points, path_length
+
+        return nodes, lengths
+
+
+    def rebalance(self):
+        """
+        Returns the (possibly new) root of the rebalanced tree
+
+        The new tree takes over the QueryCache of the tree, if it has one,
+        with a newer version.
+        """
+
+        self.config._changed()
+        tree = create([x.data for x in self.inorder() if not x.dead],
+                      dimensions=self.dimensions, leaf_size=self.leaf_size,
+                      dist=self.config.dist, alpha=self.config.alpha,
+                      max_dead=self.config.max_dead,
+                      max_cost=self.config.max_cost)
+        tree.config.version = self.config.version
+        tree.config.cache = self.config.cache
+        return tree
+
+
+    def axis_dist(self, point, axis):
+        """
+        Squared distance at the given axis between
+        the current Node and the given point
+        """
+        diff = self.data[axis] - point[axis]
+        return diff * diff
+
+
+    def dist(self, point):
+        """
+        Squared distance between the current Node
+        and the given point
+        """
+        return _squared_distance_function(self.dimensions, point)(self.data,
+                                                                  point)
+
+
+    def search_knn(self, point, k, dist=None, stats=None, eps=0,
+                   max_visits=None):
+        """ Return the k nearest neighbors of point and their distances
+
+        point must be an actual point, not a node.
+
+        k is the number of results to return. The actual results can be less
+        (if there aren't more nodes to return) or more in case of equal
+        distances.
+
+        dist is a Metric, or a distance function expecting two points and
+        returning a distance value. Distance values can be any comparable
+        type. It defaults to the distance function of the tree, or to the
+        squared euclidean distance. Subtrees are pruned by the bounds of a
+        Metric, and by squared euclidean distances otherwise, which is only
+        correct for distance functions that are never smaller.
+
+        If a SearchStats object is given as stats, the work of the search
+        is added to it.
+
+        The search can be made approximate for speed. With eps > 0 subtrees
+        are already skipped if they can't contain points that are closer by
+        a factor of (1 + eps) than the current results, so the i-th result
+        is at most (1 + eps) times farther away than the true i-th nearest
+        neighbor (for squared distances, (1 + eps) ** 2 times). max_visits
+        limits the number of visited nodes, the search then returns the
+        best results found so far.
+
+        The result is a KNNResult, an ordered list of (node, distance)
+        tuples whose exact attribute tells if the results are guaranteed
+        to be the nearest neighbors.
+        """
+
+        if k < 1:
+            raise ValueError("k must be greater than 0.")
+
+        if dist is None:
+            dist = self.config.dist
+
+        cache = self.config.cache
+        if cache is not None:
+            key = (self, 'knn', _point_key(point), k, dist, eps, max_visits)
+            result = cache.get(key, self.config.version)
+            if result is not None:
+                return KNNResult(result, result.exact)
+
+        start = _clock()
+        get_dist, metric = _distance_function(dist, point,
+                                              self.dimensions)
+        results = []
+
+        exact = self._search_node(point, k, results, get_dist,
+                                  itertools.count(), stats, eps, max_visits,
+                                  metric)
+        if stats is not None:
+            stats._searched(start)
+
+        # We sort the final result by the distance in the tuple
+        # (<KdNode>, distance).
+        result = KNNResult([(node, -d) for d, _, node in
+                            sorted(results, reverse=True)], exact)
+
+        if cache is not None:
+            cache.put(key, self.config.version, KNNResult(result, exact))
+
+        return result
+
+
+    def _search_node(self, point, k, results, get_dist, counter, stats=None,
+                     eps=0, max_visits=None, metric=None):
+        """ Collects the k nearest neighbors of point in the subtree
+
+        The subtree is traversed depth-first with an explicit stack, nearer
+        side of each splitting plane first. Every stack entry carries a lower
+        bound of the (squared) distance between point and the region of
+        space that the subtree covers, which is updated incrementally from
+        the per-axis offsets of the point to that region (Arya and Mount).
+        Subtrees whose region is farther away than the farthest result are
+        pruned. Distances of regions are bounded by metric, or by squared
+        euclidean distances if it is None.
+
+        Returns False if eps or max_visits caused a subtree to be skipped
+        that might have contained one of the k nearest neighbors. """
+
+        exact = True
+        factor = (1 + eps) ** (2 if metric is None else metric.power)
+        visited = evals = pruned = explored = max_depth = 0
+        stack = [(self, 0, (0,) * self.dimensions, 0, False)]
+        while stack:
+            node, region_dist, offsets, depth, is_far = stack.pop()
+
+            if len(results) >= k:
+                if -region_dist <= results[0][0]:
+                    pruned += 1
+                    continue
+                if -region_dist * factor <= results[0][0]:
+                    exact = False
+                    pruned += 1
+                    continue
+
+            if not node:
+                continue
+
+            if max_visits is not None and visited >= max_visits:
+                exact = False
+                break
+
+            visited += 1
+            explored += is_far
+            if depth > max_depth:
+                max_depth = depth
+
+            # Add current node to the priority queue if it closer than
+            # at least one point in the queue.
+            #
+            # If the heap is at its capacity, we need to check if the
+            # current node is closer than the current farthest node, and if
+            # so, replace it.
+            if not node.dead:
+                evals += 1
+                nodeDist = get_dist(node)
+                item = (-nodeDist, next(counter), node)
+                if len(results) >= k:
+                    if -nodeDist > results[0][0]:
+                        heapq.heapreplace(results, item)
+                else:
+                    heapq.heappush(results, item)
+
+            # The nodes in a bucket are scanned without any pruning
+            for member in node.bucket or ():
+                if member.dead:
+                    continue
+                evals += 1
+                memberDist = get_dist(member)
+                if len(results) >= k:
+                    if memberDist < -results[0][0]:
+                        heapq.heapreplace(results,
+                                          (-memberDist, next(counter), member))
+                else:
+                    heapq.heappush(results,
+                                   (-memberDist, next(counter), member))
+
+            axis = node.axis
+            # get the splitting plane
+            split_plane = node.data[axis]
+            # get the squared distance between the point and the splitting
+            # plane (squared since all distances are squared).
+            plane_dist = point[axis] - split_plane
+            if metric is None:
+                plane_dist2 = plane_dist * plane_dist
+            else:
+                plane_dist2 = metric.axis_dist(axis, plane_dist)
+
+            # Search the side of the splitting plane that the point is in
+            # first. The region on the other side is at least as far away
+            # as the splitting plane along this axis, which replaces the
+            # previous offset on this axis.
+            if point[axis] < split_plane:
+                near, far = node.left, node.right
+            else:
+                near, far = node.right, node.left
+
+            if far is not None:
+                if metric is None:
+                    far_dist = region_dist - offsets[axis] + plane_dist2
+                else:
+                    far_dist = metric.region_dist(region_dist, offsets, axis,
+                                                  plane_dist2)
+                far_offsets = offsets[:axis] + (plane_dist2,) + \
+                              offsets[axis + 1:]
+                stack.append((far, far_dist, far_offsets, depth + 1, True))
+            if near is not None:
+                stack.append((near, region_dist, offsets, depth + 1, False))
+
+        if stats is not None:
+            stats._add(visited, evals, pruned, explored, max_depth)
+
+        return exact
+
+
+    @require_axis
+    def search_nn(self, point, dist=None, stats=None, eps=0,
+                  max_visits=None):
+        """
+        Search the nearest node of the given point
+
+        point must be an actual point, not a node. The nearest node to the
+        point is returned. If a location of an actual node is used, the Node
+        with this location will be returned (not its neighbor).
+
+        dist is a distance function, expecting two points and returning a
+        distance value. Distance values can be any comparable type.
+
+        stats, eps and max_visits are passed on to search_knn(), which also
+        tells whether an approximate result is exact.
+
+        The result is a (node, distance) tuple.
+        """
+
+        return next(iter(self.search_knn(point, 1, dist, stats, eps,
+                                         max_visits)), None)
+
+
+    @require_axis
+    def iter_nearest(self, point, dist=None, stats=None):
+        """ Iterates over the nodes in the order of their distance to point
+
+        Yields (node, distance) tuples, nearest first. Nodes are only
+        visited when they are needed for the next result, so the iteration
+        can be stopped at any time, eg with itertools.islice() or after a
+        number of results that pass a filter.
+
+        dist and stats are the same as for search_knn(). """
+
+        if dist is None:
+            dist = self.config.dist
+
+        get_dist, metric = _distance_function(dist, point,
+                                              self.dimensions)
+
+        # Best-first search: the heap holds nodes keyed by the distance of
+        # their point, and subtrees keyed by the distance to their region
+        # (see _search_node()), points before regions on ties. A point
+        # is yielded once no region is closer than it.
+        if stats is not None:
+            stats.searches += 1
+
+        counter = itertools.count()
+        heap = [(0, 1, next(counter), self, (0,) * self.dimensions)]
+        while heap:
+            node_dist, is_region, _, node, offsets = heapq.heappop(heap)
+
+            if not is_region:
+                yield node, node_dist
+                continue
+
+            if not node:
+                continue
+
+            if stats is not None:
+                stats.nodes_visited += 1
+
+            for n in itertools.chain((node, ), node.bucket or ()):
+                if not n.dead:
+                    if stats is not None:
+                        stats.distance_evals += 1
+                    heapq.heappush(heap, (get_dist(n), 0, next(counter), n,
+                                          None))
+
+            axis = node.axis
+            plane_dist = point[axis] - node.data[axis]
+            if metric is None:
+                plane_dist2 = plane_dist * plane_dist
+            else:
+                plane_dist2 = metric.axis_dist(axis, plane_dist)
+
+            if point[axis] < node.data[axis]:
+                near, far = node.left, node.right
+            else:
+                near, far = node.right, node.left
+
+            if near:
+                heapq.heappush(heap, (node_dist, 1, next(counter), near,
+                                      offsets))
+            if far:
+                if metric is None:
+                    far_dist = node_dist - offsets[axis] + plane_dist2
+                else:
+                    far_dist = metric.region_dist(node_dist, offsets, axis,
+                                                  plane_dist2)
+                far_offsets = offsets[:axis] + (plane_dist2,) + \
+                              offsets[axis + 1:]
+                heapq.heappush(heap, (far_dist, 1, next(counter), far,
+                                      far_offsets))
+
+
+    def _search_nn_dist(self, point, dist, results, get_dist, stats=None,
+                        metric=None):
+        """ Collects the points of the subtree within dist of point
+
+        The subtree is traversed with an explicit stack, in the same order
+        as a recursive search would visit it. The far side of a splitting
+        plane is pruned by the metric's distance to the plane, if a Metric
+        is given. """
+
+        visited = evals = pruned = explored = max_depth = 0
+        stack = [(self, 0)]
+        while stack:
+            node, depth = stack.pop()
+            if not node:
+                continue
+
+            visited += 1
+            if depth > max_depth:
+                max_depth = depth
+
+            if not node.dead:
+                evals += 1
+                if get_dist(node) < dist:
+                    results.append(node.data)
+
+            for member in node.bucket or ():
+                if not member.dead:
+                    evals += 1
+                    if get_dist(member) < dist:
+                        results.append(member.data)
+
+            # get the splitting plane
+            split_plane = node.data[node.axis]
+            right_is_far = point[node.axis] < split_plane
+
+            if metric is None:
+                search_right = point[node.axis] >= split_plane - dist
+                search_left = point[node.axis] <= split_plane + dist
+            else:
+                near_plane = metric.axis_dist(
+                    node.axis, point[node.axis] - split_plane) < dist
+                search_right = near_plane or not right_is_far
+                search_left = near_plane or right_is_far
+
+            # Search the side of the splitting plane that the point is in
+            if node.right is not None:
+                if search_right:
+                    stack.append((node.right, depth + 1))
+                    explored += right_is_far
+                else:
+                    pruned += 1
+            if node.left is not None:
+                if search_left:
+                    stack.append((node.left, depth + 1))
+                    explored += not right_is_far
+                else:
+                    pruned += 1
+
+        if stats is not None:
+            stats._add(visited, evals, pruned, explored, max_depth)
+
+
+    @require_axis
+    def search_nn_dist(self, point, distance, best=None, stats=None,
+                       metric=None):
+        """
+        Search the n nearest nodes of the given point which are within given
+        distance
+
+        point must be a location, not a node. A list containing the n nearest
+        nodes to the point within the distance will be returned.
+
+        stats is a SearchStats object, see search_knn().
+
+        metric is the Metric or distance function that distance is measured
+        in, like the dist of search_knn(), and defaults to the one of the
+        tree. Only a Metric prunes subtrees by its own distances, otherwise
+        they are pruned by the difference along the split axis.
+        """
+
+        if metric is None:
+            metric = self.config.dist
+
+        cache = self.config.cache
+        if cache is not None:
+            key = (self, 'nn_dist', _point_key(point), distance, metric)
+            results = cache.get(key, self.config.version)
+            if results is not None:
+                return list(results)
+
+        start = _clock()
+        results = []
+        get_dist, metric = _distance_function(metric, point, self.dimensions)
+
+        self._search_nn_dist(point, distance, results, get_dist, stats,
+                             metric)
+        if stats is not None:
+            stats._searched(start)
+
+        if cache is not None:
+            cache.put(key, self.config.version, list(results))
+
+        return results
+
+
+    @require_axis
+    def search_box(self, lower, upper, stats=None):
+        """ Returns the points within an axis-aligned box
+
+        lower and upper are the corners of the box, the bounds are
+        inclusive on every axis. stats is a SearchStats object, see
+        search_knn(). """
+
+        results = []
+        self._search_box(lower, upper, results, stats)
+        return results
+
+
+    @require_axis
+    def count_box(self, lower, upper, stats=None):
+        """ Returns the number of points within an axis-aligned box
+
+        The arguments are the same as for search_box(). Subtrees that lie
+        completely inside the box are counted by their size, so only the
+        nodes near the border of the box are visited. """
+
+        return self._search_box(lower, upper, None, stats)
+
+
+    def _search_box(self, lower, upper, results, stats):
+        """ Counts the points of the subtree within the box from lower to
+        upper, and appends them to results unless it is None
+
+        Every stack entry carries the cell of its subtree, the box bounded by
+        the splitting planes above it. Subtrees whose cell does not intersect
+        the box are not pushed, subtrees whose cell is inside the box are
+        taken as a whole. """
+
+        start = _clock()
+        check_dimensionality([lower, upper], self.dimensions)
+        axes = range(self.dimensions)
+        inf = float('inf')
+
+        count = visited = pruned = max_depth = 0
+        stack = [(self, (-inf,) * self.dimensions, (inf,) * self.dimensions,
+                  0)]
+        while stack:
+            node, cell_lower, cell_upper, depth = stack.pop()
+            if not node:
+                continue
+
+            if all(lower[i] <= cell_lower[i] and cell_upper[i] <= upper[i]
+                   for i in axes):
+                count += node.size
+                if results is not None:
+                    results.extend(n.data for n in node.live_nodes())
+                continue
+
+            visited += 1
+            if depth > max_depth:
+                max_depth = depth
+
+            for n in itertools.chain((node, ), node.bucket or ()):
+                if not n.dead and \
+                        all(lower[i] <= n.data[i] <= upper[i] for i in axes):
+                    count += 1
+                    if results is not None:
+                        results.append(n.data)
+
+            axis = node.axis
+            split_plane = node.data[axis]
+            if node.right:
+                if split_plane <= upper[axis]:
+                    stack.append((node.right, cell_lower[:axis] +
+                                  (split_plane, ) + cell_lower[axis + 1:],
+                                  cell_upper, depth + 1))
+                else:
+                    pruned += 1
+            if node.left:
+                if split_plane >= lower[axis]:
+                    stack.append((node.left, cell_lower, cell_upper[:axis] +
+                                  (split_plane, ) + cell_upper[axis + 1:],
+                                  depth + 1))
+                else:
+                    pruned += 1
+
+        if stats is not None:
+            stats._add(visited, 0, pruned, 0, max_depth)
+            stats._searched(start)
+
+        return count
+
+
+    @require_axis
+    def save(self, path):
+        """ Writes the tree to a file in the format of FrozenKDTree
+
+        The file can be loaded with load(). The points must have numeric
+        coordinates, payloads are not saved. """
+
+        with open(path, 'wb') as f:
+            for chunk in _frozen_chunks(self):
+                f.write(memoryview(chunk).cast('B'))
+
+
+    @require_axis
+    def freeze(self, shared=False):
+        """ Returns a read-only copy of the tree as a FrozenKDTree
+
+        The points must have numeric coordinates, dead nodes are left out.
+        If shared is True, the
+        copy is placed in a new block of shared memory, which other
+        processes can attach() to by the name of the FrozenKDTree. The
+        process that froze the tree has to unlink() it when it is no longer
+        needed. """
+
+        chunks = [memoryview(c).cast('B') for c in _frozen_chunks(self)]
+        size = sum(len(c) for c in chunks)
+
+        shm = None
+        if not shared:
+            buf = bytearray(size)
+        elif shared_memory is None:
+            raise ImportError('shared memory requires Python 3.8 or later')
+        else:
+            shm = shared_memory.SharedMemory(create=True, size=size)
+            buf = shm.buf
+
+        offset = 0
+        for chunk in chunks:
+            buf[offset:offset + len(chunk)] = chunk
+            offset += len(chunk)
+
+        return FrozenKDTree(buf, shm)
+
+
+    @require_axis
+    def is_valid(self):
+        """ Checks recursively if the tree is valid
+
+        It is valid if each node splits correctly """
+
+        if not self:
+            return True
+
+        if self.left and self.data[self.axis] < self.left.data[self.axis]:
+            return False
+
+        if self.right and self.data[self.axis] > self.right.data[self.axis]:
+            return False
+
+        return all(c.is_valid() for c, _ in self.children) or self.is_leaf
+
+
+    def extreme_child(self, sel_func, axis):
+        """ Returns a child of the subtree and its parent
+
+        The child is selected by sel_func which is either min or max
+        (or a different function with similar semantics).
+
+        For min and max, only one side of a node that splits on axis can
+        contain the extreme point, so the other side is skipped. In a
+        balanced tree of k dimensions this visits O(n ** (1 - 1 / k))
+        nodes instead of all of them. """
+
+        prune_right = sel_func is min
+        prune_left = sel_func is max
+
+        candidates = []
+        # we don't know our parent, so we include None
+        stack = [(self, None)]
+        while stack:
+            node, parent = stack.pop()
+            if not node:
+                continue
+
+            candidates.append((node, parent))
+
+            # nodes in a bucket are returned with their leaf as "parent"
+            candidates.extend((n, node) for n in node.bucket or ())
+
+            on_axis = node.axis == axis
+            if node.right and not (prune_right and on_axis):
+                stack.append((node.right, node))
+            if node.left and not (prune_left and on_axis):
+                stack.append((node.left, node))
+
+        if not candidates:
+            return None, None
+
+        return sel_func(candidates, key=lambda c: c[0].data[axis])
+
+
+
+def create(point_list=None, dimensions=None, axis=0, sel_axis=None,
+           leaf_size=1, dist=None, workers=None, alpha=None, max_dead=None,
+           cache_size=None, max_cost=None):
+    """ Creates a kd-tree from a list of points
+
+    All points in the list must be of the same dimensionality.
+
+    If no point_list is given, an empty tree is created. The number of
+    dimensions has to be given instead.
+
+    If both a point_list and dimensions are given, the numbers must agree.
+
+    Axis is the axis on which the root-node should split.
+
+    sel_axis(axis) is used when creating subnodes of a node. It receives the
+    axis of the parent node and returns the axis of the child node.
+
+    leaf_size is the number of points a leaf can hold. With a leaf_size
+    greater than 1, the points of a leaf are kept in a bucket and are
+    scanned together instead of being split further.
+
+    dist is the Metric or distance function used by searches that are not
+    given one, see KDNode.search_knn().
+
+    workers is the number of processes that compute the layout of large
+    trees. This requires numpy and points with numeric coordinates, and
+    results in the same tree as a build in a single process. The nodes
+    are always created in the calling process. Without numpy, for other
+    points and for fewer than 1000 points, workers is ignored and the
+    layout is computed in the calling process.
+
+    alpha turns on the self-balancing of add() and remove(). When one of
+    the subtrees of a node holds more than alpha times the points of the
+    node (0.5 < alpha < 1), only the subtree of that node is rebuilt. This
+    bounds the height of the tree to about log(n) / log(1 / alpha), at an
+    amortized cost of O(log n) rebuilt points per update. Smaller values
+    keep the tree more balanced and rebuild more often, 0.7 is a good
+    start.
+
+    max_dead turns on lazy deletion. remove() then only marks nodes as
+    dead, and compacts the tree once more than max_dead (0 < max_dead < 1)
+    of its nodes are dead. Each compaction takes O(n log n), which is
+    O(log n / max_dead) amortized over the removals before it.
+
+    cache_size turns on a QueryCache of that many results for search_knn(),
+    search_nn() and search_nn_dist(). Repeated searches for the same point
+    and arguments then return the stored result as long as the tree has
+    not changed since. The cache is available as tree.config.cache.
+
+    max_cost turns on automatic rebuilding. The expected cost of searches
+    (see KDNode.stats()) is checked for every subtree whenever a quarter
+    of the points of the tree have been added or removed since the last
+    check, or earlier if add() puts points so deep that the cost of the
+    whole tree may have grown past max_cost (> 1). The highest subtrees
+    whose cost is more than max_cost times that of a balanced tree are
+    rebuilt, which is the whole tree if it is too costly as a whole. A
+    check takes O(n). As add() does not return the root, checks it runs
+    keep the topmost node and only rebuild the subtrees below it.
+
+    All nodes of the tree share these settings through one TreeConfig. """
+
+    if leaf_size < 1:
+        raise ValueError('leaf_size must be greater than 0.')
+
+    if alpha is not None and not 0.5 < alpha < 1:
+        raise ValueError('alpha must be between 0.5 and 1.')
+
+    if max_dead is not None and not 0 < max_dead < 1:
+        raise ValueError('max_dead must be between 0 and 1.')
+
+    if max_cost is not None and not max_cost > 1:
+        raise ValueError('max_cost must be greater than 1.')
+
+    if point_list is not None:
+        point_list = list(point_list)
+
+    if not point_list and not dimensions:
+        raise ValueError('either point_list or dimensions must be provided')
+
+    elif point_list:
+        dimensions = check_dimensionality(point_list, dimensions)
+
+    # by default cycle through the axis
+    sel_axis = sel_axis or _NextAxis(dimensions)
+
+    cache = QueryCache(cache_size) if cache_size is not None else None
+    config = TreeConfig(dimensions, sel_axis, leaf_size, dist, alpha,
+                        max_dead, cache, max_cost)
+
+    if not point_list:
+        return KDNode(axis=axis, config=config)
+
+    layout = _median_layout(point_list, dimensions, axis, sel_axis, workers)
+    return _build_nodes(point_list, layout, axis, config)
+
+
+class _NextAxis(object):
+    """ The default sel_axis, which cycles through the axes
+
+    Unlike a lambda, it can be pickled together with the tree. """
+
+    def __init__(self, dimensions):
+        self.dimensions = dimensions
+
+    def __call__(self, prev_axis):
+        return (prev_axis + 1) % self.dimensions
+
+
+
+def _level_axes(n, axis, sel_axis):
+    """ Returns the split axis of each level of a tree with n points
+
+    sel_axis only depends on the axis of the parent, so all nodes at the
+    same depth split on the same axis. """
+
+    axes = []
+    while n:
+        axes.append(axis)
+        axis = sel_axis(axis)
+        n //= 2
+    return axes
+
+
+_PRESORT_MIN_POINTS = 1000
+
+
+def _median_layout(point_list, dimensions, axis, sel_axis, workers=None):
+    """ Returns the point indices of a median-split tree in inorder
+
+    The node of the subtree over the positions [lo, hi) of the layout is at
+    position (lo + hi) // 2, its subtrees cover the positions left and right
+    of it. """
+
+    coords = None
+    # for small point lists, the overhead of numpy outweighs sorting each
+    # level separately
+    if np is not None and len(point_list) >= _PRESORT_MIN_POINTS:
+        try:
+            coords = np.array(point_list)
+        except (TypeError, ValueError):
+            pass
+
+    if coords is not None and coords.dtype.kind in 'biuf' and \
+            coords.shape == (len(point_list), dimensions):
+        axes = _level_axes(len(point_list), axis, sel_axis)
+        if workers is not None and workers > 1:
+            return _median_layout_parallel(coords, axes, workers).tolist()
+        return _median_layout_presorted(coords, axes).tolist()
+
+    return _median_layout_sorted(point_list, dimensions, axis, sel_axis)
+
+
+def _median_layout_presorted(coords, axes):
+    """ Computes the layout of _median_layout() in O(n log n) using numpy
+
+    axes are the split axes of the levels of the tree, see _level_axes().
+
+    The points are sorted only once along every axis. Then, for every level
+    of the tree, each of these orders is partitioned around the medians of
+    the level, without changing the relative order of the points on either
+    side. All subtrees of a level are processed together in O(n) vectorized
+    operations per axis. """
+
+    n, dimensions = coords.shape
+    orders = [np.argsort(coords[:, a], kind='stable')
+              for a in range(dimensions)]
+
+    positions = np.arange(n, dtype=np.intp)
+    # the subtree [lo, hi) that each position currently belongs to;
+    # positions that already hold a node are subtrees of their own
+    lo = np.zeros(n, dtype=np.intp)
+    hi = np.full(n, n, dtype=np.intp)
+    side = np.empty(n, dtype=np.int8)
+
+    # a tree of n points has n.bit_length() levels
+    for level_axis in axes[:n.bit_length()]:
+        mid = (lo + hi) // 2
+        side[orders[level_axis]] = np.sign(positions - mid)
+
+        for a in range(dimensions):
+            if a == level_axis:
+                continue
+
+            order = orders[a]
+            point_side = side[order]
+            is_left, is_right = point_side < 0, point_side > 0
+
+            # the rank of a point among the points on the same side of the
+            # same subtree is the number of such points before it
+            left_before = np.concatenate(([0], np.cumsum(is_left)))
+            right_before = np.concatenate(([0], np.cumsum(is_right)))
+            new_pos = np.where(is_left,
+                lo + left_before[:-1] - left_before[lo],
+                np.where(is_right,
+                    mid + 1 + right_before[:-1] - right_before[lo],
+                    mid))
+
+            reordered = np.empty_like(order)
+            reordered[new_pos] = order
+            orders[a] = reordered
+
+        lo, hi = np.where(positions < mid, lo, mid + 1), \
+                 np.where(positions < mid, mid, hi)
+        is_mid = positions == mid
+        lo[is_mid], hi[is_mid] = positions[is_mid], positions[is_mid] + 1
+
+    return orders[0]
+
+
+def _median_layout_parallel(coords, axes, workers):
+    """ Computes the layout of _median_layout() with a pool of processes
+
+    The top levels of the tree are split in this process, by selecting the
+    median of each subtree in O(n) with ties broken by the index of the
+    points, as the stable sorts of _median_layout_presorted() do. The
+    subtrees below are laid out by the workers, which only receive their
+    coordinates and split axes. """
+
+    import multiprocessing
+
+    n = len(coords)
+    # a few subtrees per worker, so that they are evenly loaded
+    depth = min(len(axes) - 1, int(math.ceil(math.log(workers * 4, 2))))
+    layout = np.empty(n, dtype=np.intp)
+
+    tasks = []
+    stack = [(np.arange(n), 0, 0)]
+    while stack:
+        indices, lo, level = stack.pop()
+        if not len(indices):
+            continue
+
+        if level == depth:
+            tasks.append((indices, lo, level))
+            continue
+
+        values = coords[indices, axes[level]]
+        median = len(indices) // 2
+        split = np.partition(values, median)[median]
+        less, equal = values < split, values == split
+        node = indices[equal][median - np.count_nonzero(less)]
+        layout[lo + median] = node
+
+        left = less | (equal & (indices < node))
+        right = ~left & (indices != node)
+        stack.append((indices[left], lo, level + 1))
+        stack.append((indices[right], lo + median + 1, level + 1))
+
+    pool = multiprocessing.Pool(workers)
+    try:
+        results = pool.map(_median_layout_task,
+                           [(coords[indices], axes[level:])
+                            for indices, lo, level in tasks])
+    finally:
+        pool.close()
+        pool.join()
+
+    for (indices, lo, _), subtree_layout in zip(tasks, results):
+        layout[lo:lo + len(indices)] = indices[subtree_layout]
+
+    return layout
+
+
+def _median_layout_task(task):
+    """ Lays out a subtree in a worker of _median_layout_parallel() """
+
+    coords, axes = task
+    return _median_layout_presorted(coords, axes)
+
+
+def _median_layout_sorted(point_list, dimensions, axis, sel_axis):
+    """ Computes the layout of _median_layout() by sorting every subtree """
+
+    coords = [[point[a] for point in point_list] for a in range(dimensions)]
+    layout = [None] * len(point_list)
+
+    stack = [(list(range(len(point_list))), 0, axis)]
+    while stack:
+        indices, lo, axis = stack.pop()
+        if not indices:
+            continue
+
+        indices.sort(key=coords[axis].__getitem__)
+        median = len(indices) // 2
+        layout[lo + median] = indices[median]
+
+        child_axis = sel_axis(axis)
+        stack.append((indices[:median], lo, child_axis))
+        stack.append((indices[median + 1:], lo + median + 1, child_axis))
+
+    return layout
+
+
+@contextmanager
+def _gc_paused():
+    """ Disables the cyclic garbage collector for the block
+
+    The previous state is restored afterwards, so the collector stays
+    disabled if it was disabled before. The state is global to the process,
+    so this is not thread-safe: other threads do not collect cycles during
+    the block, and a thread that changes the state at the same time can have
+    its change undone. """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def _build_nodes(point_list, layout, axis, config, nodes=None):
+    """ Creates the KDNodes of a tree from a layout in inorder
+
+    If nodes are given, the node nodes[i] is relinked for the point
+    point_list[i] instead of creating a new one. Subtrees without points are
+    represented by None. """
+
+    sel_axis, leaf_size = config.sel_axis, config.leaf_size
+
+    if nodes is None:
+        get_node = lambda i, axis: KDNode(point_list[i], axis=axis,
+                                          config=config)
+    else:
+        def get_node(i, axis):
+            node = nodes[i]
+            node.left = node.right = node.bucket = None
+            node.axis = axis
+            node.size = node.levels = 1
+            node.dead_size = 0
+            return node
+
+    # Nodes don't form reference cycles, so the cyclic garbage collector
+    # would only waste time on the many objects created here
+    with _gc_paused():
+        root = None
+        stack = [(None, None, 0, len(layout), axis)]
+        while stack:
+            parent, is_left, lo, hi, axis = stack.pop()
+
+            mid = (lo + hi) // 2
+            node = get_node(layout[mid], axis)
+            node.size = hi - lo
+            # the left half is never smaller than the right one, and is
+            # halved until it fits into a leaf
+            node.levels = ((hi - lo) // (leaf_size + 1)).bit_length() + 1
+            if parent is None:
+                root = node
+            elif is_left:
+                parent.left = node
+            else:
+                parent.right = node
+
+            child_axis = sel_axis(axis)
+
+            if leaf_size > 1 and hi - lo <= leaf_size:
+                node.bucket = [get_node(i, child_axis)
+                               for i in layout[lo:mid] + layout[mid + 1:hi]]
+                node.bucket = node.bucket or None
+                continue
+
+            if mid + 1 < hi:
+                stack.append((node, False, mid + 1, hi, child_axis))
+            if lo < mid:
+                stack.append((node, True, lo, mid, child_axis))
+
+    return root
+
+
+def check_dimensionality(point_list, dimensions=None):
+    dimensions = dimensions or len(point_list[0])
+    for p in point_list:
+        if len(p) != dimensions:
+            raise ValueError('All Points in the point_list must have the same dimensionality')
+
+    return dimensions
+
+
+
+def level_order(tree, include_all=False):
+    """ Returns an iterator over the tree in level-order
+
+    If include_all is set to True, empty parts of the tree are filled
+    with dummy entries and the iterator becomes infinite. """
+
+    q = deque()
+    q.append(tree)
+    while q:
+        node = q.popleft()
+        yield node
+
+        if include_all or node.left:
+            q.append(node.left or node.__class__())
+
+        if include_all or node.right:
+            q.append(node.right or node.__class__())
+
+
+
+def visualize(tree, max_level=100, node_width=10, left_padding=5):
+    """ Prints the tree to stdout """
+
+    height = min(max_level, tree.height()-1)
+    max_width = pow(2, height)
+
+    per_level = 1
+    in_level  = 0
+    level     = 0
+
+    for node in level_order(tree, include_all=True):
+
+        if in_level == 0:
+            print()
+            print()
+            print(' '*left_padding, end=' ')
+
+        width = int(max_width*node_width/per_level)
+
+        node_str = (str(node.data) if node else '').center(width)
+        print(node_str, end=' ')
+
+        in_level += 1
+
+        if in_level == per_level:
+            in_level   = 0
+            per_level *= 2
+            level     += 1
+
+        if level > height:
+            break
+
+    print()
     print()
-    print()
+
+
+
+class KDForest(object):
+    """ A growing set of points, kept in balanced kd-trees
+
+    Adding points to a KDNode one by one can make it deep and unbalanced. A
+    KDForest instead keeps its points in a series of trees built by
+    create(), following the logarithmic method of Bentley and Saxe: the
+    i-th tree in trees is either None or holds at most 2 ** i points. Like
+    a binary counter, adding a point merges it with the trees 0, 1, ...
+    into a single new tree, until a free slot is found. Every point is
+    rebuilt O(log n) times, so adding takes O(log(n) ** 2) amortized, and
+    all trees are balanced.
+
+    Removed points are only marked as dead, and are dropped when their
+    tree is merged. Once half of the nodes are dead, all trees are rebuilt
+    from the remaining ones.
+
+    Searches search all of the O(log n) trees and merge their results.
+    When trees are merged, their nodes are relinked into the new tree, so
+    references to nodes stay valid. """
+
+    def __init__(self, point_list=None, dimensions=None, sel_axis=None,
+                 leaf_size=1, dist=None):
+        """ Creates a forest from a list of points
+
+        If no point_list is given, the number of dimensions has to be given
+        instead. sel_axis, leaf_size and dist are used for all trees, see
+        create(). All trees share one TreeConfig. """
+
+        if leaf_size < 1:
+            raise ValueError('leaf_size must be greater than 0.')
+
+        point_list = list(() if point_list is None else point_list)
+        if not point_list and not dimensions:
+            raise ValueError('either point_list or dimensions must be provided')
+
+        if point_list:
+            dimensions = check_dimensionality(point_list, dimensions)
+
+        self.config = TreeConfig(dimensions, sel_axis or _NextAxis(dimensions),
+                                 leaf_size, dist)
+        self._fill(point_list)
+
+
+    dimensions = _config_property('dimensions')
+
+
+    def __len__(self):
+        return self._size
+
+
+    def __repr__(self):
+        return '<%(cls)s - %(size)d points in %(trees)d trees>' % \
+            dict(cls=self.__class__.__name__, size=self._size,
+                 trees=sum(tree is not None for tree in self.trees))
+
+
+    def _build(self, point_list, nodes=None):
+        """ Builds a tree of the points, relinking nodes if given """
+
+        layout = _median_layout(point_list, self.dimensions, 0,
+                                self.config.sel_axis)
+        return _build_nodes(point_list, layout, 0, self.config, nodes)
+
+
+    def _fill(self, point_list, nodes=None):
+        """ Replaces the trees by new ones of the points, relinking nodes if
+        given, with one tree for every bit set in the number of points """
+
+        self.trees = []
+        self._size = len(point_list)
+
+        start = 0
+        for i in range(len(point_list).bit_length()):
+            if len(point_list) >> i & 1:
+                end = start + 2 ** i
+                self.trees.append(self._build(
+                    point_list[start:end],
+                    None if nodes is None else nodes[start:end]))
+                start = end
+            else:
+                self.trees.append(None)
+
+
+    def add(self, point):
+        """ Adds a point to the forest and returns its node """
+
+        check_dimensionality([point], self.dimensions)
+
+        node = KDNode(point, config=self.config)
+        nodes = [node]
+        for i, tree in enumerate(self.trees):
+            if tree is None:
+                break
+
+            nodes.extend(tree.live_nodes())
+            self.trees[i] = None
+        else:
+            i = len(self.trees)
+            self.trees.append(None)
+
+        self.trees[i] = self._build([n.data for n in nodes], nodes)
+        self._size += 1
+        return node
+
+
+    def remove(self, point, node=None):
+        """ Removes a point from the forest and returns its node
+
+        The node is only marked as dead, and searches skip it. The "node"
+        parameter is used for checking the identity like in
+        KDNode.remove(). Returns None if there is no such point. """
+
+        for tree in self.trees:
+            removed = tree._mark_dead(point, node) if tree else None
+            if removed is not None:
+                break
+        else:
+            return None
+
+        self._size -= 1
+        dead = sum(tree.dead_size for tree in self.trees if tree)
+        if dead > self._size:
+            nodes = [n for tree in self.trees if tree
+                     for n in tree.live_nodes()]
+            self._fill([n.data for n in nodes], nodes)
+        return removed
+
+
+    def search_knn(self, point, k, dist=None, stats=None):
+        """ Return the k nearest neighbors of point and their distances
+
+        The arguments and the result are the same as for KDNode.search_knn().
+        The largest trees are searched first, and all trees share the
+        results found so far, so that the smaller ones are mostly pruned. """
+
+        if k < 1:
+            raise ValueError("k must be greater than 0.")
+
+        if dist is None:
+            dist = self.config.dist
+
+        start = _clock()
+        get_dist, metric = _distance_function(dist, point,
+                                              self.dimensions)
+        results = []
+        counter = itertools.count()
+        for tree in reversed(self.trees):
+            if tree is not None:
+                tree._search_node(point, k, results, get_dist, counter,
+                                  stats, metric=metric)
+        if stats is not None:
+            stats._searched(start)
+
+        return KNNResult([(node, -d) for d, _, node in
+                          sorted(results, reverse=True)])
+
+
+    def search_nn(self, point, dist=None, stats=None):
+        """ Search the nearest node of the given point
+
+        The result is a (node, distance) tuple, or None if the forest is
+        empty. """
+
+        return next(iter(self.search_knn(point, 1, dist, stats)), None)
+
+
+    def search_nn_dist(self, point, distance, stats=None, metric=None):
+        """ Search the points within the given distance of point
+
+        See KDNode.search_nn_dist(). """
+
+        if metric is None:
+            metric = self.config.dist
+
+        start = _clock()
+        get_dist, metric = _distance_function(metric, point, self.dimensions)
+
+        results = []
+        for tree in self.trees:
+            if tree is not None:
+                tree._search_nn_dist(point, distance, results, get_dist,
+                                     stats, metric)
+        if stats is not None:
+            stats._searched(start)
+        return results
+
+
+
+class FlatKDTree(object):
+    """ An array-backed kd-tree
+
+    Instead of one Python object per point, all coordinates are stored in a
+    single contiguous (n, d) numpy array and the tree structure is kept in
+    index arrays (split axis, split value, left and right child). Leaves are
+    buckets of up to leaf_size points, stored as ranges of a permutation
+    array, which are scanned with vectorized numpy operations.
+
+    Points are referred to by their row index in the coordinate array. Row
+    indices are stable: adding or removing points never moves other points.
+    Searches therefore return row indices instead of nodes; the coordinates
+    of a result can be looked up in tree.data.
+
+    numpy is required to use this class. """
+
+    def __init__(self, points=None, dimensions=None, leaf_size=16, axis=0):
+        """ Creates a tree from an (n, d) array-like of points
+
+        If no points are given, an empty tree is created and the number of
+        dimensions has to be given instead. axis is the axis on which the
+        root node splits; subnodes cycle through the axes. """
+
+        if np is None:
+            raise ImportError('FlatKDTree requires numpy')
+
+        if leaf_size < 1:
+            raise ValueError('leaf_size must be greater than 0.')
+
+        if points is not None:
+            points = np.array(points, dtype=np.float64, ndmin=2)
+            if not points.size:
+                points = None
+
+        if points is None and not dimensions:
+            raise ValueError('either points or dimensions must be provided')
+
+        if points is not None:
+            if points.ndim != 2 or (dimensions and
+                                    points.shape[1] != dimensions):
+                raise ValueError('All Points in the point_list must have '
+                                 'the same dimensionality')
+            dimensions = points.shape[1]
+        else:
+            points = np.empty((0, dimensions), dtype=np.float64)
+
+        self.dimensions = dimensions
+        self.leaf_size = leaf_size
+
+        n = len(points)
+        self._points = points
+        self._n_rows = n
+        self._free_rows = []
+        self._size = n
+
+        self._axis = np.zeros(0, dtype=np.intp)
+        self._split = np.zeros(0, dtype=np.float64)
+        self._left = np.zeros(0, dtype=np.intp)
+        self._right = np.zeros(0, dtype=np.intp)
+        self._start = np.zeros(0, dtype=np.intp)
+        self._count = np.zeros(0, dtype=np.intp)
+        self._n_nodes = 0
+        self._free_nodes = []
+
+        self._perm = np.zeros(0, dtype=np.intp)
+        self._n_slots = 0
+        self._free_ranges = []
+
+        self._build(np.arange(n, dtype=np.intp), axis)
+
+
+    def __len__(self):
+        return self._size
+
+
+    def __repr__(self):
+        return '<%(cls)s - %(size)d points, %(dims)d dimensions>' % \
+            dict(cls=self.__class__.__name__, size=self._size,
+                 dims=self.dimensions)
+
+
+    @property
+    def data(self):
+        """ The coordinate array, indexed by row
+
+        Rows of removed points are not cleared, use indices() to get the
+        rows of the points that are currently in the tree. """
+        return self._points[:self._n_rows]
+
+
+    def indices(self):
+        """ Returns an array of the row indices of all points in the tree """
+
+        leaves = self._leaves()
+        if not leaves:
+            return np.zeros(0, dtype=np.intp)
+        return np.concatenate([self._bucket(n) for n in leaves])
+
+
+    def _leaves(self):
+        leaves = []
+        stack = [0]
+        while stack:
+            node = stack.pop()
+            if self._left[node] < 0:
+                leaves.append(node)
+            else:
+                stack.append(self._right[node])
+                stack.append(self._left[node])
+        return leaves
+
+
+    def _bucket(self, node):
+        start = self._start[node]
+        return self._perm[start:start + self._count[node]]
+
+
+    def _new_node(self, axis):
+        if self._free_nodes:
+            node = self._free_nodes.pop()
+        else:
+            node = self._n_nodes
+            if node == len(self._axis):
+                size = max(16, 2 * node)
+                for name in ('_axis', '_split', '_left', '_right',
+                             '_start', '_count'):
+                    setattr(self, name, _grow(getattr(self, name), size))
+            self._n_nodes += 1
+
+        self._axis[node] = axis
+        self._left[node] = self._right[node] = -1
+        self._count[node] = 0
+        self._start[node] = self._new_range()
+        return node
+
+
+    def _new_range(self):
+        if self._free_ranges:
+            return self._free_ranges.pop()
+
+        start = self._n_slots
+        if start + self.leaf_size > len(self._perm):
+            size = max(start + self.leaf_size, 2 * len(self._perm))
+            self._perm = _grow(self._perm, size)
+        self._n_slots += self.leaf_size
+        return start
+
+
+    def _new_row(self, point):
+        if self._free_rows:
+            row = self._free_rows.pop()
+        else:
+            row = self._n_rows
+            if row == len(self._points):
+                size = max(16, 2 * row)
+                self._points = _grow(self._points, size)
+            self._n_rows += 1
+
+        self._points[row] = point
+        return row
+
+
+    def _build(self, rows, axis):
+        """ Builds the tree over the given rows, starting at the root """
+
+        self._new_node(axis)
+        self._build_subtree(0, rows)
+
+
+    def _build_subtree(self, node, rows):
+        """ Splits the rows at their median until they fit into leaves
+
+        node must be an empty leaf. rows is partitioned in place. """
+
+        stack = [(node, 0, len(rows))]
+        while stack:
+            node, lo, hi = stack.pop()
+
+            if hi - lo <= self.leaf_size:
+                start = self._start[node]
+                self._perm[start:start + hi - lo] = rows[lo:hi]
+                self._count[node] = hi - lo
+                continue
+
+            axis = self._axis[node]
+            mid = (lo + hi) // 2
+            sub = rows[lo:hi]
+            order = np.argpartition(self._points[sub, axis], mid - lo)
+            rows[lo:hi] = sub[order]
+
+            self._split[node] = self._points[rows[mid], axis]
+            self._free_ranges.append(self._start[node])
+            child_axis = (axis + 1) % self.dimensions
+            left = self._new_node(child_axis)
+            right = self._new_node(child_axis)
+            self._left[node] = left
+            self._right[node] = right
+
+            stack.append((right, mid, hi))
+            stack.append((left, lo, mid))
+
+
+    def _check_point(self, point):
+        if len(point) != self.dimensions:
+            raise ValueError('All Points in the point_list must have the '
+                             'same dimensionality')
+        return np.asarray(point, dtype=np.float64)
+
+
+    def add(self, point):
+        """ Adds a point to the tree and returns its row index
+
+        A leaf that overflows is split at its median. """
+
+        point = self._check_point(point)
+        row = self._new_row(point)
+
+        node = 0
+        while self._left[node] >= 0:
+            if point[self._axis[node]] < self._split[node]:
+                node = self._left[node]
+            else:
+                node = self._right[node]
+
+        count = self._count[node]
+        if count < self.leaf_size:
+            self._perm[self._start[node] + count] = row
+            self._count[node] = count + 1
+        else:
+            rows = np.append(self._bucket(node), row)
+            self._count[node] = 0
+            self._build_subtree(node, rows)
+
+        self._size += 1
+        return row
+
+
+    def remove(self, point):
+        """ Removes a point with the given coordinates from the tree
+
+        If there are multiple points matching "point", only one is removed.
+        Leaves whose sibling is also a leaf are merged into their parent once
+        both hold at most half of leaf_size points together.
+
+        Returns the tree itself, so it can be used like KDNode.remove(). """
+
+        point = self._check_point(point)
+
+        stack = [(0, ())]
+        while stack:
+            node, path = stack.pop()
+
+            if self._left[node] >= 0:
+                value = point[self._axis[node]]
+                split = self._split[node]
+                path = path + (node,)
+                if value >= split:
+                    stack.append((self._right[node], path))
+                if value <= split:
+                    stack.append((self._left[node], path))
+                continue
+
+            bucket = self._bucket(node)
+            match = np.flatnonzero(
+                (self._points[bucket] == point).all(axis=1))
+            if not len(match):
+                continue
+
+            pos = match[0]
+            last = len(bucket) - 1
+            self._free_rows.append(bucket[pos])
+            bucket[pos] = bucket[last]
+            self._count[node] = last
+            self._size -= 1
+            self._merge(path)
+            break
+
+        return self
+
+
+    def _merge(self, path):
+        """ Merges underflowing sibling leaves along path, bottom-up """
+
+        for parent in reversed(path):
+            left, right = self._left[parent], self._right[parent]
+            if self._left[left] >= 0 or self._left[right] >= 0:
+                return
+
+            total = self._count[left] + self._count[right]
+            if total > self.leaf_size // 2:
+                return
+
+            # the parent becomes a leaf and takes over the left child's range
+            start = self._start[left]
+            nleft = self._count[left]
+            self._perm[start + nleft:start + total] = self._bucket(right)
+            self._start[parent] = start
+            self._count[parent] = total
+            self._left[parent] = self._right[parent] = -1
+
+            self._free_ranges.append(self._start[right])
+            self._free_nodes.extend((left, right))
+
+
+    def search_knn(self, point, k, dist=None, eps=0, max_leaves=None):
+        """ Return the k nearest neighbors of point and their distances
+
+        point must be an actual point. k is the number of results to return.
+
+        dist is a distance function, expecting two points and returning a
+        distance value. By default the squared euclidean distance is used.
+
+        eps and max_leaves make the search approximate, like eps and
+        max_visits of KDNode.search_knn(). max_leaves limits the number of
+        leaves that are scanned.
+
+        The result is a KNNResult of (row index, distance) tuples. """
+
+        if k < 1:
+            raise ValueError("k must be greater than 0.")
+
+        point = self._check_point(point)
+        coords = point.tolist()
+
+        exact = True
+        factor = (1 + eps) ** 2
+        leaves = 0
+        results = []
+        stack = [(0, 0.0)]
+        while stack:
+            node, bound = stack.pop()
+            if len(results) >= k:
+                if bound > -results[0][0]:
+                    continue
+                if bound * factor > -results[0][0]:
+                    exact = False
+                    continue
+
+            left = self._left[node]
+            if left < 0:
+                if max_leaves is not None and leaves >= max_leaves:
+                    exact = False
+                    break
+                leaves += 1
+
+                bucket = self._bucket(node)
+                if not len(bucket):
+                    continue
+                if dist is None:
+                    diff = self._points[bucket] - point
+                    dists = (diff * diff).sum(axis=1).tolist()
+                else:
+                    dists = [dist(self._points[row], coords)
+                             for row in bucket]
+
+                for row, d in zip(bucket.tolist(), dists):
+                    item = (-d, row)
+                    if len(results) < k:
+                        heapq.heappush(results, item)
+                    elif item > results[0]:
+                        heapq.heapreplace(results, item)
+                continue
+
+            diff = coords[self._axis[node]] - self._split[node]
+            if diff < 0:
+                near, far = left, self._right[node]
+            else:
+                near, far = self._right[node], left
+
+            stack.append((far, max(bound, diff * diff)))
+            stack.append((near, bound))
+
+        return KNNResult([(row, -d) for d, row in
+                          sorted(results, reverse=True)], exact)
+
+
+    def search_knn_batch(self, queries, k, chunk_size=4096):
+        """ Return the k nearest neighbors of many points at once
+
+        queries is an (m, d) array-like of points. Instead of searching for
+        each point separately, all queries descend the tree together, one
+        level per step, as arrays of (query, node) pairs. The traversal
+        therefore costs a number of numpy operations proportional to the
+        height of the tree, not to the number of queries. Queries are
+        processed in chunks of chunk_size to bound memory use.
+
+        The result is an (indices, distances) tuple of two (m, k) arrays,
+        holding the row indices and squared distances of the neighbors of
+        each query, ordered by distance. If the tree contains fewer than k
+        points, the missing entries have index -1 and an infinite
+        distance. """
+
+        if k < 1:
+            raise ValueError("k must be greater than 0.")
+
+        queries = np.array(queries, dtype=np.float64, ndmin=2)
+        if queries.shape[1] != self.dimensions:
+            raise ValueError('All Points in the point_list must have the '
+                             'same dimensionality')
+
+        m = len(queries)
+        rows = np.full((m, k), -1, dtype=np.intp)
+        dists = np.full((m, k), np.inf)
+
+        # queries that end up in the same leaf are processed together, so
+        # that each chunk touches a compact part of the tree
+        order = np.argsort(self._descend(queries), kind='stable')
+
+        counts = self._subtree_counts()
+        for lo in range(0, m, chunk_size):
+            idx = order[lo:lo + chunk_size]
+            chunk = queries[idx]
+            bound = self._knn_bound(chunk, k, counts)
+            rows[idx], dists[idx] = self._knn_within(chunk, k, bound)
+
+        return rows, dists
+
+
+    def _descend(self, queries, counts=None, k=None):
+        """ Returns the node each query ends up in when descending the tree
+
+        If counts and k are given, the descent stops before entering a
+        subtree with less than k points. """
+
+        nodes = np.zeros(len(queries), dtype=np.intp)
+        active = np.arange(len(queries), dtype=np.intp)
+        while len(active):
+            current = nodes[active]
+            left = self._left[current]
+            inner = left >= 0
+            active, current, left = active[inner], current[inner], left[inner]
+
+            goes_left = queries[active, self._axis[current]] < \
+                        self._split[current]
+            child = np.where(goes_left, left, self._right[current])
+            if counts is not None:
+                deeper = counts[child] >= k
+                active, child = active[deeper], child[deeper]
+            nodes[active] = child
+
+        return nodes
+
+
+    def _subtree_counts(self):
+        """ Returns the number of points in each node's subtree """
+
+        counts = self._count[:self._n_nodes].copy()
+        levels = []
+        level = np.zeros(1, dtype=np.intp)
+        while len(level):
+            level = level[self._left[level] >= 0]
+            levels.append(level)
+            level = np.concatenate((self._left[level], self._right[level]))
+
+        for level in reversed(levels):
+            counts[level] = counts[self._left[level]] + \
+                            counts[self._right[level]]
+        return counts
+
+
+    def _knn_bound(self, queries, k, counts):
+        """ Returns an upper bound of each query's k-th neighbor distance
+
+        Every query descends towards its own leaf, as long as the subtree
+        it enters still contains at least k points. The k-th smallest
+        distance to the points of that subtree bounds the distance of the
+        k-th nearest neighbor. """
+
+        m = len(queries)
+        if counts[0] < k:
+            return np.full(m, np.inf)
+
+        idx = np.arange(m, dtype=np.intp)
+        nodes = self._descend(queries, counts, k)
+        qs, leaves = self._expand_to_leaves(idx, nodes)
+        qs, rows = self._leaf_points(qs, leaves)
+        dists = self._pair_dists(queries, qs, rows)
+        return self._smallest_pairs(qs, rows, dists, m, k)[1][:, k - 1]
+
+
+    def _expand_to_leaves(self, qs, nodes, queries=None, bound=None):
+        """ Expands (query, node) pairs to (query, leaf) pairs
+
+        If queries and bound are given, subtrees whose splitting plane is
+        farther away from a query than its bound are pruned. """
+
+        if queries is not None:
+            lower = np.zeros(len(qs))
+
+        leaf_qs, leaf_nodes = [], []
+        while len(qs):
+            left = self._left[nodes]
+            is_leaf = left < 0
+            leaf_qs.append(qs[is_leaf])
+            leaf_nodes.append(nodes[is_leaf])
+
+            inner = ~is_leaf
+            qs, nodes, left = qs[inner], nodes[inner], left[inner]
+            right = self._right[nodes]
+
+            if queries is None:
+                qs = np.concatenate((qs, qs))
+                nodes = np.concatenate((left, right))
+                continue
+
+            lower = lower[inner]
+            diff = queries[qs, self._axis[nodes]] - self._split[nodes]
+            near = np.where(diff < 0, left, right)
+            far = np.where(diff < 0, right, left)
+            far_lower = np.maximum(lower, diff * diff)
+            visit = far_lower <= bound[qs]
+
+            nodes = np.concatenate((near, far[visit]))
+            lower = np.concatenate((lower, far_lower[visit]))
+            qs = np.concatenate((qs, qs[visit]))
+
+        return np.concatenate(leaf_qs), np.concatenate(leaf_nodes)
+
+
+    def _leaf_points(self, qs, leaves):
+        """ Expands (query, leaf) pairs to (query, row) pairs """
+
+        counts = self._count[leaves]
+        total = counts.sum()
+        offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts,
+                                               counts)
+        slots = np.repeat(self._start[leaves], counts) + offsets
+        return np.repeat(qs, counts), self._perm[slots]
+
+
+    def _pair_dists(self, queries, qs, rows):
+        diff = queries[qs] - self._points[rows]
+        return np.einsum('ij,ij->i', diff, diff)
+
+
+    def _smallest_pairs(self, qs, rows, dists, m, k):
+        """ Selects the k smallest distances per query from the pairs
+
+        Returns (rows, dists) arrays of shape (m, k), sorted by distance. """
+
+        # lay out the pairs in a matrix with one (padded) row per query
+        order = np.argsort(qs, kind='stable')
+        qs = qs[order]
+        per_query = np.bincount(qs, minlength=m)
+        pos = np.arange(len(qs)) - np.repeat(np.cumsum(per_query) - per_query,
+                                             per_query)
+        width = max(k, per_query.max() if len(qs) else 0)
+        matrix = np.full((m, width), np.inf)
+        matrix[qs, pos] = dists[order]
+        row_matrix = np.full((m, width), -1, dtype=np.intp)
+        row_matrix[qs, pos] = rows[order]
+
+        if width > k:
+            part = np.argpartition(matrix, k - 1, axis=1)[:, :k]
+            matrix = np.take_along_axis(matrix, part, axis=1)
+            row_matrix = np.take_along_axis(row_matrix, part, axis=1)
+
+        order = np.argsort(matrix, axis=1, kind='stable')
+        return (np.take_along_axis(row_matrix, order, axis=1),
+                np.take_along_axis(matrix, order, axis=1))
+
+
+    def _knn_within(self, queries, k, bound):
+        """ Returns the k nearest neighbors within bound of each query """
+
+        m = len(queries)
+        qs, leaves = self._expand_to_leaves(np.arange(m, dtype=np.intp),
+            np.zeros(m, dtype=np.intp), queries, bound)
+        qs, rows = self._leaf_points(qs, leaves)
+        dists = self._pair_dists(queries, qs, rows)
+
+        # pairs beyond the bound can never be among the k nearest
+        within = dists <= bound[qs]
+        return self._smallest_pairs(qs[within], rows[within], dists[within],
+                                    m, k)
+
+
+    def search_nn(self, point, dist=None, eps=0, max_leaves=None):
+        """ Search the nearest point to the given point
+
+        dist, eps and max_leaves are passed on to search_knn().
+
+        The result is a (row index, distance) tuple, or None if the tree is
+        empty. """
+
+        return next(iter(self.search_knn(point, 1, dist, eps, max_leaves)),
+                    None)
+
+
+    def search_nn_dist(self, point, distance):
+        """ Search the points within the given (squared) distance of point
+
+        Returns a list of the row indices of all points whose squared
+        distance to point is smaller than distance. """
+
+        point = self._check_point(point)
+        coords = point.tolist()
+
+        results = []
+        stack = [0]
+        while stack:
+            node = stack.pop()
+
+            left = self._left[node]
+            if left < 0:
+                bucket = self._bucket(node)
+                diff = self._points[bucket] - point
+                dists = (diff * diff).sum(axis=1)
+                results.extend(bucket[dists < distance].tolist())
+                continue
+
+            diff = coords[self._axis[node]] - self._split[node]
+            if diff < 0:
+                near, far = left, self._right[node]
+            else:
+                near, far = self._right[node], left
+
+            if diff * diff < distance:
+                stack.append(far)
+            stack.append(near)
+
+        return results
+
+
+
+def _grow(array, size):
+    """ Returns a copy of array, enlarged to size rows """
+
+    grown = np.empty((size,) + array.shape[1:], dtype=array.dtype)
+    grown[:len(array)] = array
+    return grown
+
+
+
+# The buffer of a FrozenKDTree starts with a header of _FROZEN_HEADER_SIZE
+# bytes: magic, format version, byte order of the arrays, dimensions and
+# number of rows. The arrays follow in the order of _FROZEN_ARRAYS, each
+# with one item per row (coordinates: one per row and dimension).
+_FROZEN_MAGIC = b'KDTREE\x00\x00'
+_FROZEN_VERSION = 1
+_FROZEN_HEADER = struct.Struct('<8sHBxIq')
+_FROZEN_HEADER_SIZE = 64
+_FROZEN_ARRAYS = (('coords', 'd'), ('left', 'q'), ('right', 'q'),
+                  ('axis', 'i'), ('bucket', 'i'))
+
+
+class FrozenKDTree(object):
+    """ A read-only kd-tree in a single flat buffer
+
+    It is created by KDNode.freeze() and has the same structure as the tree
+    it was created from. The nodes are stored as rows of coordinates, split
+    axis, child row indices and bucket size, in the order of
+    KDNode.preorder(); the members of a bucket follow their leaf.
+
+    As the buffer contains no Python objects, it can be placed in shared
+    memory and be searched by many processes at once without copying or
+    rebuilding anything, see attach().
+
+    Searches return row indices instead of nodes, the coordinates of a row
+    are returned by point(). Payloads are not stored and have to be looked
+    up by the row index. """
+
+    def __init__(self, buf, owner=None):
+        """ Wraps a buffer in the format written by KDNode.freeze()
+
+        owner is the SharedMemory or mmap object that holds the buffer, if
+        any. It is closed together with the tree.
+
+        The header of the buffer is validated, a ValueError is raised if
+        it doesn't contain a tree of this version. """
+
+        if len(buf) < _FROZEN_HEADER_SIZE:
+            raise ValueError('buffer is too small for a FrozenKDTree')
+
+        magic, version, little_endian, dimensions, size = \
+            _FROZEN_HEADER.unpack_from(buf)
+        if magic != _FROZEN_MAGIC:
+            raise ValueError('buffer does not contain a FrozenKDTree')
+        if version != _FROZEN_VERSION:
+            raise ValueError('unsupported FrozenKDTree version %d' % version)
+        if bool(little_endian) != (sys.byteorder == 'little'):
+            raise ValueError('FrozenKDTree has a different byte order')
+        if len(buf) < _frozen_size(dimensions, size):
+            raise ValueError('buffer is too small for a FrozenKDTree of '
+                             '%d rows' % size)
+
+        self.dimensions = dimensions
+        self._size = size
+        self._owner = owner
+
+        view = memoryview(buf)
+        self._views = [view]
+
+        offset = _FROZEN_HEADER_SIZE
+        for name, typecode in _FROZEN_ARRAYS:
+            items = size * dimensions if name == 'coords' else size
+            end = offset + items * struct.calcsize(typecode)
+            array_view = view[offset:end].cast(typecode)
+            self._views.append(array_view)
+            setattr(self, '_' + name, array_view)
+            offset = end
+
+
+    @property
+    def name(self):
+        """ The name of the shared memory block of the tree, or None """
+        return getattr(self._owner, 'name', None)
+
+
+    def __len__(self):
+        return self._size
+
+
+    def __repr__(self):
+        return '<%(cls)s - %(size)d points, %(dims)d dimensions>' % \
+            dict(cls=self.__class__.__name__, size=self._size,
+                 dims=self.dimensions)
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+    def close(self):
+        """ Releases the buffer of the tree
+
+        The tree can't be used afterwards. Shared memory stays available
+        to other processes until it is unlinked. """
+
+        for view in reversed(self._views):
+            view.release()
+        self._views = []
+
+        if self._owner is not None:
+            self._owner.close()
+
+
+    def unlink(self):
+        """ Frees the shared memory block of the tree
+
+        This should be called once, by the process that created it. """
+
+        if self.name is not None:
+            self._owner.unlink()
+
+
+    def save(self, path):
+        """ Writes the tree to a file, see load() """
+
+        with open(path, 'wb') as f:
+            f.write(self._views[0][:_frozen_size(self.dimensions,
+                                                 self._size)])
+
+
+    def point(self, row):
+        """ Returns the coordinates of the given row as a tuple """
+
+        d = self.dimensions
+        return tuple(self._coords[row * d:(row + 1) * d])
+
+
+    def _check_point(self, point):
+        if len(point) != self.dimensions:
+            raise ValueError('point must have %d dimensions' %
+                             self.dimensions)
+
+
+    def search_knn(self, point, k, dist=None):
+        """ Return the k nearest neighbors of point and their distances
+
+        The search works like KDNode.search_knn(). dist is called with two
+        tuples of coordinates.
+
+        The result is a KNNResult of (row index, distance) tuples. """
+
+        if k < 1:
+            raise ValueError("k must be greater than 0.")
+
+        self._check_point(point)
+        d = self.dimensions
+        coords, left, right, axes, buckets = \
+            self._coords, self._left, self._right, self._axis, self._bucket
+
+        if dist is None:
+            squared_distance = _squared_distance_function(d)
+            get_dist = lambda row: squared_distance(
+                coords[row * d:row * d + d], point)
+        else:
+            get_dist = lambda row: dist(tuple(coords[row * d:row * d + d]),
+                                        point)
+
+        counter = itertools.count()
+        results = []
+        stack = [(0, 0, (0,) * d)] if self._size else []
+        while stack:
+            row, region_dist, offsets = stack.pop()
+
+            if len(results) >= k and -region_dist <= results[0][0]:
+                continue
+
+            # the node and the members of its bucket
+            for r in range(row, row + buckets[row] + 1):
+                item = (-get_dist(r), next(counter), r)
+                if len(results) >= k:
+                    if item[0] > results[0][0]:
+                        heapq.heapreplace(results, item)
+                else:
+                    heapq.heappush(results, item)
+
+            axis = axes[row]
+            split_plane = coords[row * d + axis]
+            plane_dist = point[axis] - split_plane
+            plane_dist2 = plane_dist * plane_dist
+
+            if point[axis] < split_plane:
+                near, far = left[row], right[row]
+            else:
+                near, far = right[row], left[row]
+
+            if far >= 0:
+                far_dist = region_dist - offsets[axis] + plane_dist2
+                far_offsets = offsets[:axis] + (plane_dist2,) + \
+                              offsets[axis + 1:]
+                stack.append((far, far_dist, far_offsets))
+            if near >= 0:
+                stack.append((near, region_dist, offsets))
+
+        return KNNResult([(r, -key) for key, _, r in
+                          sorted(results, reverse=True)])
+
+
+    def search_nn(self, point, dist=None):
+        """ Search the nearest point to the given point
+
+        The result is a (row index, distance) tuple, or None if the tree is
+        empty. """
+
+        return next(iter(self.search_knn(point, 1, dist)), None)
+
+
+    def search_nn_dist(self, point, distance):
+        """ Search the points within the given (squared) distance of point
+
+        Returns a list of the row indices of all points whose squared
+        distance to point is smaller than distance. """
+
+        self._check_point(point)
+        d = self.dimensions
+        coords, left, right, axes, buckets = \
+            self._coords, self._left, self._right, self._axis, self._bucket
+
+        squared_distance = _squared_distance_function(d)
+
+        results = []
+        stack = [0] if self._size else []
+        while stack:
+            row = stack.pop()
+
+            for r in range(row, row + buckets[row] + 1):
+                if squared_distance(coords[r * d:r * d + d],
+                                    point) < distance:
+                    results.append(r)
+
+            axis = axes[row]
+            plane_dist = point[axis] - coords[row * d + axis]
+            if right[row] >= 0 and (plane_dist >= 0 or
+                                    plane_dist * plane_dist < distance):
+                stack.append(right[row])
+            if left[row] >= 0 and (plane_dist <= 0 or
+                                   plane_dist * plane_dist < distance):
+                stack.append(left[row])
+
+        return results
+
+
+
+def _frozen_size(dimensions, size):
+    """ Returns the number of bytes of a FrozenKDTree buffer """
+
+    return _FROZEN_HEADER_SIZE + sum(
+        (size * dimensions if name == 'coords' else size) *
+        struct.calcsize(typecode) for name, typecode in _FROZEN_ARRAYS)
+
+
+def _frozen_chunks(tree):
+    """ Returns the header and arrays of a FrozenKDTree of tree
+
+    The result is a list of bytes-like objects, that have to be written
+    one after the other. Dead nodes are left out, by freezing a rebuilt
+    copy of the tree. """
+
+    # the copy gets a config of its own, so the tree stays as it is
+    if tree.dead_size:
+        tree = create([n.data for n in tree.live_nodes()],
+                      dimensions=tree.dimensions, axis=tree.axis,
+                      sel_axis=tree.sel_axis, leaf_size=tree.leaf_size)
+
+    nodes, left, right, bucket = [], [], [], []
+    stack = [(tree, None, None)]
+    while stack:
+        node, parent, children = stack.pop()
+        if not node:
+            continue
+
+        row = len(nodes)
+        if parent is not None:
+            children[parent] = row
+
+        members = node.bucket or ()
+        nodes.append(node)
+        nodes.extend(members)
+        left.extend([-1] * (len(members) + 1))
+        right.extend([-1] * (len(members) + 1))
+        bucket.append(len(members))
+        bucket.extend([0] * len(members))
+
+        stack.append((node.right, row, right))
+        stack.append((node.left, row, left))
+
+    dimensions = tree.dimensions
+    if nodes:
+        check_dimensionality([n.data for n in nodes], dimensions)
+
+    arrays = {
+        'coords': array.array('d', (c for n in nodes for c in n.data)),
+        'left': array.array('q', left),
+        'right': array.array('q', right),
+        'axis': array.array('i', (n.axis for n in nodes)),
+        'bucket': array.array('i', bucket),
+    }
+
+    header = bytearray(_FROZEN_HEADER_SIZE)
+    _FROZEN_HEADER.pack_into(header, 0, _FROZEN_MAGIC, _FROZEN_VERSION,
+                             sys.byteorder == 'little', dimensions,
+                             len(nodes))
+    return [header] + [arrays[name] for name, _ in _FROZEN_ARRAYS]
+
+
+def attach(name):
+    """ Attaches to a FrozenKDTree in shared memory
+
+    name is the name of the tree's shared memory block, see
+    KDNode.freeze(). Nothing is copied, so this takes constant time. """
+
+    if shared_memory is None:
+        raise ImportError('shared memory requires Python 3.8 or later')
+
+    try:
+        shm = shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Before Python 3.13, attaching registers the block with the
+        # resource tracker, which would unlink it when this process exits.
+        # The creating process owns the block, so the registration is
+        # dropped again if attaching started a tracker of this process.
+        # Processes started by multiprocessing share the tracker of their
+        # parent, in which the block is already registered by its creator,
+        # and unregistering would drop that registration.
+        from multiprocessing import resource_tracker
+        own_tracker = getattr(resource_tracker._resource_tracker, '_fd',
+                              None) is None
+        shm = shared_memory.SharedMemory(name=name)
+        if own_tracker:
+            resource_tracker.unregister(shm._name, 'shared_memory')
+
+    return FrozenKDTree(shm.buf, shm)
+
+
+def load(path, mmap=True):
+    """ Loads a tree that has been saved with KDNode.save()
+
+    Returns a FrozenKDTree. With mmap, the file is memory-mapped instead of
+    read, so loading takes constant time and the operating system only
+    reads the parts of the file that are searched. A ValueError is raised
+    if the file doesn't contain a tree of a supported version. """
+
+    with open(path, 'rb') as f:
+        if not mmap:
+            return FrozenKDTree(bytearray(f.read()))
+
+        mapped = _mmap.mmap(f.fileno(), 0, access=_mmap.ACCESS_READ)
+
+    try:
+        return FrozenKDTree(mapped, mapped)
+    except ValueError:
+        mapped.close()
+        raise
@@ -35,14 +35,14 @@ CLASSIFIERS = [
     'License :: OSI Approved :: ISC License (ISCL)',
     'Operating System :: OS Independent',
     'Programming Language :: Python',
-    'Programming Language :: Python :: 2',
-    'Programming Language :: Python :: 2.6',
-    'Programming Language :: Python :: 2.7',
     'Programming Language :: Python :: 3',
-    'Programming Language :: Python :: 3.3',
-    'Programming Language :: Python :: 3.4',
-    'Programming Language :: Python :: 3.5',
-    'Programming Language :: Python :: 3.6',
+    'Programming Language :: Python :: 3 :: Only',
+    'Programming Language :: Python :: 3.8',
+    'Programming Language :: Python :: 3.9',
+    'Programming Language :: Python :: 3.10',
+    'Programming Language :: Python :: 3.11',
+    'Programming Language :: Python :: 3.12',
+    'Programming Language :: Python :: 3.13',
     'Programming Language :: Python :: Implementation :: CPython',
     'Programming Language :: Python :: Implementation :: PyPy',
     'Topic :: Software Development :: Libraries',
@@ -63,5 +63,9 @@ setup(name=PACKAGE,
         PACKAGE[0] + '/' + PACKAGE + '/' + \
         PACKAGE + '-' + VERSION + '.tar.gz',
       classifiers=CLASSIFIERS,
+      python_requires='>=3.8',
+      extras_require={
+          'numpy': ['numpy'],
+      },
       test_suite='test',
 )
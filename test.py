@@ -2,7 +2,9 @@
 
 from __future__ import absolute_import
 
+import os
 import sys
+import math
 import random
 import logging
 import unittest
@@ -13,6 +15,10 @@ from itertools import islice
 # import after starting coverage, to ensure that import-time code is covered
 import kdtree
 
+# tests that take minutes only run if KDTREE_SLOW_TESTS is set
+slow = unittest.skipUnless(os.environ.get('KDTREE_SLOW_TESTS'),
+                           'set KDTREE_SLOW_TESTS to run slow tests')
+
 class RemoveTest(unittest.TestCase):
 
 
@@ -74,6 +80,31 @@ class RemoveTest(unittest.TestCase):
         tree.remove( (1, 2) )
         self.assertFalse(bool(tree))
 
+    def test_extreme_child(self, nodes=300):
+        for leaf_size in (1, 4):
+            tree = kdtree.create(list(islice(random_points(), 0, nodes)),
+                                 leaf_size=leaf_size)
+            for axis in range(3):
+                for sel_func in (min, max):
+                    values = [n.data[axis] for n in tree.preorder()]
+                    child, parent = tree.extreme_child(sel_func, axis)
+                    self.assertEqual(child.data[axis], sel_func(values))
+                    if child is not tree:
+                        siblings = [parent.left, parent.right]
+                        siblings += parent.bucket or []
+                        self.assertTrue(any(child is n for n in siblings))
+
+    def test_remove_large(self, nodes=1000):
+        points = list(islice(random_points(), 0, nodes))
+        tree = kdtree.create(points)
+        random.shuffle(points)
+        while len(points) > nodes // 2:
+            tree = tree.remove(points.pop())
+
+        self.assertTrue(tree.is_valid())
+        self.assertEqual(sorted(n.data for n in tree.inorder()),
+                         sorted(points))
+
 
 class AddTest(unittest.TestCase):
 
@@ -122,6 +153,124 @@ class InvalidTreeTests(unittest.TestCase):
         self.assertRaises(ValueError, kdtree.create, points)
 
 
+class CreateTests(unittest.TestCase):
+
+    def test_median_split(self, nodes=500):
+        """ every node splits its subtree at the median """
+        points = list(set(islice(random_points(), 0, nodes)))
+        tree = kdtree.create(points)
+        self.assertEqual(len(list(tree.inorder())), len(points))
+
+        for node in tree.preorder():
+            left = list(node.left.inorder()) if node.left else []
+            right = list(node.right.inorder()) if node.right else []
+            self.assertTrue(len(left) - len(right) in (0, 1))
+            self.assertTrue(all(n.data[node.axis] <= node.data[node.axis]
+                                for n in left))
+            self.assertTrue(all(n.data[node.axis] >= node.data[node.axis]
+                                for n in right))
+
+    def test_duplicates(self):
+        points = list(islice(random_points(maxval=3), 0, 200))
+        tree = kdtree.create(points)
+        self.assertTrue(tree.is_valid())
+        self.assertEqual(sorted(n.data for n in tree.inorder()),
+                         sorted(points))
+
+    def test_sel_axis(self):
+        """ a custom sel_axis is used on all levels """
+        points = list(islice(random_points(), 0, 50))
+        tree = kdtree.create(points, sel_axis=lambda axis: 2 - axis)
+        self.assertEqual(set(n.axis for n in tree.preorder()), set([0, 2]))
+
+    def test_pickle(self):
+        """ trees with the default sel_axis can be pickled """
+        import pickle
+
+        points = list(islice(random_points(), 0, 100))
+        tree = pickle.loads(pickle.dumps(kdtree.create(points, leaf_size=4)))
+        self.assertEqual(sorted(n.data for n in tree.inorder()),
+                         sorted(points))
+        tree.add(random_point())
+        self.assertEqual(tree.size, 101)
+
+    @unittest.skipIf(kdtree.np is None, 'numpy is not installed')
+    def test_presorted_layout(self):
+        """ the numpy layout matches the one found by sorting """
+        points = [tuple(random.random() for _ in range(3))
+                  for _ in range(1000)]
+        sel_axis = lambda axis: (axis + 1) % 3
+        self.assertEqual(
+            kdtree._median_layout(points, 3, 1, sel_axis),
+            kdtree._median_layout_sorted(points, 3, 1, sel_axis))
+
+    @unittest.skipIf(kdtree.np is None, 'numpy is not installed')
+    def test_workers(self, nodes=2000):
+        """ a tree built by several processes equals the serial one """
+        for leaf_size in (1, 4):
+            points = list(islice(random_points(maxval=10), 0, nodes))
+            serial = kdtree.create(points, leaf_size=leaf_size)
+            parallel = kdtree.create(points, leaf_size=leaf_size, workers=3)
+            self.assertEqual(
+                [(id(n.data), n.axis, n.size) for n in parallel.preorder()],
+                [(id(n.data), n.axis, n.size) for n in serial.preorder()])
+
+    def test_gc_state(self):
+        """ building keeps the garbage collector disabled if it was """
+        import gc
+        enabled = gc.isenabled()
+        try:
+            gc.disable()
+            kdtree.create(list(islice(random_points(), 0, 100)))
+            self.assertFalse(gc.isenabled())
+            gc.enable()
+            kdtree.create(list(islice(random_points(), 0, 100)))
+            self.assertTrue(gc.isenabled())
+        finally:
+            if not enabled:
+                gc.disable()
+
+
+
+class NodeMemoryTests(unittest.TestCase):
+
+    def test_shared_config(self):
+        tree = kdtree.create(list(islice(random_points(), 0, 100)))
+        tree.add(random_point())
+        configs = set(id(node.config) for node in tree.preorder())
+        self.assertEqual(len(configs), 1)
+        self.assertEqual(tree.dimensions, 3)
+
+    def test_bytes_per_point(self, nodes=10000):
+        """ nodes take less memory than objects with an instance dict """
+        import tracemalloc
+
+        class Plain(object):
+            def __init__(self):
+                self.data = self.left = self.right = self.bucket = None
+                self.axis = self.sel_axis = self.dimensions = None
+
+        points = list(islice(random_points(), 0, nodes))
+        tracemalloc.start()
+        plain = [Plain() for _ in points]
+        plain_size = tracemalloc.get_traced_memory()[0]
+        del plain
+        tracemalloc.stop()
+
+        tracemalloc.start()
+        tree = kdtree.create(points)
+        tree_size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+        self.assertEqual(len(list(tree.inorder())), nodes)
+        self.assertTrue(tree_size < plain_size,
+                        '%d bytes per point' % (tree_size // nodes))
+
+    @slow
+    def test_bytes_per_point_large(self):
+        self.test_bytes_per_point(nodes=1000000)
+
+
 class TreeTraversals(unittest.TestCase):
 
     def test_same_length(self):
@@ -149,6 +298,89 @@ class BalanceTests(unittest.TestCase):
         self.assertTrue(tree.is_balanced)
 
 
+    def test_alpha_add(self, nodes=1000):
+        # sorted points would make a chain of nodes without rebuilding
+        points = [(i, i % 7, 0) for i in range(nodes)]
+        for leaf_size in (1, 4):
+            tree = kdtree.create(dimensions=3, leaf_size=leaf_size, alpha=0.7)
+            for point in points:
+                self.assertIs(tree.add(point).data, point)
+
+            self.assertTrue(tree.is_valid())
+            # nodes are at most one level deeper than log(n) / log(1 / alpha)
+            self.assertLessEqual(tree.height(),
+                                 math.log(nodes) / math.log(1 / 0.7) + 2)
+            self.assertEqual(sorted(n.data for n in tree.inorder()), points)
+            for node in tree.preorder():
+                self.assertEqual(node.size, len(list(node.inorder())))
+
+
+    def test_alpha_remove(self, nodes=500):
+        points = list(islice(random_points(), 0, nodes))
+        tree = kdtree.create(points, alpha=0.7)
+        random.shuffle(points)
+        while len(points) > 10:
+            tree = tree.remove(points.pop())
+            self.assertTrue(all(not child or child.size <= 0.7 * tree.size
+                                for child in (tree.left, tree.right)))
+
+        self.assertTrue(tree.is_valid())
+        self.assertEqual(sorted(n.data for n in tree.inorder()),
+                         sorted(points))
+
+
+    def test_alpha_payload(self, nodes=1000):
+        # rebuilding relinks the nodes, which keep their points and payloads
+        points = [(i, i % 7, 0) for i in range(nodes)]
+        for leaf_size in (1, 4):
+            tree = kdtree.create(dimensions=3, leaf_size=leaf_size, alpha=0.7)
+            added = []
+            for point in points:
+                node = tree.add(point)
+                node.payload = point
+                added.append(node)
+
+            self.assertTrue(all(n.payload == n.data for n in tree.preorder()))
+            for node in added[::2]:
+                tree = tree.remove(node.data, node=node)
+
+            self.assertEqual(tree.size, nodes // 2)
+            self.assertEqual(sorted(n.data for n in tree.inorder()),
+                             points[1::2])
+            self.assertTrue(all(n.payload == n.data for n in tree.preorder()))
+            self.assertTrue(tree.is_valid())
+
+
+    def test_cached_height(self, nodes=300):
+        def height(node):
+            return max([int(bool(node))] +
+                       [height(c) + 1 for c, _ in node.children])
+
+        for kwargs in ({}, {'leaf_size': 4}, {'alpha': 0.7},
+                       {'max_dead': 0.25}, {'max_cost': 1.2}):
+            points = list(islice(random_points(), 0, nodes))
+            tree = kdtree.create(points[:nodes // 3], **kwargs)
+            for point in points[nodes // 3:2 * nodes // 3]:
+                tree.add(point)
+            tree = tree.add_many(points[2 * nodes // 3:])
+            for point in random.sample(points, nodes // 3):
+                tree = tree.remove(point)
+            tree = tree.remove_many(random.sample(points, nodes // 3))
+
+            for node in tree.preorder():
+                self.assertEqual(node.height(), height(node))
+            balanced = all(abs(height(n.left or kdtree.KDNode()) -
+                               height(n.right or kdtree.KDNode())) <= 1
+                           for n in tree.preorder())
+            self.assertEqual(tree.is_balanced, balanced)
+
+
+    def test_alpha_range(self):
+        for alpha in (0.5, 1, 2):
+            self.assertRaises(ValueError, kdtree.create, dimensions=2,
+                              alpha=alpha)
+
+
 
 class NearestNeighbor(unittest.TestCase):
 
@@ -229,6 +461,100 @@ class NearestNeighbor(unittest.TestCase):
 
 
 
+    def test_search_knn_stats(self, nodes=1000):
+        points = list(islice(random_points(dimensions=4), 0, nodes))
+        tree = kdtree.create(points)
+        stats = kdtree.SearchStats()
+
+        for _ in range(10):
+            point = random_point(dimensions=4)
+            result = tree.search_knn(point, 5, stats=stats)
+            expected = sorted(sum((a - b) ** 2 for a, b in zip(p, point))
+                              for p in points)[:5]
+            self.assertEqual([d for _, d in result], expected)
+
+        self.assertTrue(0 < stats.nodes_visited < 10 * nodes / 2)
+
+    def test_search_stats(self, nodes=1000):
+        points = list(islice(random_points(dimensions=4), 0, nodes))
+        tree = kdtree.create(points)
+        height = tree.height()
+        stats = kdtree.SearchStats()
+
+        tree.search_knn(random_point(dimensions=4), 5, stats=stats)
+        self.assertEqual(stats.distance_evals, stats.nodes_visited)
+        self.assertTrue(0 < stats.subtrees_explored < stats.nodes_visited)
+        self.assertTrue(stats.subtrees_pruned > 0)
+        self.assertTrue(0 < stats.max_depth < height)
+
+        tree.search_nn_dist(random_point(dimensions=4), 100, stats=stats)
+        tree.count_box((0, 0, 0, 0), (50, 50, 50, 50), stats=stats)
+        counts = stats.as_dict()
+        self.assertEqual(counts['searches'], 3)
+        self.assertTrue(counts['seconds'] > 0)
+
+        self.assertEqual(stats.reset(), counts)
+        self.assertEqual(set(stats.as_dict().values()), set([0]))
+
+    def test_search_knn_approximate(self, nodes=1000, eps=0.5):
+        points = list(islice(random_points(dimensions=4), 0, nodes))
+        tree = kdtree.create(points)
+
+        for _ in range(10):
+            point = random_point(dimensions=4)
+            expected = sorted(sum((a - b) ** 2 for a, b in zip(p, point))
+                              for p in points)[:5]
+
+            result = tree.search_knn(point, 5, eps=0)
+            self.assertTrue(result.exact)
+            self.assertEqual([d for _, d in result], expected)
+
+            result = tree.search_knn(point, 5, eps=eps)
+            self.assertEqual(len(result), 5)
+            for (_, d), best in zip(result, expected):
+                self.assertTrue(d <= best * (1 + eps) ** 2)
+
+        stats = kdtree.SearchStats()
+        result = tree.search_knn(random_point(dimensions=4), 5, stats=stats,
+                                 max_visits=3)
+        self.assertEqual(stats.nodes_visited, 3)
+        self.assertEqual(len(result), 3)
+        self.assertFalse(result.exact)
+
+    def test_iter_nearest(self, nodes=300):
+        for leaf_size in (1, 8):
+            points = list(islice(random_points(), 0, nodes))
+            tree = kdtree.create(points, leaf_size=leaf_size)
+            point = random_point()
+            expected = sorted(sum((a - b) ** 2 for a, b in zip(p, point))
+                              for p in points)
+
+            result = list(tree.iter_nearest(point))
+            self.assertEqual([d for _, d in result], expected)
+            self.assertEqual(sorted(n.data for n, _ in result), sorted(points))
+
+            result = tree.iter_nearest(point)
+            self.assertEqual([d for _, d in islice(result, 0, 10)],
+                             expected[:10])
+            self.assertEqual(next(result)[1], expected[10])
+
+    def test_iter_nearest_lazy(self, nodes=1000):
+        points = list(islice(random_points(), 0, nodes))
+        tree = kdtree.create(points)
+        point = random_point()
+        stats = kdtree.SearchStats()
+
+        even = ((n, d) for n, d in tree.iter_nearest(point, stats=stats)
+                if n.data[0] % 2 == 0)
+        result = list(islice(even, 0, 3))
+        expected = sorted(sum((a - b) ** 2 for a, b in zip(p, point))
+                          for p in points if p[0] % 2 == 0)
+        self.assertEqual([d for _, d in result], expected[:3])
+        self.assertTrue(stats.nodes_visited < nodes / 2)
+
+        empty = kdtree.create(dimensions=3)
+        self.assertEqual(list(empty.iter_nearest(point)), [])
+
     def find_best(self, tree, point):
         best = None
         best_dist = None
@@ -325,6 +651,40 @@ class NearestNeighbor(unittest.TestCase):
                         self.assertTrue(pn.dist(point) >= dist, '%s not in %s but %s >= %s' % (pn, nn, pn.dist(point), dist))
 
 
+class DegenerateTreeTests(unittest.TestCase):
+    """ test searches on trees that are deeper than the recursion limit """
+
+    def setUp(self):
+        self.points = [(i, i * 2, i * 3) for i in range(sys.getrecursionlimit() * 2)]
+        self.tree = kdtree.create([self.points[0]])
+        node = self.tree
+        for point in self.points[1:]:
+            node.right = node.create_subnode(point)
+            node = node.right
+
+    def test_traversals(self):
+        n = len(self.points)
+        self.assertEqual([x.data for x in self.tree.inorder()], self.points)
+        self.assertEqual(len(list(self.tree.preorder())), n)
+        self.assertEqual(len(list(self.tree.postorder())), n)
+
+    def test_search_knn(self):
+        point = (500.2, 1000.4, 1500.6)
+        result = self.tree.search_knn(point, 3)
+        self.assertEqual([node.data for node, _ in result],
+                         [(500, 1000, 1500), (501, 1002, 1503),
+                          (499, 998, 1497)])
+
+    def test_search_nn_dist(self):
+        result = self.tree.search_nn_dist((100, 200, 300), 15)
+        self.assertEqual(sorted(result), [(99, 198, 297), (100, 200, 300),
+                                          (101, 202, 303)])
+
+    def test_rebalance(self):
+        tree = self.tree.rebalance()
+        self.assertTrue(tree.is_balanced)
+
+
 class PointTypeTests(unittest.TestCase):
     """ test using different types as points """
 
@@ -354,6 +714,892 @@ class PayloadTests(unittest.TestCase):
             self.assertEqual(i, tree.search_nn(p)[0].payload)
 
 
+class LeafBucketTests(unittest.TestCase):
+    """ test trees whose leaves hold several points """
+
+    def assertValid(self, tree):
+        """ checks the split of every node against its whole subtree """
+        for node in tree.preorder():
+            if node.bucket:
+                self.assertFalse(node.left or node.right)
+            for child, pos in node.children:
+                for n in child.inorder():
+                    if pos == 0:
+                        self.assertTrue(n.data[node.axis] <= node.data[node.axis])
+                    else:
+                        self.assertTrue(n.data[node.axis] >= node.data[node.axis])
+
+    def brute_dists(self, points, point):
+        return sorted(sum((a - b) ** 2 for a, b in zip(p, point))
+                      for p in points)
+
+    def test_create(self, nodes=200):
+        points = list(islice(random_points(), 0, nodes))
+        tree = kdtree.create(points, leaf_size=8)
+        self.assertValid(tree)
+        self.assertEqual(sorted(n.data for n in tree.inorder()),
+                         sorted(points))
+        self.assertTrue(max(len(n.bucket or ()) for n in tree.preorder()) < 8)
+        self.assertTrue(tree.height() < kdtree.create(points).height())
+
+    def test_search(self, nodes=200):
+        points = list(islice(random_points(), 0, nodes))
+        tree = kdtree.create(points, leaf_size=8)
+
+        for _ in range(20):
+            point = random_point()
+            dists = self.brute_dists(points, point)
+            result = tree.search_knn(point, 10)
+            self.assertEqual([d for _, d in result], dists[:10])
+
+            nn = tree.search_nn_dist(point, dists[10])
+            self.assertEqual(len(nn), len([d for d in dists if d < dists[10]]))
+
+    def test_add_remove(self, nodes=200):
+        points = list(islice(random_points(), 0, nodes))
+        tree = kdtree.create(dimensions=3, leaf_size=4)
+        for i, point in enumerate(points):
+            tree.add(point).payload = i
+            self.assertValid(tree)
+
+        self.assertEqual(len(list(tree.inorder())), nodes)
+        for i, point in enumerate(points):
+            self.assertEqual(tree.search_nn(point)[1], 0)
+
+        random.shuffle(points)
+        while points:
+            tree = tree.remove(points.pop())
+            self.assertValid(tree)
+            self.assertEqual(len(list(tree.inorder())), len(points))
+            if points:
+                point = random_point()
+                self.assertEqual(tree.search_nn(point)[1],
+                                 self.brute_dists(points, point)[0])
+
+    def test_remove_duplicates(self):
+        points = [(1, 1)] * 50
+        tree = kdtree.create(points, leaf_size=4)
+        for n in range(49, -1, -1):
+            tree = tree.remove((1, 1))
+            self.assertEqual(len(list(tree.inorder())), n)
+
+
+class MetricTests(unittest.TestCase):
+    """ test searches with the built-in metrics against brute force """
+
+    metrics = [kdtree.Metric(), kdtree.SquaredEuclidean(),
+               kdtree.Manhattan(), kdtree.Chebyshev(),
+               kdtree.WeightedEuclidean((1, 4, 0.5)), kdtree.Minkowski(3)]
+
+    def test_search_knn(self, nodes=300, k=5):
+        points = list(islice(random_points(), 0, nodes))
+        for leaf_size in (1, 4):
+            tree = kdtree.create(points, leaf_size=leaf_size)
+            for metric in self.metrics:
+                for _ in range(10):
+                    point = random_point()
+                    dists = sorted(metric.dist(p, point) for p in points)
+                    result = tree.search_knn(point, k, dist=metric)
+                    self.assertEqual([d for _, d in result], dists[:k])
+                    nearest = islice(tree.iter_nearest(point, metric), k)
+                    self.assertEqual([d for _, d in nearest], dists[:k])
+
+    def test_search_nn_dist(self, nodes=300):
+        points = list(islice(random_points(), 0, nodes))
+        trees = [kdtree.create(points), kdtree.create(points, leaf_size=4),
+                 kdtree.KDForest(points)]
+        for metric in self.metrics:
+            for _ in range(10):
+                point = random_point()
+                dists = sorted(metric.dist(p, point) for p in points)
+                for distance in (dists[0] / 2., dists[10], dists[-1] + 1):
+                    expected = sorted(p for p in points
+                                      if metric.dist(p, point) < distance)
+                    for tree in trees:
+                        result = tree.search_nn_dist(point, distance,
+                                                     metric=metric)
+                        self.assertEqual(sorted(result), expected)
+
+    def test_approximate(self, nodes=500, k=5, eps=0.5):
+        points = list(islice(random_points(), 0, nodes))
+        tree = kdtree.create(points)
+        for metric in self.metrics:
+            for _ in range(10):
+                point = random_point()
+                dists = sorted(metric.dist(p, point) for p in points)
+                result = tree.search_knn(point, k, dist=metric, eps=eps)
+                for (_, d), exact in zip(result, dists):
+                    self.assertLessEqual(d, exact * (1 + eps) ** metric.power)
+
+    def test_tree_metric(self, nodes=100):
+        points = list(islice(random_points(), 0, nodes))
+        tree = kdtree.create(points, dist=kdtree.Chebyshev())
+        forest = kdtree.KDForest(points, dist=kdtree.Chebyshev())
+        point = random_point()
+        expected = min(kdtree.Chebyshev().dist(p, point) for p in points)
+        self.assertEqual(tree.search_nn(point)[1], expected)
+        self.assertEqual(forest.search_nn(point)[1], expected)
+        self.assertEqual(len(tree.search_nn_dist(point, expected + 1)),
+                         sum(kdtree.Chebyshev().dist(p, point) < expected + 1
+                             for p in points))
+        self.assertEqual(len(forest.search_nn_dist(point, expected + 1)),
+                         len(tree.search_nn_dist(point, expected + 1)))
+
+    def test_squared_distance_kernels(self, nodes=100, k=5):
+        for dimensions in (2, 3, 5):
+            points = list(islice(random_points(dimensions), 0, nodes))
+            tree = kdtree.create(points)
+            queries = [random_point(dimensions)]
+            if kdtree.np is not None:
+                queries.append(kdtree.np.array(random_point(dimensions)))
+            for point in queries:
+                dists = sorted(sum((a - b) ** 2 for a, b in zip(p, point))
+                               for p in points)
+                result = tree.search_knn(point, k)
+                self.assertEqual([d for _, d in result], dists[:k])
+                self.assertEqual(tree.dist(point), sum(
+                    (a - b) ** 2 for a, b in zip(tree.data, point)))
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, kdtree.Minkowski, 0.5)
+        self.assertRaises(ValueError, kdtree.WeightedEuclidean, (1, -1))
+
+
+class BoxSearchTests(unittest.TestCase):
+    """ test subtree sizes and searches for axis-aligned boxes """
+
+    def assertSizes(self, tree):
+        for node in tree.preorder():
+            self.assertEqual(node.size, len(list(node.inorder())))
+
+    def random_box(self, dimensions=3):
+        corners = list(zip(random_point(dimensions), random_point(dimensions)))
+        return ([min(c) for c in corners], [max(c) for c in corners])
+
+    def test_sizes(self, nodes=100):
+        for leaf_size in (1, 4):
+            points = list(islice(random_points(maxval=10), 0, nodes))
+            tree = kdtree.create(points[:nodes // 2], leaf_size=leaf_size)
+            self.assertSizes(tree)
+            for point in points[nodes // 2:]:
+                tree.add(point)
+            self.assertSizes(tree)
+
+            random.shuffle(points)
+            while points:
+                tree = tree.remove(points.pop())
+                self.assertSizes(tree)
+                self.assertEqual(tree.size, len(points))
+
+    def test_search_box(self, nodes=300):
+        points = list(islice(random_points(), 0, nodes))
+        for leaf_size in (1, 8):
+            tree = kdtree.create(points, leaf_size=leaf_size)
+            for _ in range(20):
+                lower, upper = self.random_box()
+                expected = [p for p in points
+                            if all(l <= x <= u
+                                   for l, x, u in zip(lower, p, upper))]
+                self.assertEqual(sorted(tree.search_box(lower, upper)),
+                                 sorted(expected))
+                self.assertEqual(tree.count_box(lower, upper), len(expected))
+
+    def test_count_box_stats(self, nodes=1000):
+        points = list(islice(random_points(dimensions=2), 0, nodes))
+        tree = kdtree.create(points)
+        stats = kdtree.SearchStats()
+        expected = len([p for p in points
+                        if all(10 <= x <= 90 for x in p)])
+        self.assertEqual(tree.count_box((10, 10), (90, 90), stats), expected)
+        self.assertTrue(stats.nodes_visited < nodes / 2)
+
+    def test_inclusive_bounds(self):
+        tree = kdtree.create([(1, 1), (2, 2), (3, 3)])
+        self.assertEqual(sorted(tree.search_box((1, 1), (2, 2))),
+                         [(1, 1), (2, 2)])
+        self.assertEqual(tree.count_box((2, 2), (2, 2)), 1)
+        self.assertEqual(kdtree.create(dimensions=2).count_box((0, 0), (1, 1)),
+                         0)
+
+
+class TombstoneTests(unittest.TestCase):
+    """ test lazy deletion with max_dead """
+
+    def test_remove(self, nodes=300):
+        for leaf_size in (1, 4):
+            points = list(islice(random_points(), 0, nodes))
+            tree = kdtree.create(points, leaf_size=leaf_size, max_dead=0.5)
+            random.shuffle(points)
+            removed, points = points[:nodes // 3], points[nodes // 3:]
+            for point in removed:
+                self.assertIs(tree.remove(point), tree)
+
+            self.assertEqual(tree.size, len(points))
+            self.assertAlmostEqual(tree.dead_ratio, 1 / 3.)
+            self.assertEqual(tree.dead_size, len(removed))
+            self.assertEqual(sorted(n.data for n in tree.live_nodes()),
+                             sorted(points))
+            self.check_counts(tree)
+
+            for _ in range(20):
+                point = random_point()
+                dists = sorted(sum((a - b) ** 2 for a, b in zip(p, point))
+                               for p in points)
+                result = tree.search_knn(point, 5)
+                self.assertEqual([d for _, d in result], dists[:5])
+                self.assertFalse(any(node.dead for node, _ in result))
+                nearest = islice(tree.iter_nearest(point), 5)
+                self.assertEqual([d for _, d in nearest], dists[:5])
+                self.assertEqual(len(tree.search_nn_dist(point, 400)),
+                                 sum(d < 400 for d in dists))
+
+            self.assertEqual(sorted(tree.search_box((0, 0, 0), (50, 50, 50))),
+                             sorted(p for p in points if max(p) <= 50))
+            self.assertEqual(tree.count_box((0, 0, 0), (100, 100, 100)),
+                             len(points))
+
+    def check_counts(self, tree):
+        """ the counts of every subtree match its nodes """
+        for node in tree.preorder():
+            dead = sum(n.dead for n in node.preorder())
+            self.assertEqual(node.size,
+                             sum(not n.dead for n in node.preorder()))
+            self.assertEqual(node.dead_size, dead)
+            if dead:
+                self.assertAlmostEqual(node.dead_ratio,
+                                       dead / float(node.size + dead))
+
+    def test_updates_with_dead_nodes(self, nodes=300):
+        """ rebuilding subtrees with dead nodes updates the counts """
+        for leaf_size in (1, 4):
+            points = list(islice(random_points(), 0, nodes))
+            tree = kdtree.create(points, leaf_size=leaf_size, alpha=0.6,
+                                 max_dead=0.5)
+            for point in points[:nodes // 3]:
+                tree = tree.remove(point)
+            self.check_counts(tree)
+
+            # a cluster of points unbalances subtrees with dead nodes
+            for i in range(50):
+                tree.add((i / 100., i / 100., i / 100.))
+            self.check_counts(tree)
+
+            tree = tree.add_many([(i, 100 - i, i) for i in range(100)])
+            self.check_counts(tree)
+
+            tree = tree.remove_many(points[nodes // 3:nodes // 2])
+            self.check_counts(tree)
+            self.assertTrue(tree.is_valid())
+
+    def test_compact(self, nodes=300):
+        points = list(islice(random_points(), 0, nodes))
+        tree = kdtree.create(points, max_dead=0.25)
+        random.shuffle(points)
+        ratios = []
+        while points:
+            tree = tree.remove(points.pop())
+            ratios.append(tree.dead_ratio)
+            self.assertLessEqual(tree.dead_ratio, 0.25)
+            self.assertEqual(tree.size, len(points))
+
+        # the ratio drops to 0 whenever the tree is compacted
+        self.assertIn(0.0, ratios[1:])
+        self.assertEqual(len(list(tree.inorder())), 0)
+
+        tree.add((1, 2, 3))
+        self.assertEqual(tree.search_nn((0, 0, 0))[0].data, (1, 2, 3))
+
+    def test_freeze(self, nodes=100):
+        points = list(islice(random_points(), 0, nodes))
+        tree = kdtree.create(points, max_dead=0.5)
+        for point in points[:10]:
+            tree.remove(point)
+
+        with tree.freeze() as frozen:
+            self.assertEqual(len(frozen), nodes - 10)
+
+    def test_freeze_keeps_tree(self, nodes=100):
+        points = list(islice(random_points(), 0, nodes))
+        tree = kdtree.create(points, sel_axis=lambda axis: (axis + 2) % 3,
+                             max_dead=0.5, cache_size=10)
+        for point in points[:10]:
+            tree = tree.remove(point)
+        tree.search_nn(points[-1])
+        config, nodes = tree.config, list(tree.preorder())
+        version = tree.version
+
+        with tree.freeze() as frozen:
+            self.assertEqual(frozen.search_nn(points[-1])[1], 0)
+
+        self.assertIs(tree.config, config)
+        self.assertEqual(tree.dead_size, 10)
+        self.assertEqual(list(tree.preorder()), nodes)
+        self.assertEqual(tree.version, version)
+        self.assertEqual(tree.search_nn(points[-1])[1], 0)
+        self.assertEqual(tree.config.cache.hits, 1)
+
+    def test_compact_payload(self, nodes=300):
+        # compacting relinks the live nodes, which keep their payloads
+        points = list(islice(random_points(), 0, nodes))
+        tree = kdtree.create(points, max_dead=0.25)
+        for node in tree.preorder():
+            node.payload = node.data
+
+        random.shuffle(points)
+        for point in points[:nodes // 2]:
+            tree = tree.remove(point)
+
+        self.assertEqual(tree.size, nodes - nodes // 2)
+        self.assertTrue(all(n.payload == n.data for n in tree.preorder()))
+
+
+class BatchTests(unittest.TestCase):
+    """ test add_many() and remove_many() """
+
+    def assertTree(self, tree, points):
+        self.assertTrue(tree.is_valid())
+        self.assertEqual(sorted(n.data for n in tree.preorder()
+                                if not n.dead), sorted(points))
+        for node in tree.preorder():
+            self.assertEqual(node.size,
+                             sum(not n.dead for n in node.preorder()))
+
+    def test_add_many(self, nodes=500):
+        for leaf_size in (1, 4):
+            points = sorted(islice(random_points(), 0, nodes))
+            tree = kdtree.create(dimensions=3, leaf_size=leaf_size)
+            for i in range(0, nodes, 100):
+                tree = tree.add_many(points[i:i + 100])
+                self.assertTree(tree, points[:i + 100])
+
+            # sorted batches would make a chain of nodes with add()
+            self.assertLess(tree.height(), 20)
+
+    def test_add_many_payload(self, nodes=500):
+        # rebuilt subtrees keep the payloads of their nodes
+        for leaf_size in (1, 4):
+            points = sorted(islice(random_points(), 0, nodes))
+            tree = kdtree.create(dimensions=3, leaf_size=leaf_size)
+            for i in range(0, nodes, 50):
+                tree = tree.add_many(points[i:i + 50])
+                for node in tree.preorder():
+                    if not hasattr(node, 'payload'):
+                        node.payload = node.data
+                self.assertTrue(all(n.payload == n.data
+                                    for n in tree.preorder()))
+
+    def test_add_many_dimensions(self):
+        tree = kdtree.create([(1, 2)])
+        self.assertRaises(ValueError, tree.add_many, [(1, 2), (1, 2, 3)])
+        self.assertTree(tree, [(1, 2)])
+
+    def test_remove_many(self, nodes=500):
+        for max_dead in (None, 0.5):
+            points = list(islice(random_points(maxval=10), 0, nodes))
+            tree = kdtree.create(points, max_dead=max_dead)
+            random.shuffle(points)
+
+            # duplicates are removed once per occurrence in the batch
+            removed = points[:nodes // 2] + [points[0], (-1, -1, -1)]
+            tree = tree.remove_many(removed)
+            remaining = points[nodes // 2:]
+            if points[0] in remaining:
+                remaining.remove(points[0])
+            self.assertTree(tree, remaining)
+
+            tree = tree.remove_many(remaining)
+            self.assertTree(tree, [])
+            self.assertEqual(tree.size, 0)
+
+
+class TreeStatsTests(unittest.TestCase):
+    """ test the shape reports of trees and rebuilding by max_cost """
+
+    def test_balanced(self, nodes=1000):
+        points = list(islice(random_points(), 0, nodes))
+        for leaf_size in (1, 4):
+            tree = kdtree.create(points, leaf_size=leaf_size)
+            stats = tree.stats()
+            self.assertEqual(stats.size, nodes)
+            self.assertEqual(stats.max_leaf_depth, tree.height() - 1)
+            self.assertEqual(len(stats.depths), tree.height())
+            self.assertEqual(sum(stats.splits),
+                             sum(stats.depths) - stats.leaves)
+            self.assertLessEqual(stats.imbalance, 0.5)
+            self.assertEqual(stats.cost, 1.0)
+            self.assertEqual(stats.as_dict()['leaves'], stats.leaves)
+
+    def test_degenerate(self, nodes=100):
+        tree = kdtree.create(dimensions=2)
+        for i in range(nodes):
+            tree.add((i, i))
+        tree = tree.remove((0, 0))
+
+        stats = tree.stats()
+        self.assertEqual(stats.depths, [1] * (nodes - 1))
+        self.assertEqual((stats.leaves, stats.max_leaf_depth), (1, nodes - 2))
+        self.assertEqual(stats.splits, [(nodes - 1) // 2, (nodes - 2) // 2])
+        self.assertGreater(stats.imbalance, 0.95)
+        self.assertGreater(stats.cost, 5)
+
+    def test_max_cost(self, nodes=1000):
+        points = [(i, i % 7, 0) for i in range(nodes)]
+        tree = kdtree.create(dimensions=3, max_cost=1.5)
+        for point in points:
+            self.assertIs(tree.add(point).data, point)
+
+        self.assertTrue(tree.is_valid())
+        self.assertEqual(sorted(n.data for n in tree.inorder()), points)
+        self.assertLess(tree.stats().cost, 3)
+        self.assertLess(tree.height(), 150)
+
+        for point in points[:nodes // 2]:
+            tree = tree.remove(point)
+        self.assertEqual(tree.size, nodes // 2)
+        self.assertLess(tree.stats().cost, 3)
+
+        self.assertRaises(ValueError, kdtree.create, points, max_cost=1)
+
+    def test_max_cost_payload(self, nodes=2000):
+        points = [(i, i % 7, 0) for i in range(nodes)]
+        tree = kdtree.create(dimensions=3, max_cost=1.2)
+        added = []
+        for point in points:
+            node = tree.add(point)
+            node.payload = point
+            added.append(node)
+
+        self.assertTrue(all(n.payload == n.data for n in tree.preorder()))
+        for node in added[::2]:
+            tree = tree.remove(node.data, node=node)
+        self.assertEqual(sorted(n.data for n in tree.inorder()), points[1::2])
+        self.assertTrue(all(n.payload == n.data for n in tree.preorder()))
+
+    def test_max_cost_max_dead(self, nodes=1000):
+        points = [(i, i % 7, 0) for i in range(nodes)]
+        tree = kdtree.create(dimensions=3, max_cost=1.5, max_dead=0.25)
+        for point in points:
+            tree.add(point)
+
+        # lazy removals count towards the next check of the cost
+        updates = tree.config.updates
+        for point in points[:10]:
+            tree = tree.remove(point)
+        self.assertEqual(tree.config.updates, updates + 10)
+
+        for point in points[10:nodes // 2]:
+            tree = tree.remove(point)
+        self.assertEqual(tree.size, nodes // 2)
+        self.assertLessEqual(tree.dead_ratio, 0.25)
+        for node in tree.preorder():
+            self.assertEqual(node.dead_size,
+                             sum(n.dead for n in node.preorder()))
+        self.assertTrue(tree.is_valid())
+        self.assertLess(tree.stats().cost, 3)
+
+
+class QueryCacheTests(unittest.TestCase):
+    """ test that cached search results are reused until the tree changes """
+
+    def test_hits(self, nodes=100):
+        points = list(islice(random_points(), 0, nodes))
+        tree = kdtree.create(points, cache_size=10)
+        cache = tree.config.cache
+        point = random_point()
+
+        result = tree.search_knn(point, 5)
+        self.assertEqual(tree.search_knn(list(point), 5), result)
+        self.assertEqual(tree.search_nn(point), result[0])
+        self.assertEqual(tree.search_nn(point), result[0])
+        within = tree.search_nn_dist(point, 500)
+        self.assertEqual(tree.search_nn_dist(point, 500), within)
+        self.assertEqual((cache.hits, cache.misses), (3, 3))
+        self.assertEqual(cache.hit_rate, 0.5)
+
+    def test_invalidation(self, nodes=100):
+        points = list(islice(random_points(), 0, nodes))
+        tree = kdtree.create(points, cache_size=10)
+        point = random_point()
+
+        tree.search_nn(point)
+        tree.add(point)
+        self.assertEqual(tree.search_nn(point)[1], 0)
+        tree = tree.remove(point)
+        self.assertNotEqual(tree.search_nn(point)[0].data, point)
+        tree = tree.add_many([point])
+        self.assertEqual(tree.search_nn_dist(point, 0.5), [point])
+        tree = tree.remove_many([point])
+        self.assertEqual(tree.search_nn_dist(point, 0.5), [])
+
+        version = tree.version
+        tree = tree.rebalance()
+        self.assertGreater(tree.version, version)
+        self.assertEqual(tree.config.cache.hits, 0)
+
+    def test_changes_drop_results(self, nodes=100):
+        """ changes drop the results, which refer to nodes of old trees """
+        points = list(islice(random_points(), 0, nodes))
+        tree = kdtree.create(points, cache_size=10, max_dead=0.5)
+        cache = tree.config.cache
+        point = random_point()
+
+        for update in (lambda tree: tree.rebalance(),
+                       lambda tree: tree.compact(),
+                       lambda tree: tree.remove(points[0]),
+                       lambda tree: tree.add_many(points[:1])):
+            tree.search_knn(point, 5)
+            tree.search_knn(point, 5)
+            self.assertEqual(len(cache), 1)
+            tree = update(tree)
+            self.assertEqual(len(cache), 0)
+            self.assertIs(tree.config.cache, cache)
+        self.assertEqual((cache.hits, cache.misses), (4, 4))
+
+    def test_lru(self, nodes=100):
+        points = list(islice(random_points(), 0, nodes))
+        tree = kdtree.create(points, cache_size=2)
+        cache = tree.config.cache
+        a, b, c = points[:3]
+
+        tree.search_nn(a)
+        tree.search_nn(b)
+        tree.search_nn(a)
+        tree.search_nn(c)
+        self.assertEqual(len(cache), 2)
+        tree.search_nn(a)
+        tree.search_nn(b)
+        self.assertEqual((cache.hits, cache.misses), (2, 4))
+
+        self.assertRaises(ValueError, kdtree.create, points, cache_size=0)
+
+
+class KDForestTests(unittest.TestCase):
+    """ test the forest of trees built with the logarithmic method """
+
+    def assertTrees(self, forest, removed=False):
+        sizes = [tree.size if tree is not None else 0
+                 for tree in forest.trees]
+        self.assertEqual(sum(sizes), len(forest))
+        for i, tree in enumerate(forest.trees):
+            if removed:
+                # dead nodes are dropped when their tree is merged
+                self.assertLessEqual(tree.size + tree.dead_size if tree
+                                     else 0, 2 ** i)
+            else:
+                self.assertIn(sizes[i], (0, 2 ** i))
+        for tree in forest.trees:
+            if tree is not None:
+                self.assertTrue(tree.is_valid())
+                self.assertTrue(tree.is_balanced)
+
+    def test_add(self, nodes=300):
+        points = list(islice(random_points(), 0, nodes))
+        forest = kdtree.KDForest(points[:nodes // 3])
+        self.assertTrees(forest)
+        added = [forest.add(point) for point in points[nodes // 3:]]
+        self.assertTrees(forest)
+
+        # merging trees relinks the existing nodes
+        preorder = [n for t in forest.trees if t is not None
+                    for n in t.preorder()]
+        for node in added:
+            self.assertTrue(any(node is n for n in preorder))
+        self.assertEqual(sorted(n.data for n in preorder), sorted(points))
+
+    def test_search(self, nodes=300):
+        points = list(islice(random_points(), 0, nodes))
+        forest = kdtree.KDForest(dimensions=3, leaf_size=4)
+        for point in points:
+            forest.add(point)
+
+        for _ in range(20):
+            point = random_point()
+            dists = sorted(sum((a - b) ** 2 for a, b in zip(p, point))
+                           for p in points)
+            result = forest.search_knn(point, 5)
+            self.assertEqual([d for _, d in result], dists[:5])
+            self.assertEqual(forest.search_nn(point)[1], dists[0])
+            self.assertEqual(len(forest.search_nn_dist(point, 400)),
+                             sum(d < 400 for d in dists))
+
+    def test_remove(self, nodes=300):
+        points = list(islice(random_points(), 0, nodes))
+        forest = kdtree.KDForest(points[:nodes // 3], leaf_size=4)
+        for point in points[nodes // 3:]:
+            forest.add(point)
+
+        random.shuffle(points)
+        for point in points[:nodes // 3]:
+            node = forest.remove(point)
+            self.assertEqual(node.data, point)
+            self.assertTrue(node.dead)
+        points = points[nodes // 3:]
+        self.assertEqual(len(forest), len(points))
+        self.assertTrees(forest, removed=True)
+        self.assertIsNone(forest.remove((-1, -1, -1)))
+        self.assertIsNone(forest.remove(points[0], kdtree.KDNode()))
+
+        for _ in range(20):
+            point = random_point()
+            dists = sorted(sum((a - b) ** 2 for a, b in zip(p, point))
+                           for p in points)
+            result = forest.search_knn(point, 5)
+            self.assertEqual([d for _, d in result], dists[:5])
+            self.assertEqual(len(forest.search_nn_dist(point, 400)),
+                             sum(d < 400 for d in dists))
+
+        # merging drops dead nodes
+        for point in islice(random_points(), 0, 10):
+            forest.add(point)
+            points.append(point)
+        self.assertTrees(forest, removed=True)
+
+        # the forest is rebuilt once half of its nodes are dead
+        while len(points) > nodes // 4:
+            forest.remove(points.pop())
+            dead = sum(t.dead_size for t in forest.trees if t)
+            self.assertLessEqual(dead, len(forest))
+        self.assertTrees(forest, removed=True)
+        self.assertEqual(sorted(n.data for t in forest.trees if t
+                                for n in t.live_nodes()), sorted(points))
+
+    @unittest.skipIf(kdtree.np is None, 'numpy is not installed')
+    def test_array(self, nodes=100):
+        points = kdtree.np.random.random((nodes, 3))
+        forest = kdtree.KDForest(points)
+        self.assertEqual(len(forest), nodes)
+        self.assertEqual(forest.search_nn(points[0])[1], 0)
+
+    def test_empty(self):
+        forest = kdtree.KDForest(dimensions=2)
+        self.assertEqual(len(forest), 0)
+        self.assertIsNone(forest.search_nn((1, 2)))
+        self.assertRaises(ValueError, kdtree.KDForest)
+
+
+@unittest.skipIf(kdtree.np is None, 'numpy is not installed')
+class FlatKDTreeTests(unittest.TestCase):
+    """ test the array-backed tree against brute force """
+
+    def brute_knn(self, points, point, k):
+        dists = [(sum((a - b) ** 2 for a, b in zip(p, point)), p)
+                 for p in points]
+        return sorted(d for d, _ in dists)[:k]
+
+    def test_search_knn(self, nodes=500):
+        points = list(islice(random_points(), 0, nodes))
+        tree = kdtree.FlatKDTree(points, leaf_size=4)
+        self.assertEqual(len(tree), nodes)
+
+        for _ in range(20):
+            point = random_point()
+            result = tree.search_knn(point, 5)
+            self.assertEqual([d for _, d in result],
+                             self.brute_knn(points, point, 5))
+            for row, d in result:
+                self.assertEqual(tree.data[row].tolist(),
+                                 list(points[row]))
+
+    def test_search_knn_approximate(self, nodes=500, eps=1):
+        points = list(islice(random_points(), 0, nodes))
+        tree = kdtree.FlatKDTree(points, leaf_size=4)
+
+        for _ in range(20):
+            point = random_point()
+            expected = self.brute_knn(points, point, 5)
+            self.assertTrue(tree.search_knn(point, 5).exact)
+            result = tree.search_knn(point, 5, eps=eps)
+            for (_, d), best in zip(result, expected):
+                self.assertTrue(d <= best * (1 + eps) ** 2)
+
+        result = tree.search_knn(random_point(), 5, max_leaves=1)
+        self.assertTrue(0 < len(result) <= 5)
+        self.assertFalse(result.exact)
+
+    def test_search_knn_batch(self, nodes=500):
+        points = list(islice(random_points(), 0, nodes))
+        tree = kdtree.FlatKDTree(points, leaf_size=4)
+        queries = list(islice(random_points(), 0, 50))
+
+        rows, dists = tree.search_knn_batch(queries, 5)
+        self.assertEqual(rows.shape, (50, 5))
+        for query, query_rows, query_dists in zip(queries, rows, dists):
+            expected = tree.search_knn(query, 5)
+            self.assertEqual(query_dists.tolist(), [d for _, d in expected])
+            for row, d in zip(query_rows, query_dists):
+                self.assertEqual(self.brute_knn([tree.data[row]], query, 1), [d])
+
+    def test_search_knn_batch_small_tree(self):
+        tree = kdtree.FlatKDTree([(1, 2), (3, 4)])
+        rows, dists = tree.search_knn_batch([(0, 0)], 3)
+        self.assertEqual(rows.tolist(), [[0, 1, -1]])
+        self.assertEqual(dists.tolist(), [[5, 25, float('inf')]])
+
+    def test_search_nn_dist(self, nodes=500):
+        points = list(islice(random_points(), 0, nodes))
+        tree = kdtree.FlatKDTree(points, leaf_size=4)
+        point = random_point()
+
+        for distance in (0.5, 10, 300, 1000):
+            rows = tree.search_nn_dist(point, distance)
+            expected = [i for i, p in enumerate(points)
+                        if sum((a - b) ** 2 for a, b in zip(p, point)) < distance]
+            self.assertEqual(sorted(rows), expected)
+
+    def test_add_remove(self, nodes=300):
+        points = list(islice(random_points(), 0, nodes))
+        tree = kdtree.FlatKDTree(dimensions=3, leaf_size=4)
+        for point in points:
+            tree.add(point)
+        self.assertEqual(len(tree), nodes)
+
+        point = random_point()
+        nn, dist = tree.search_nn(point)
+        self.assertEqual(dist, self.brute_knn(points, point, 1)[0])
+
+        random.shuffle(points)
+        while points:
+            point = points.pop()
+            tree = tree.remove(point)
+            self.assertEqual(len(tree), len(points))
+            self.assertEqual(len(tree.indices()), len(points))
+
+        self.assertEqual(tree.search_nn((1, 2, 3)), None)
+
+    def test_remove_duplicates(self):
+        tree = kdtree.FlatKDTree([(1, 1)] * 100, leaf_size=3)
+        for n in range(99, -1, -1):
+            tree.remove((1, 1))
+            self.assertEqual(len(tree.indices()), n)
+
+    def test_different_dimensions(self):
+        self.assertRaises(ValueError, kdtree.FlatKDTree)
+        tree = kdtree.FlatKDTree([(1, 2), (3, 4)])
+        self.assertRaises(ValueError, tree.add, (1, 2, 3))
+
+
+class FrozenKDTreeTests(unittest.TestCase):
+    """ test read-only trees in a flat buffer """
+
+    def brute_dists(self, points, point):
+        return sorted(sum((a - b) ** 2 for a, b in zip(p, point))
+                      for p in points)
+
+    def test_search(self, nodes=300):
+        for leaf_size in (1, 8):
+            points = list(islice(random_points(), 0, nodes))
+            tree = kdtree.create(points, leaf_size=leaf_size)
+            frozen = tree.freeze()
+            self.assertEqual(len(frozen), nodes)
+            self.assertEqual([frozen.point(row) for row in range(nodes)],
+                             [n.data for n in tree.preorder()])
+
+            for _ in range(20):
+                point = random_point()
+                self.assertEqual([d for _, d in frozen.search_knn(point, 5)],
+                                 [d for _, d in tree.search_knn(point, 5)])
+                self.assertEqual(frozen.search_nn(point)[1],
+                                 self.brute_dists(points, point)[0])
+
+                rows = frozen.search_nn_dist(point, 200)
+                self.assertEqual(
+                    sorted(frozen.point(row) for row in rows),
+                    sorted(p for p in points
+                           if self.brute_dists([p], point)[0] < 200))
+
+    def test_empty(self):
+        frozen = kdtree.create(dimensions=2).freeze()
+        self.assertEqual(len(frozen), 0)
+        self.assertEqual(frozen.search_knn((1, 2), 3), [])
+        self.assertEqual(frozen.search_nn_dist((1, 2), 3), [])
+
+    def test_invalid_buffer(self):
+        buf = bytearray(kdtree.create([(1, 2)]).freeze()._views[0])
+        self.assertEqual(kdtree.FrozenKDTree(buf).point(0), (1, 2))
+        self.assertRaises(ValueError, kdtree.FrozenKDTree, buf[:-1])
+        self.assertRaises(ValueError, kdtree.FrozenKDTree, b'x' * 100)
+
+    def test_save_load(self, nodes=300):
+        import os
+        import tempfile
+
+        points = list(islice(random_points(), 0, nodes))
+        tree = kdtree.create(points, leaf_size=4)
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            tree.save(path)
+            for mmap in (True, False):
+                with kdtree.load(path, mmap=mmap) as loaded:
+                    self.assertEqual(len(loaded), nodes)
+                    self.assertEqual(
+                        [loaded.point(row) for row in range(nodes)],
+                        [n.data for n in tree.preorder()])
+                    point = random_point()
+                    self.assertEqual(
+                        [d for _, d in loaded.search_knn(point, 5)],
+                        [d for _, d in tree.search_knn(point, 5)])
+
+            with kdtree.load(path) as loaded:
+                loaded.save(path + '.copy')
+            with open(path, 'rb') as f, open(path + '.copy', 'rb') as copy:
+                self.assertEqual(f.read(), copy.read())
+        finally:
+            os.remove(path)
+            if os.path.exists(path + '.copy'):
+                os.remove(path + '.copy')
+
+    def test_load_invalid(self):
+        import os
+        import tempfile
+
+        data = bytearray(kdtree.create([(1, 2), (3, 4)]).freeze()._views[0])
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            for invalid in (data[:-1], b'XDTREE' + data[6:],
+                            data[:8] + b'\x63' + data[9:], b''):
+                with open(path, 'wb') as f:
+                    f.write(invalid)
+                for mmap in (True, False):
+                    self.assertRaises(ValueError, kdtree.load, path, mmap)
+        finally:
+            os.remove(path)
+
+    @unittest.skipIf(kdtree.shared_memory is None,
+                     'shared memory requires Python 3.8')
+    def test_shared_memory(self, nodes=300):
+        import multiprocessing
+
+        points = list(islice(random_points(), 0, nodes))
+        queries = list(islice(random_points(), 0, 10))
+        frozen = kdtree.create(points).freeze(shared=True)
+        try:
+            pool = multiprocessing.Pool(2)
+            try:
+                results = pool.map(search_frozen,
+                                   [(frozen.name, q) for q in queries])
+            finally:
+                pool.close()
+                pool.join()
+
+            for query, result in zip(queries, results):
+                self.assertEqual(result, [d for _, d in
+                                          frozen.search_knn(query, 3)])
+                self.assertEqual(result,
+                                 self.brute_dists(points, query)[:3])
+        finally:
+            frozen.close()
+            frozen.unlink()
+
+
+def search_frozen(args):
+    """ searches a shared FrozenKDTree from a worker process """
+    name, point = args
+    with kdtree.attach(name) as tree:
+        return [d for _, d in tree.search_knn(point, 3)]
+
+
 def random_tree(nodes=20, dimensions=3, minval=0, maxval=100):
     points = list(islice(random_points(), 0, nodes))
     tree = kdtree.create(points)